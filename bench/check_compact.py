@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""Check that compacting twice on the same day keeps every archived run.
+
+Usage: bench/check_compact.py [--rows 5k]
+
+Bootstraps a scratch database, fills it with synthetic history and runs
+`repty compact` on it. Then it adds a few runs older than the cutoff and
+compacts again on the same UTC day, and finally imports the first archive
+with `repty import`. Last it archives, adds an old run the way an import
+running alongside would, and collapses. Exits non-zero unless the new
+database uses write-ahead logging and incremental auto-vacuum, so
+compaction never needs a full VACUUM, the first archive is left as it
+was, the second run writes its own archive, the archives hold every run
+that left the commands table, importing an archive adds no runs and
+counts none of them twice, and the run added mid-compaction is kept.
+"""
+import os
+import sys
+import glob
+import gzip
+import shutil
+import sqlite3
+import argparse
+import time
+import tempfile
+import subprocess
+
+REPO_DIR = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(REPO_DIR, 'bench'))
+sys.path.insert(0, os.path.join(REPO_DIR, 'lib'))
+
+from generate_history import generate, parse_rows
+from repty.compact import archive, collapse, cutoff_epoch
+from repty.history import ensure_history_schema, record_commands
+
+KEEP_DAYS = 180
+
+def check(description, ok, detail=""):
+    print(f"{'ok  ' if ok else 'FAIL'} {description}" + (f" ({detail})" if detail else ""))
+    return ok
+
+def old_run(command, cutoff, offset=0):
+    """A commands row from a month before the cutoff"""
+    return (command, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(cutoff - 30 * 86400 + offset)),
+            "/srv/app", 0, "", "import", command)
+
+def count_commands(db_path):
+    conn = sqlite3.connect(db_path)
+    count = conn.execute("SELECT COUNT(*) FROM commands").fetchone()[0]
+    conn.close()
+    return count
+
+def count_runs(db_path):
+    """Runs counted in command_texts, compacted or not"""
+    conn = sqlite3.connect(db_path)
+    runs = conn.execute("SELECT COALESCE(SUM(run_count), 0) FROM command_texts").fetchone()[0]
+    conn.close()
+    return runs
+
+def archived(directory):
+    """Return {archive file name: runs in it}"""
+    counts = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.jsonl.gz"))):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            counts[os.path.basename(path)] = sum(1 for _ in f)
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Check repeated compaction")
+    parser.add_argument("--rows", default="5k", help="synthetic history size, e.g. 5k, 20k")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="repty-compact-")
+    db_path = os.path.join(scratch, ".repty.db")
+    directory = os.path.join(scratch, "archive")
+    env = dict(os.environ, HOME=scratch, REPTY_DB=db_path, REPTY_SKIP_PIP="1", REPTY_EMBED_EVERY="0",
+               REPTY_ARCHIVE_DIR=directory, PYTHONPATH=os.path.join(REPO_DIR, "lib"))
+    compact = [sys.executable, "-m", "repty.compact", "--keep-days", str(KEEP_DAYS), "--no-vacuum"]
+    try:
+        subprocess.run(["bash", os.path.join(REPO_DIR, "lib", "bootstrap.sh")], check=True, env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        conn = sqlite3.connect(db_path)
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        conn.close()
+        generate(db_path, parse_rows(args.rows))
+        total = count_commands(db_path)
+
+        subprocess.run(compact, check=True, env=env, stdout=subprocess.DEVNULL)
+        first = archived(directory)
+
+        # Old runs arriving after the first compaction
+        cutoff = cutoff_epoch(KEEP_DAYS)
+        conn = sqlite3.connect(db_path)
+        ensure_history_schema(conn)
+        with conn:
+            record_commands(conn, [old_run(f"echo imported {n}", cutoff, n) for n in range(2)])
+        conn.close()
+        total += 2
+
+        subprocess.run(compact, check=True, env=env, stdout=subprocess.DEVNULL)
+        second = archived(directory)
+        kept = count_commands(db_path)
+        runs = count_runs(db_path)
+
+        subprocess.run([sys.executable, "-m", "repty.importer", os.path.join(directory, min(first))],
+                       check=True, env=env, stdout=subprocess.DEVNULL)
+        imported = count_commands(db_path)
+        imported_runs = count_runs(db_path)
+
+        # An old run imported between the archive and the delete of a compaction
+        conn = sqlite3.connect(db_path)
+        with conn:
+            record_commands(conn, [old_run("echo before compaction", cutoff)])
+        last_id = conn.execute("SELECT MAX(id) FROM commands").fetchone()[0]
+        late_dir = os.path.join(scratch, "late")
+        os.makedirs(late_dir)
+        _, late_archived = archive(conn, late_dir, cutoff, last_id)
+        with conn:
+            record_commands(conn, [old_run("echo during compaction", cutoff)])
+        with conn:
+            late_collapsed = collapse(conn, cutoff, last_id)
+        late_kept = conn.execute("SELECT COUNT(*) FROM commands WHERE command = 'echo during compaction'").fetchone()[0]
+        conn.close()
+
+        passed = check("new database in WAL mode", journal_mode == "wal", journal_mode)
+        passed &= check("new database uses incremental auto-vacuum", auto_vacuum == 2, f"auto_vacuum = {auto_vacuum}")
+        passed &= check("first compaction wrote an archive", len(first) == 1 and sum(first.values()) > 0,
+                       f"{sum(first.values())} runs")
+        passed &= check("first archive left as it was",
+                        all(second.get(name) == count for name, count in first.items()))
+        passed &= check("second compaction wrote its own archive", len(second) == 2,
+                        ", ".join(f"{name}: {count}" for name, count in second.items()))
+        passed &= check("every compacted run is archived", sum(second.values()) == total - kept,
+                        f"{sum(second.values())} archived, {total - kept} compacted")
+        passed &= check("importing an archive adds no runs", imported == kept, f"{imported - kept} added")
+        passed &= check("importing an archive leaves the run counts", imported_runs == runs,
+                        f"{imported_runs - runs} counted twice")
+        passed &= check("a run added mid-compaction is kept for the next one",
+                        late_kept == 1 and late_collapsed == late_archived,
+                        f"{late_archived} archived, {late_collapsed} collapsed")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Check that time and context filters are index lookups, not table scans.
+
+Usage: bench/check_query_plans.py
+
+Bootstraps a scratch database, fills it with synthetic history, and asks
+nlp_search.sh and export.sh for the EXPLAIN QUERY PLAN of their filter
+queries (REPTY_EXPLAIN=1), plus the cwd, git project and session lookups
+the filters use. Exits non-zero when a plan scans the commands
+table or misses the expected index.
+"""
+import os
+import sys
+import random
+import shutil
+import sqlite3
+import tempfile
+import subprocess
+import time
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, os.path.join(REPO_DIR, 'lib'))
+
+from repty.history import ensure_history_schema, record_commands
+
+# (description, script arguments, index the plan must use)
+SCRIPT_QUERIES = [
+    ("nlp yesterday", ["nlp_search.sh", "what did I run yesterday"], "commands_ts"),
+    ("nlp today", ["nlp_search.sh", "commands from today"], "commands_ts"),
+    ("nlp last week", ["nlp_search.sh", "commands in the last week"], "commands_ts"),
+    ("nlp failed", ["nlp_search.sh", "commands that failed"], "commands_exit_code_ts"),
+    ("nlp cwd", ["nlp_search.sh", "git commit in /srv/project3 last week"], "commands_cwd_ts"),
+    ("nlp project", ["nlp_search.sh", "git commit in project project3 yesterday"], "commands_git_project_ts"),
+    ("export", ["export.sh"], "commands_ts"),
+    ("export since", ["export.sh", "--format", "jsonl", "--since", "2024-01-01"], "commands_ts"),
+    ("export project", ["export.sh", "--project", "project3"], "commands_git_project_ts"),
+]
+
+# (description, SQL, index the plan must use)
+CONTEXT_QUERIES = [
+    ("cwd", "SELECT command FROM commands WHERE cwd = '/srv/app' ORDER BY ts DESC LIMIT 7",
+     "commands_cwd_ts"),
+    ("cwd and time", "SELECT command FROM commands WHERE cwd = '/srv/app' AND ts >= 1700000000",
+     "commands_cwd_ts"),
+    ("git project", "SELECT command FROM commands WHERE git_project = 'repty' ORDER BY ts DESC LIMIT 7",
+     "commands_git_project_ts"),
+    ("session", "SELECT command FROM commands WHERE session_id = 'session-1' ORDER BY ts DESC LIMIT 7",
+     "commands_session_ts"),
+    ("exit code and time", "SELECT command FROM commands WHERE exit_code = 127 AND ts >= 1700000000",
+     "commands_exit_code_ts"),
+]
+
+def fill(db_path, rows=20000, seed=0):
+    """Add synthetic executions spread over the last year"""
+    rng = random.Random(seed)
+    now = int(time.time())
+    conn = sqlite3.connect(db_path)
+    ensure_history_schema(conn)
+    batch = []
+    for _ in range(rows):
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now - rng.randrange(365 * 86400)))
+        batch.append((f"git commit -m 'change {rng.randrange(2000)}'", timestamp,
+                      f"/srv/project{rng.randrange(40)}", rng.choice([0] * 9 + [1, 127]),
+                      f"project{rng.randrange(10)}", f"session-{rng.randrange(300)}", "git commit change"))
+    with conn:
+        record_commands(conn, batch)
+    conn.close()
+
+def check_plan(description, plan, index):
+    """Print the verdict for one plan and return whether it passed"""
+    scans = [line for line in plan.splitlines() if "SCAN commands" in line]
+    ok = index in plan and not scans
+    print(f"{'ok  ' if ok else 'FAIL'} {description:<20} {index}")
+    if not ok:
+        print("     " + plan.strip().replace("\n", "\n     "))
+    return ok
+
+def main():
+    scratch = tempfile.mkdtemp()
+    env = dict(os.environ, HOME=scratch, REPTY_SKIP_PIP="1", REPTY_EXPLAIN="1")
+    env.pop("REPTY_DB", None)
+    db_path = os.path.join(scratch, ".repty.db")
+    try:
+        subprocess.run(["bash", os.path.join(REPO_DIR, "lib", "bootstrap.sh")], env=env,
+                       stdout=subprocess.DEVNULL, check=True)
+        fill(db_path)
+
+        passed = True
+        for description, args, index in SCRIPT_QUERIES:
+            result = subprocess.run(["bash", os.path.join(REPO_DIR, "lib", args[0])] + args[1:],
+                                    env=env, stdin=subprocess.DEVNULL, capture_output=True, text=True,
+                                    errors="replace")
+            plan = result.stdout[result.stdout.find("QUERY PLAN"):] if "QUERY PLAN" in result.stdout else ""
+            passed &= check_plan(description, plan, index)
+
+        conn = sqlite3.connect(db_path)
+        for description, sql, index in CONTEXT_QUERIES:
+            plan = "\n".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql))
+            passed &= check_plan(description, plan, index)
+        conn.close()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
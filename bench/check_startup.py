@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Check that a cold `repty nlp` search starts within its time budget.
+
+Usage: bench/check_startup.py [--rows 20k] [--runs 5] [--budget-ms 500]
+
+Bootstraps a scratch database, fills it with synthetic history and builds
+the search indexes with one search. Then each backend chain `repty nlp`
+uses is started as a fresh process --runs times, with the query cache
+off, and must finish within the budget (median wall time, REPTY_STARTUP_BUDGET_MS by default). Each chain
+is also run once under -X importtime to make sure it leaves alone the
+libraries it does not need: the keyword backend must not import NumPy, and
+searching an existing TF-IDF index must not import scikit-learn. The
+slowest imports are listed when a chain is over budget.
+"""
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+import statistics
+import time
+
+REPO_DIR = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(REPO_DIR, 'bench'))
+
+from generate_history import parse_rows
+
+LIB = os.path.join(REPO_DIR, "lib")
+QUERY = "start the redis container with docker"
+
+# (description, backends, top-level packages that must not be imported,
+# required package)
+CHAINS = [
+    ("keyword", "keyword", ("numpy", "scipy", "sklearn", "sentence_transformers", "torch"), None),
+    ("semantic tf-idf", "semantic", ("sklearn", "sentence_transformers", "torch"), "sklearn"),
+    ("full chain", "daemon,semantic,keyword", ("sentence_transformers", "torch"), None),
+]
+
+def have_module(name):
+    import importlib.util
+    return importlib.util.find_spec(name) is not None
+
+def search_args(backends, *python_flags):
+    return [sys.executable, *python_flags, "-m", "repty.search", "--backends", backends, QUERY]
+
+def imported(stderr):
+    """Return {module: cumulative microseconds} from -X importtime output"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+def check_chain(description, backends, forbidden, runs, budget_ms, env):
+    """Time one chain and check its imports, returning whether it passed"""
+    walls = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(search_args(backends), env=env, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+        walls.append((time.perf_counter() - start) * 1000)
+        if result.returncode != 0:
+            print(f"FAIL {description:<16} exit status {result.returncode}")
+            return False
+    median = statistics.median(walls)
+
+    result = subprocess.run(search_args(backends, "-X", "importtime"), env=env, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, text=True, errors="replace")
+    modules = imported(result.stderr)
+    unwanted = sorted({name.split(".")[0] for name in modules} & set(forbidden))
+
+    ok = median <= budget_ms and not unwanted
+    print(f"{'ok  ' if ok else 'FAIL'} {description:<16} {median:>7.1f} ms (budget {budget_ms} ms)"
+          + (f", imported {', '.join(unwanted)}" if unwanted else ""))
+    if median > budget_ms:
+        top_level = {name: us for name, us in modules.items() if "." not in name}
+        for name, us in sorted(top_level.items(), key=lambda item: -item[1])[:8]:
+            print(f"     {us / 1000:>7.1f} ms  import {name}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the cold start time of repty searches")
+    parser.add_argument("--rows", type=parse_rows, default=parse_rows("20k"), help="history size (default 20k)")
+    parser.add_argument("--runs", type=int, default=5, help="timed runs per chain; the median counts")
+    parser.add_argument("--budget-ms", type=float, default=float(os.environ.get("REPTY_STARTUP_BUDGET_MS", "500")),
+                        help="median wall time allowed per search (default $REPTY_STARTUP_BUDGET_MS or 500)")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="repty-startup-")
+    db_path = os.path.join(scratch, ".repty.db")
+    env = dict(os.environ, HOME=scratch, REPTY_DB=db_path, REPTY_SOCKET=os.path.join(scratch, ".repty.sock"),
+               REPTY_SKIP_PIP="1", PYTHONPATH=LIB)
+    env.pop("REPTY_TRACE", None)
+    # Time the full search rather than the query cache, with no embedding
+    # worker competing for the CPU
+    env["REPTY_QUERY_CACHE_SIZE"] = "0"
+    env["REPTY_EMBED_EVERY"] = "0"
+    try:
+        subprocess.run(["bash", os.path.join(LIB, "bootstrap.sh")], env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        subprocess.run([sys.executable, os.path.join(REPO_DIR, "bench", "generate_history.py"), str(args.rows)],
+                       env=env, check=True, stdout=subprocess.DEVNULL)
+        # Build the indexes, so only the query path is timed
+        subprocess.run(search_args("semantic,keyword"), env=env, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+
+        failed = 0
+        for description, backends, forbidden, requirement in CHAINS:
+            if requirement and not have_module(requirement):
+                print(f"skip {description:<16} {requirement} not installed")
+                continue
+            if not check_chain(description, backends, forbidden, args.runs, args.budget_ms, env):
+                failed += 1
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    if failed:
+        print(f"{failed} search chain(s) over budget or importing too much", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Compare the encodings text_embeddings can store vectors in.
+
+Usage: bench/embedding_storage.py [--rows 100k] [--dim 384] [--queries 200]
+
+Fills a scratch history with bench/generate_history.py and embeds its
+command texts with sentence-transformers or, without it, a --dim wide LSA
+projection of their TF-IDF vectors standing in for a model. The vectors are
+written to their own text_embeddings table once per encoding
+(repty.quantize), and for each the table reports:
+
+    db        bytes the rows take in the database
+    load      seconds to read and decode every row into the memory-mapped
+              store the search maps
+    store     bytes of that store
+    first     milliseconds of the first search of the freshly opened store,
+              which upcasts float16 rows once
+    query     milliseconds per brute-force top-10 search after that
+    recall    top-10 overlap with float32, using stored vectors as queries
+
+Needs scikit-learn.
+"""
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+REPO_DIR = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(REPO_DIR, 'bench'))
+sys.path.insert(0, os.path.join(REPO_DIR, 'lib'))
+
+from generate_history import generate, parse_rows
+from repty.embedding_store import EmbeddingStore, top_k
+from repty.embeddings import embedding_text, ensure_embedding_schema
+from repty.quantize import encode
+
+K = 10
+
+def embed_texts(texts, dim):
+    """Return (dense matrix, name of the model)"""
+    try:
+        from sentence_transformers import SentenceTransformer
+        from repty.embeddings import MODEL_NAME
+        model = SentenceTransformer(MODEL_NAME, device="cpu")
+        return np.asarray(model.encode(texts), dtype=np.float32), MODEL_NAME
+    except ImportError:
+        from sklearn.decomposition import TruncatedSVD
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        tfidf = TfidfVectorizer(stop_words='english', dtype=np.float32).fit_transform(texts)
+        dim = min(dim, tfidf.shape[1] - 1)
+        dense = TruncatedSVD(dim, random_state=0).fit_transform(tfidf).astype(np.float32)
+        return dense, f"LSA/{dim}"
+
+def write_table(db_path, space, encoding, vectors, batch_size=10000):
+    """Store the vectors in a fresh database, returning its size in bytes"""
+    conn = sqlite3.connect(db_path)
+    ensure_embedding_schema(conn)
+    for start in range(0, vectors.shape[0], batch_size):
+        blobs = encode(vectors[start:start + batch_size], encoding)
+        conn.executemany('''
+        INSERT INTO text_embeddings (text_id, embedding, model, dim, version, encoding) VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(start + row + 1, blob) + space + (encoding,) for row, blob in enumerate(blobs)])
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    return os.path.getsize(db_path)
+
+def load_dense(db_path, index_dir, space, encoding):
+    """Sync a store from the table, returning (store, seconds)"""
+    os.environ['REPTY_EMBED_STORAGE'] = encoding
+    conn = sqlite3.connect(db_path)
+    store = EmbeddingStore(index_dir)
+    start = time.perf_counter()
+    store.sync(conn, space)
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return store, elapsed
+
+def search_all(score, queries):
+    """Top-k rows for every query and the mean milliseconds per query"""
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append(set(top_k(score(query), K).tolist()))
+    return results, (time.perf_counter() - start) * 1000 / len(queries)
+
+def recall(results, truth):
+    return sum(len(found & exact) for found, exact in zip(results, truth)) / (K * len(truth))
+
+def first_search(store, query):
+    """Milliseconds of the first search after opening the store"""
+    store.open()
+    start = time.perf_counter()
+    store.scores(query)
+    return (time.perf_counter() - start) * 1000
+
+def print_row(name, db_bytes, load_s, store_bytes, first_ms, query_ms, overlap):
+    print(f"{name:<9} {db_bytes / 1048576:>8.1f} MB {load_s:>8.3f} s {store_bytes / 1048576:>8.1f} MB"
+          f" {first_ms:>8.2f} ms {query_ms:>8.2f} ms {overlap:>8.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding storage encodings")
+    parser.add_argument("--rows", default="100k", help="history size, e.g. 20k, 100k, 1m")
+    parser.add_argument("--dim", type=int, default=384, help="width of the LSA stand-in for a model")
+    parser.add_argument("--queries", type=int, default=200, help="sampled queries for the recall check")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="repty-storage-")
+    try:
+        history = os.path.join(scratch, ".repty.db")
+        subprocess.run(["bash", os.path.join(REPO_DIR, "lib", "bootstrap.sh")], check=True,
+                       env=dict(os.environ, HOME=scratch, REPTY_DB=history, REPTY_SKIP_PIP="1"),
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        generate(history, parse_rows(args.rows))
+        conn = sqlite3.connect(history)
+        texts = [embedding_text(command, keywords) for command, keywords in
+                 conn.execute("SELECT command, keywords FROM command_texts ORDER BY id")]
+        conn.close()
+
+        dense, model = embed_texts(texts, args.dim)
+        rng = np.random.default_rng(0)
+        query_rows = rng.choice(len(texts), size=min(args.queries, len(texts)), replace=False)
+
+        print(f"{len(texts)} command texts; vectors from {model} ({dense.shape[1]} dims)\n")
+        print(f"{'encoding':<9} {'db':>11} {'load':>10} {'store':>11} {'first':>11} {'query':>11} {'recall@10':>9}")
+        space = (model, dense.shape[1], 1)
+        truth = None
+        for encoding in ('float32', 'float16', 'int8'):
+            db_path = os.path.join(scratch, f"dense-{encoding}.db")
+            db_bytes = write_table(db_path, space, encoding, dense)
+            store, load_s = load_dense(db_path, os.path.join(scratch, f"dense-{encoding}.index"), space, encoding)
+            store_bytes = sum(os.path.getsize(os.path.join(store.index_dir, name))
+                              for name in os.listdir(store.index_dir))
+            first_ms = first_search(store, dense[query_rows[0]])
+            results, query_ms = search_all(store.scores, dense[query_rows])
+            truth = truth or results
+            print_row(encoding, db_bytes, load_s, store_bytes, first_ms, query_ms, recall(results, truth))
+    finally:
+        os.environ.pop('REPTY_EMBED_STORAGE', None)
+        shutil.rmtree(scratch, ignore_errors=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
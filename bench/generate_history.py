@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""Generate a realistic synthetic command history for benchmarks.
+
+Usage: bench/generate_history.py ROWS [--db PATH] [--seed N]
+
+ROWS accepts k/m suffixes (100k, 1m). Commands are drawn from a pool of
+distinct commands with a Zipf-like skew, so a few (`git status`, `ls`) repeat
+constantly and most appear a handful of times. Work happens in many
+directories under a few dozen git projects plus some outside any project,
+sessions change every few dozen commands, and failures depend on the kind of
+command (typos always fail, test runs sometimes do).
+
+The database must already be set up by lib/bootstrap.sh. Rows go through
+repty.history.record_commands, so command_texts, the epoch column and the
+full-text index are filled exactly as at log time.
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+
+from repty import get_db_path
+from repty.history import ensure_history_schema, record_commands
+from repty.terms import extract_keywords
+
+PROJECTS = """
+repty api-server web-frontend infra payments auth-service data-pipeline mobile-app docs ml-models
+billing search-service notifications analytics dotfiles blog cli-tools k8s-manifests terraform-aws
+scraper chat-bot image-resizer queue-worker admin-panel design-system etl-jobs monitoring sdk-python
+""".split()
+
+SUBDIRS = ["", "/src", "/tests", "/scripts", "/deploy", "/docs", "/src/components", "/migrations"]
+
+OTHER_DIRS = ["/tmp", "/etc/nginx", "/var/log", "/home/dev", "/home/dev/Downloads", "/opt"]
+
+BRANCHES = ["main", "develop", "feature/login", "fix/timeout", "release/2.1", "chore/deps"]
+SERVICES = ["redis", "postgres", "nginx", "mongo", "rabbitmq", "elasticsearch", "api", "worker"]
+FILES = ["README.md", "main.py", "app.js", "config.yaml", "Dockerfile", "setup.py", "index.ts", ".env"]
+HOSTS = ["prod-1", "staging", "bastion", "db-replica", "build-box"]
+PACKAGES = ["requests", "numpy", "flask", "express", "react", "lodash", "pytest", "boto3", "axios"]
+
+# (template, failure probability, weight): weights shape how much of the
+# history each kind of command makes up
+TEMPLATES = [
+    ("git status", 0.0, 40),
+    ("ls -la", 0.0, 30),
+    ("cd {dir}", 0.02, 25),
+    ("git add .", 0.0, 12),
+    ("git commit -m \"{message}\"", 0.05, 12),
+    ("git push origin {branch}", 0.1, 8),
+    ("git pull", 0.05, 8),
+    ("git checkout {branch}", 0.05, 8),
+    ("git log --oneline -n {n}", 0.0, 4),
+    ("git diff {file}", 0.0, 5),
+    ("docker ps", 0.0, 6),
+    ("docker compose up -d {service}", 0.1, 5),
+    ("docker logs -f {service}", 0.02, 4),
+    ("docker run -d -p {port}:{port} {service}", 0.15, 3),
+    ("docker exec -it {service} bash", 0.05, 3),
+    ("kubectl get pods -n {namespace}", 0.05, 4),
+    ("kubectl logs deploy/{service} -n {namespace}", 0.05, 3),
+    ("kubectl apply -f k8s/{service}.yaml", 0.1, 2),
+    ("npm install {package}", 0.08, 4),
+    ("npm run {script}", 0.2, 5),
+    ("pip install {package}", 0.08, 4),
+    ("python3 {file}", 0.25, 5),
+    ("pytest tests/test_{module}.py -x", 0.3, 5),
+    ("make {target}", 0.15, 4),
+    ("vim {file}", 0.0, 10),
+    ("cat {file}", 0.02, 6),
+    ("grep -rn \"{word}\" .", 0.1, 5),
+    ("ssh {host}", 0.1, 3),
+    ("curl -s http://localhost:{port}/health", 0.2, 3),
+    ("redis-cli -p 6379 get {word}", 0.05, 2),
+    ("psql -h localhost -U postgres -c \"select count(*) from {word}\"", 0.1, 2),
+    ("terraform plan -var-file={namespace}.tfvars", 0.15, 2),
+    ("tail -f /var/log/{service}.log", 0.02, 2),
+    ("gti status", 1.0, 1),
+    ("sl", 1.0, 1),
+]
+
+WORDS = """
+users orders timeout retry cache session token invoice queue webhook metrics config migrate schema
+payload health login logout refund report export import sync build release
+""".split()
+
+def parse_rows(text):
+    """Parse a row count such as 5000, 100k or 1m"""
+    text = text.strip().lower()
+    scale = {"k": 1000, "m": 1000000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * scale)
+
+def make_pool(rng, size):
+    """Distinct (command, failure probability) pairs, most common first"""
+    fields = lambda: {
+        "dir": rng.choice(PROJECTS) + rng.choice(SUBDIRS), "branch": rng.choice(BRANCHES),
+        "message": f"{rng.choice(['fix', 'add', 'update', 'remove'])} {rng.choice(WORDS)} {rng.randrange(1000)}",
+        "n": rng.choice([5, 10, 20]), "file": rng.choice(FILES), "service": rng.choice(SERVICES),
+        "port": rng.choice([3000, 5432, 6379, 8000, 8080, 9200]), "namespace": rng.choice(["dev", "staging", "prod"]),
+        "package": rng.choice(PACKAGES), "script": rng.choice(["dev", "build", "test", "lint"]),
+        "module": rng.choice(WORDS), "target": rng.choice(["build", "test", "clean", "deploy"]),
+        "word": rng.choice(WORDS), "host": rng.choice(HOSTS),
+    }
+    weights = [weight for _, _, weight in TEMPLATES]
+    pool = []
+    seen = set()
+    # Plain templates (no fields) first: they are the constantly repeated ones
+    for template, failure, _ in TEMPLATES:
+        if "{" not in template:
+            pool.append((template, failure))
+            seen.add(template)
+    while len(pool) < size:
+        template, failure, _ = rng.choices(TEMPLATES, weights)[0]
+        command = template.format(**fields())
+        if command not in seen:
+            seen.add(command)
+            pool.append((command, failure))
+    return pool
+
+def generate(db_path, rows, seed=0, batch_size=50000):
+    """Append `rows` synthetic executions to the database at db_path"""
+    rng = random.Random(seed)
+    pool = make_pool(rng, max(200, rows // 7))
+    # Zipf-like skew: the i-th command is about 1/i as common as the first
+    cum_weights = []
+    total = 0.0
+    for rank in range(1, len(pool) + 1):
+        total += 1.0 / rank
+        cum_weights.append(total)
+    keywords = {}
+
+    directories = [project + sub for project in PROJECTS for sub in SUBDIRS]
+    now = int(time.time())
+    timestamp = now - 365 * 86400
+    step = 365 * 86400 // max(rows, 1)
+
+    conn = sqlite3.connect(db_path)
+    ensure_history_schema(conn)
+    session = 0
+    cwd = "/home/dev"
+    batch = []
+    for i in range(rows):
+        # A new session about every 50 commands, usually in a project
+        if i == 0 or rng.random() < 0.02:
+            session += 1
+            cwd = rng.choice(OTHER_DIRS) if rng.random() < 0.15 else "/home/dev/src/" + rng.choice(directories)
+        command, failure = rng.choices(pool, cum_weights=cum_weights)[0]
+        if command not in keywords:
+            keywords[command] = extract_keywords(command)
+        timestamp = min(now, timestamp + rng.randint(1, 2 * step + 1))
+        project = cwd.split("/")[4] if cwd.startswith("/home/dev/src/") else ""
+        exit_code = (127 if failure == 1.0 else rng.choice([1, 1, 2, 130])) if rng.random() < failure else 0
+        batch.append((command, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(timestamp)), cwd, exit_code,
+                      project, f"session-{session}", keywords[command]))
+        if len(batch) >= batch_size:
+            with conn:
+                record_commands(conn, batch)
+            batch = []
+    if batch:
+        with conn:
+            record_commands(conn, batch)
+    conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic repty history")
+    parser.add_argument("rows", type=parse_rows, help="number of commands, e.g. 1k, 100k, 1m")
+    parser.add_argument("--db", default=None, help="database path (default: $REPTY_DB or ~/.repty.db)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    db_path = args.db or get_db_path()
+    conn = sqlite3.connect(db_path)
+    has_commands = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'commands'").fetchone()
+    conn.close()
+    if not has_commands:
+        print(f"{db_path} has no commands table; run lib/bootstrap.sh first", file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    generate(db_path, args.rows, args.seed)
+    print(f"Generated {args.rows} commands in {time.perf_counter() - start:.1f}s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
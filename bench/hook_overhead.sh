@@ -0,0 +1,57 @@
+#!/bin/bash
+#
+# Measure how long the repty prompt hook adds to every prompt.
+#
+# Usage: bench/hook_overhead.sh [prompts]
+#
+# Runs the hook from repty.sh against a scratch database in both logging
+# modes and reports the mean milliseconds per prompt. Exits non-zero when the
+# spool mode exceeds REPTY_HOOK_BUDGET_MS (default 1 ms).
+
+PROMPTS="${1:-200}"
+BUDGET_MS="${REPTY_HOOK_BUDGET_MS:-1}"
+REPO_DIR="$(cd "$(dirname "$(realpath "$0")")/.." && pwd)"
+
+SCRATCH="$(mktemp -d)"
+trap 'rm -rf "$SCRATCH"' EXIT
+
+export HOME="$SCRATCH"
+export REPTY_DIR="$REPO_DIR"
+export REPTY_DB="$SCRATCH/.repty.db"
+export REPTY_SPOOL="$REPTY_DB.spool"
+# Measure the hook itself; ingestion is timed separately below
+export REPTY_SPOOL_FLUSH_EVERY=0
+
+REPTY_SKIP_PIP=1 bash "$REPO_DIR/lib/bootstrap.sh" >/dev/null
+source "$REPO_DIR/repty.sh"
+trap - DEBUG
+
+# Print the mean milliseconds per call of log_command in the given mode
+time_hook() {
+  REPTY_LOG_MODE="$1"
+  local start="$EPOCHREALTIME"
+  for ((i = 0; i < PROMPTS; i++)); do
+    log_command "git commit -m \"change $i\"" 0
+  done
+  local end="$EPOCHREALTIME"
+  awk -v s="$start" -v e="$end" -v n="$PROMPTS" 'BEGIN { printf "%.3f", (e - s) * 1000 / n }'
+}
+
+SPOOL_MS=$(time_hook spool)
+DIRECT_MS=$(time_hook direct)
+
+INGEST_START="$EPOCHREALTIME"
+PYTHONPATH="$REPO_DIR/lib" python3 -m repty.ingest >/dev/null
+INGEST_END="$EPOCHREALTIME"
+INGEST_MS=$(awk -v s="$INGEST_START" -v e="$INGEST_END" 'BEGIN { printf "%.1f", (e - s) * 1000 }')
+
+echo "Prompts per mode:       $PROMPTS"
+echo "spool mode:             $SPOOL_MS ms/prompt"
+echo "direct mode:            $DIRECT_MS ms/prompt"
+echo "ingest $PROMPTS records:    $INGEST_MS ms"
+echo "Logged rows:            $(sqlite3 "$REPTY_DB" "SELECT COUNT(*) FROM commands")"
+
+if awk -v ms="$SPOOL_MS" -v budget="$BUDGET_MS" 'BEGIN { exit !(ms > budget) }'; then
+  echo "spool mode is over the ${BUDGET_MS} ms budget"
+  exit 1
+fi
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""Benchmark repty end to end on synthetic histories.
+
+Usage:
+    bench/run.py [--sizes 1k,100k] [--cases find,stats] [--repeat 3]
+                 [--json results.json] [--baseline bench/baseline.json]
+                 [--save-baseline bench/baseline.json]
+
+For every size a scratch HOME and REPTY_DB are bootstrapped and filled by
+bench/generate_history.py, then each case runs as a separate process. Every
+case records its wall time (median of --repeat runs), the peak RSS of the
+process tree (never below the few MB of the launcher it is forked from) and
+the database size afterwards. Results print as a table and
+can be written as JSON; with --baseline, cases slower or larger than the
+baseline by more than --tolerance are reported and the exit status is 1.
+
+The query cache is off except in the search-cached case, which repeats
+one search so every run after the first is a cache hit, and the background
+embedding worker is never started.
+
+Cases whose optional backend is missing (the search backends without
+scikit-learn, generate_embeddings.py without scikit-learn or
+sentence-transformers) are recorded as skipped.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+REPO_DIR = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(REPO_DIR, 'bench'))
+
+from generate_history import parse_rows
+
+REPTY = os.path.join(REPO_DIR, "bin", "repty")
+LIB = os.path.join(REPO_DIR, "lib")
+QUERY = "start the redis container with docker"
+
+def have_module(names):
+    """Check whether any of the optional Python packages is installed"""
+    import importlib.util
+    return any(importlib.util.find_spec(name) is not None for name in names.split("|"))
+
+# Runs each measured command from a small process of its own: a forked child
+# inherits its parent's peak RSS, so forking from this (growing) process
+# would report our memory instead of the command's
+LAUNCHER = r"""
+import os, sys, json, time
+for line in sys.stdin:
+    args, env = json.loads(line)
+    start = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        null = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(null, fd)
+        try:
+            os.execvpe(args[0], args, env)
+        finally:
+            os._exit(127)
+    _, status, usage = os.wait4(pid, 0)
+    print(json.dumps([time.perf_counter() - start, usage.ru_maxrss, os.waitstatus_to_exitcode(status)]),
+          flush=True)
+"""
+
+class Launcher:
+    """Client of the launcher process"""
+
+    def __init__(self):
+        self.process = subprocess.Popen([sys.executable, "-S", "-c", LAUNCHER], text=True,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def measure(self, args, env):
+        """Run a command and return (wall seconds, peak RSS in KiB, exit status)"""
+        self.process.stdin.write(json.dumps([args, env]) + "\n")
+        self.process.stdin.flush()
+        return tuple(json.loads(self.process.stdout.readline()))
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+def db_bytes(db_path):
+    """Size of the database with its WAL and index directory"""
+    total = 0
+    for path in (db_path, db_path + "-wal"):
+        if os.path.exists(path):
+            total += os.path.getsize(path)
+    for root, _, files in os.walk(db_path + ".index"):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+def case_commands(scratch):
+    """Cases as name -> (argument lists run in order, repeatable, requirement).
+
+    A requirement names the Python packages a case needs, any one of them
+    separated by |.
+    """
+    spool_lines = "".join(f"{1700000000 + i}\tbench\t{0 if i % 7 else 1}\t/tmp\tgit commit -m 'bench {i}'\n"
+                          for i in range(1000))
+    return {
+        "log": ([[REPTY, "log", "0", f"git commit -m 'bench {i}'"] for i in range(20)], False, None),
+        "ingest": ([("spool", spool_lines), [REPTY, "ingest"]], False, None),
+        "find": ([[REPTY, "find", "docker redis"]], True, None),
+        "nlp": ([[REPTY, "nlp", QUERY]], True, None),
+        "semantic-cold": ([("clear-index", None), ["python3", os.path.join(LIB, "semantic_search.py"), QUERY]],
+                          False, "sklearn"),
+        "semantic": ([["python3", os.path.join(LIB, "semantic_search.py"), QUERY]], True, "sklearn"),
+        "ext-semantic": ([["python3", os.path.join(LIB, "ext", "semantic_search.py"), QUERY]], True, "sklearn"),
+        "search": ([["python3", "-m", "repty.search", QUERY]], True, None),
+        "search-cached": ([["env", "REPTY_QUERY_CACHE_SIZE=256", "python3", "-m", "repty.search", QUERY]],
+                          True, None),
+        "fallback": ([["python3", os.path.join(LIB, "ext", "fallback_search.py"), QUERY]], True, None),
+        "embeddings": ([["python3", os.path.join(LIB, "ext", "generate_embeddings.py")]], False,
+                       "sklearn|sentence_transformers"),
+        "stats": ([[REPTY, "stats"]], True, None),
+        "export": ([[REPTY, "export", os.path.join(scratch, "export.md")]], True, None),
+    }
+
+def run_case(launcher, name, steps, repeat, env, db_path):
+    """Run one case and return its result record"""
+    walls = []
+    peak = 0
+    for _ in range(repeat):
+        wall = 0.0
+        for step in steps:
+            if isinstance(step, tuple):
+                action, data = step
+                if action == "spool":
+                    with open(db_path + ".spool", "w") as f:
+                        f.write(data)
+                elif action == "clear-index":
+                    for index_file in os.listdir(db_path + ".index") if os.path.isdir(db_path + ".index") else []:
+                        os.remove(os.path.join(db_path + ".index", index_file))
+                continue
+            elapsed, rss, status = launcher.measure(step, env)
+            if status != 0:
+                return {"case": name, "status": "failed", "exit_status": status}
+            wall += elapsed
+            peak = max(peak, rss)
+        walls.append(wall)
+
+    result = {"case": name, "status": "ok", "wall_s": round(statistics.median(walls), 4),
+              "max_rss_kb": peak, "db_bytes": db_bytes(db_path)}
+    if name == "log":
+        result["per_call_ms"] = round(result["wall_s"] * 1000 / len(steps), 2)
+    if name == "embeddings":
+        import sqlite3
+        conn = sqlite3.connect(db_path)
+        texts = conn.execute("SELECT COUNT(*) FROM text_embeddings").fetchone()[0]
+        conn.close()
+        result["texts_per_s"] = round(texts / result["wall_s"], 1) if result["wall_s"] else None
+    return result
+
+def run_size(launcher, rows, cases, repeat, keep):
+    """Bootstrap and fill a scratch history, then run the cases against it"""
+    scratch = tempfile.mkdtemp(prefix=f"repty-bench-{rows}-")
+    db_path = os.path.join(scratch, ".repty.db")
+    env = dict(os.environ, HOME=scratch, REPTY_DB=db_path, REPTY_SOCKET=os.path.join(scratch, ".repty.sock"),
+               REPTY_SPOOL=db_path + ".spool", REPTY_SKIP_PIP="1", PYTHONPATH=LIB,
+               REPTY_QUERY_CACHE_SIZE="0", REPTY_EMBED_EVERY="0")
+    env.pop("REPTY_TERMS_FILE", None)
+
+    try:
+        subprocess.run(["bash", os.path.join(LIB, "bootstrap.sh")], env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(REPO_DIR, "bench", "generate_history.py"), str(rows)],
+                       env=env, check=True, stdout=subprocess.DEVNULL)
+        print(f"# {rows} rows generated in {time.perf_counter() - start:.1f}s ({scratch})", file=sys.stderr)
+
+        results = []
+        commands = case_commands(scratch)
+        for name in cases:
+            steps, repeatable, requirement = commands[name]
+            if requirement and not have_module(requirement):
+                result = {"case": name, "status": "skipped", "reason": f"{requirement.replace('|', ' or ')} not installed"}
+            else:
+                result = run_case(launcher, name, steps, repeat if repeatable else 1, env, db_path)
+            result["rows"] = rows
+            results.append(result)
+            print_result(result)
+        return results
+    finally:
+        if keep:
+            print(f"# kept {scratch}", file=sys.stderr)
+        else:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+def print_result(result, baseline=None):
+    """Print one result line, with its ratio to the baseline if given"""
+    if result["status"] != "ok":
+        print(f"{result['rows']:>9}  {result['case']:<14} {result['status']} {result.get('reason', '')}")
+        return
+    line = (f"{result['rows']:>9}  {result['case']:<14} {result['wall_s'] * 1000:>10.1f} ms "
+            f"{result['max_rss_kb'] / 1024:>8.1f} MB {result['db_bytes'] / 1048576:>9.1f} MB db")
+    if baseline:
+        line += f"   x{result['wall_s'] / baseline['wall_s']:.2f} time x{result['max_rss_kb'] / baseline['max_rss_kb']:.2f} rss"
+    print(line)
+
+def compare(results, baseline, tolerance, min_seconds):
+    """Print results against the baseline and return the regressions"""
+    previous = {(r["rows"], r["case"]): r for r in baseline["results"] if r["status"] == "ok"}
+    regressions = []
+    print(f"\nAgainst baseline from {baseline.get('meta', {}).get('date', 'unknown date')}:")
+    for result in results:
+        before = previous.get((result["rows"], result["case"]))
+        if result["status"] != "ok" or before is None:
+            continue
+        print_result(result, before)
+        slower = (result["wall_s"] > before["wall_s"] * tolerance
+                  and result["wall_s"] - before["wall_s"] > min_seconds)
+        larger = result["max_rss_kb"] > before["max_rss_kb"] * tolerance
+        if slower or larger:
+            regressions.append((result, before, "time" if slower else "rss"))
+    for result, before, kind in regressions:
+        print(f"REGRESSION {result['case']} at {result['rows']} rows: {kind}", file=sys.stderr)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark repty on synthetic histories")
+    parser.add_argument("--sizes", default="1k,100k", help="history sizes, e.g. 1k,100k,1m,5m")
+    parser.add_argument("--cases", default=None, help="comma separated cases (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per read-only case; the median is kept")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare against results saved earlier")
+    parser.add_argument("--save-baseline", help="save the results as a new baseline")
+    parser.add_argument("--tolerance", type=float, default=1.25,
+                        help="ratio to the baseline counted as a regression (default 1.25)")
+    parser.add_argument("--min-seconds", type=float, default=0.05,
+                        help="ignore slowdowns smaller than this many seconds (default 0.05)")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directories")
+    args = parser.parse_args()
+
+    available = list(case_commands("").keys())
+    cases = args.cases.split(",") if args.cases else available
+    unknown = [name for name in cases if name not in available]
+    if unknown:
+        parser.error(f"unknown cases {', '.join(unknown)}; choose from {', '.join(available)}")
+
+    print(f"{'rows':>9}  {'case':<14} {'wall':>13} {'peak rss':>11} {'size':>12}")
+    results = []
+    launcher = Launcher()
+    try:
+        for size in args.sizes.split(","):
+            results.extend(run_size(launcher, parse_rows(size), cases, args.repeat, args.keep))
+    finally:
+        launcher.close()
+
+    report = {
+        "meta": {"date": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+                 "platform": platform.platform(), "repeat": args.repeat},
+        "results": results,
+    }
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance, args.min_seconds):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
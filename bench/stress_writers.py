@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""Log commands from many shells at once and count what reaches the database.
+
+Usage: bench/stress_writers.py [--shells 50] [--commands 20] [--think-ms 50]
+                               [--readers 2] [--hold 0.5] [--every 2]
+                               [--modes rollback,wal,writer]
+
+Each simulated shell is a process calling repty.ingest.log_command, the
+code behind `repty log` in REPTY_LOG_MODE=direct, --commands times with a
+random pause of up to --think-ms between commands. While they run,
+--readers processes search the history in a loop like `repty find` and
+`repty nlp`, and one process holds a write transaction for --hold seconds
+every --every seconds like a batch of the embedding worker. Every mode
+starts from a fresh scratch database with --rows of synthetic history:
+
+    rollback  rollback journal and a 5 second busy timeout: how the
+              database was opened before WAL
+    wal       write-ahead logging and the REPTY_BUSY_TIMEOUT default
+    writer    wal, with `repty writer` group-committing for every shell
+
+For each mode the table reports where the commands went (committed by a
+shell, committed by the writer, or spooled because the database stayed
+locked), how many calls failed, and the insert latency percentiles. After
+the run the spool is ingested and every command is looked up: `lost` are
+the ones in neither place, `dup` the ones stored twice. Before WAL a
+spooled command was an error, and a lost write. Exits non-zero when a
+command is lost or duplicated.
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+
+REPO_DIR = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(REPO_DIR, 'bench'))
+sys.path.insert(0, os.path.join(REPO_DIR, 'lib'))
+
+from generate_history import generate, parse_rows
+
+MODES = {
+    "rollback": {"REPTY_JOURNAL_MODE": "delete", "REPTY_BUSY_TIMEOUT": "5"},
+    "wal": {"REPTY_JOURNAL_MODE": "wal"},
+    "writer": {"REPTY_JOURNAL_MODE": "wal"},
+}
+PREFIX = "stress shell"
+
+def shell(index, commands, think_ms, db_path, start, results):
+    """Log --commands commands, sending (latency ms, destination) pairs back"""
+    from repty.ingest import log_command
+    rng = random.Random(index)
+    timings = []
+    start.wait()
+    for n in range(commands):
+        time.sleep(rng.uniform(0, think_ms) / 1000)
+        started = time.perf_counter()
+        try:
+            where = log_command(0, f"{PREFIX} {index} command {n}", db_path)
+        except Exception:
+            where = "error"
+        timings.append(((time.perf_counter() - started) * 1000, where))
+    results.put(timings)
+
+def reader(db_path, stop):
+    """Search the history in a loop, like shells running repty find and nlp"""
+    from repty.db import connect
+    conn = connect(db_path)
+    while not stop.is_set():
+        try:
+            conn.execute("SELECT COUNT(*) FROM commands WHERE command LIKE '%docker%'").fetchone()
+        except sqlite3.OperationalError:
+            pass
+        time.sleep(0.01)
+    conn.close()
+
+def holder(db_path, hold, every, stop):
+    """Hold a write transaction now and then, like the embedding worker"""
+    from repty.db import connect
+    conn = connect(db_path)
+    conn.isolation_level = None
+    while not stop.wait(every):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            continue
+        conn.execute("INSERT OR REPLACE INTO repty_meta (key, value) VALUES ('stress_hold', ?)", (str(time.time()),))
+        time.sleep(hold)
+        conn.execute("COMMIT")
+    conn.close()
+
+def start_writer(env):
+    """Start `repty writer serve` and wait until it answers"""
+    from repty.unix_server import is_running
+    process = subprocess.Popen([sys.executable, "-m", "repty.writer", "serve"], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        if is_running(env["REPTY_WRITER_SOCKET"]):
+            return process
+        time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("writer did not start")
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def run_mode(mode, args, scratch):
+    """Run one mode in its own scratch database and return the table row"""
+    directory = os.path.join(scratch, mode)
+    os.makedirs(directory)
+    db_path = os.path.join(directory, ".repty.db")
+    env = dict(os.environ, HOME=directory, REPTY_DB=db_path, REPTY_SKIP_PIP="1", REPTY_EMBED_EVERY="0",
+               REPTY_WRITER_SOCKET=os.path.join(directory, "writer.sock"),
+               PYTHONPATH=os.path.join(REPO_DIR, "lib"), **MODES[mode])
+    for key in ("REPTY_BUSY_TIMEOUT", "REPTY_SPOOL"):
+        if key not in MODES[mode]:
+            env.pop(key, None)
+    subprocess.run(["bash", os.path.join(REPO_DIR, "lib", "bootstrap.sh")], check=True, env=env,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    generate(db_path, parse_rows(args.rows))
+
+    # The forked processes below read their settings from the environment
+    saved = dict(os.environ)
+    os.environ.clear()
+    os.environ.update(env)
+    writer = start_writer(env) if mode == "writer" else None
+    ctx = multiprocessing.get_context("fork")
+    stop, start, results = ctx.Event(), ctx.Event(), ctx.Queue()
+    background = [ctx.Process(target=reader, args=(db_path, stop)) for _ in range(args.readers)]
+    if args.hold > 0:
+        background.append(ctx.Process(target=holder, args=(db_path, args.hold, args.every, stop)))
+    shells = [ctx.Process(target=shell, args=(i, args.commands, args.think_ms, db_path, start, results))
+              for i in range(args.shells)]
+    try:
+        for process in background + shells:
+            process.start()
+        started = time.perf_counter()
+        start.set()
+        timings = [timing for _ in shells for timing in results.get()]
+        wall = time.perf_counter() - started
+        for process in shells:
+            process.join()
+    finally:
+        stop.set()
+        for process in background:
+            process.join()
+        if writer:
+            from repty.unix_server import send_request
+            send_request(env["REPTY_WRITER_SOCKET"], {"cmd": "shutdown"})
+            writer.wait(timeout=10)
+        os.environ.clear()
+        os.environ.update(saved)
+
+    subprocess.run([sys.executable, "-m", "repty.ingest"], env=env, check=True, stdout=subprocess.DEVNULL)
+    conn = sqlite3.connect(db_path)
+    stored, distinct = conn.execute("SELECT COUNT(*), COUNT(DISTINCT command) FROM commands WHERE command LIKE ?",
+                                    (PREFIX + " %",)).fetchone()
+    conn.close()
+
+    latencies = sorted(ms for ms, _ in timings)
+    where = [dest for _, dest in timings]
+    return {
+        "mode": mode,
+        "writer": where.count("writer"),
+        "database": where.count("database"),
+        "spool": where.count("spool"),
+        "error": where.count("error"),
+        "lost": args.shells * args.commands - distinct,
+        "dup": stored - distinct,
+        "p50": percentile(latencies, 50),
+        "p90": percentile(latencies, 90),
+        "p99": percentile(latencies, 99),
+        "max": latencies[-1],
+        "wall": wall,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress concurrent command logging")
+    parser.add_argument("--shells", type=int, default=50, help="simulated shells logging at once")
+    parser.add_argument("--commands", type=int, default=20, help="commands logged by each shell")
+    parser.add_argument("--think-ms", type=float, default=50, help="longest pause between a shell's commands")
+    parser.add_argument("--readers", type=int, default=2, help="processes searching while the shells log")
+    parser.add_argument("--hold", type=float, default=0.5, help="seconds the background writer holds its lock")
+    parser.add_argument("--every", type=float, default=2, help="seconds between its transactions")
+    parser.add_argument("--rows", default="5k", help="synthetic history to start from, e.g. 5k, 100k")
+    parser.add_argument("--modes", default="rollback,wal,writer", help="comma-separated modes to run")
+    args = parser.parse_args()
+
+    modes = [mode for mode in args.modes.split(",") if mode]
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        parser.error(f"unknown mode: {', '.join(unknown)}")
+
+    print(f"{args.shells} shells x {args.commands} commands, {args.readers} readers, "
+          f"a {args.hold}s write lock every {args.every}s\n")
+    print(f"{'mode':<9} {'shell':>6} {'writer':>6} {'spool':>6} {'error':>6} {'lost':>5} {'dup':>4}"
+          f" {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'wall':>7}")
+    scratch = tempfile.mkdtemp(prefix="repty-writers-")
+    failed = False
+    try:
+        for mode in modes:
+            row = run_mode(mode, args, scratch)
+            print(f"{row['mode']:<9} {row['database']:>6} {row['writer']:>6} {row['spool']:>6} {row['error']:>6}"
+                  f" {row['lost']:>5} {row['dup']:>4}"
+                  + "".join(f" {row[key]:>5.1f} ms" for key in ("p50", "p90", "p99", "max"))
+                  + f" {row['wall']:>6.1f}s")
+            failed = failed or row["lost"] > 0 or row["dup"] > 0
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -28,6 +28,7 @@ mkdir -p "$INSTALL_DIR"
 mkdir -p "$INSTALL_DIR/bin"
 mkdir -p "$INSTALL_DIR/lib"
 mkdir -p "$INSTALL_DIR/lib/ext"
+mkdir -p "$INSTALL_DIR/lib/repty"
 
 # Copy files to installation directory
 print_step "Copying files to installation directory..."
@@ -67,6 +68,23 @@ if [ -d "lib" ]; then
         fi
     done
     
+    for file in lib/*.py; do
+        if [ -f "$file" ]; then
+            cp "$file" "$INSTALL_DIR/lib/" || echo -e "${YELLOW}Warning:${NC} Could not copy $file"
+        fi
+    done
+    
+    # Copy the shared Python package
+    if [ -d "lib/repty" ]; then
+        for file in lib/repty/*.py; do
+            if [ -f "$file" ]; then
+                cp "$file" "$INSTALL_DIR/lib/repty/" || echo -e "${YELLOW}Warning:${NC} Could not copy $file"
+            fi
+        done
+    else
+        echo -e "${YELLOW}Warning:${NC} lib/repty directory not found"
+    fi
+    
     # Copy extension files
     if [ -d "lib/ext" ]; then
         for file in lib/ext/*.py; do
@@ -1,6 +1,6 @@
 #!/bin/bash
 
-DB="$HOME/.repty.db"
+DB="${REPTY_DB:-$HOME/.repty.db}"
 REPTY_EXT_DIR="$(dirname "$(realpath "$0")")/ext"
 mkdir -p "$REPTY_EXT_DIR"
 
@@ -16,7 +16,11 @@ if ! command -v sqlite3 &>/dev/null; then
   fi
 fi
 
+# New databases return free pages to the file system on `repty compact`;
+# auto_vacuum only takes effect before the first table is created
 sqlite3 "$DB" <<'EOF'
+PRAGMA auto_vacuum = INCREMENTAL;
+
 CREATE TABLE IF NOT EXISTS commands (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   command TEXT,
@@ -25,197 +29,130 @@ CREATE TABLE IF NOT EXISTS commands (
   exit_code INTEGER,
   git_project TEXT,
   session_id TEXT,
-  keywords TEXT
+  keywords TEXT,
+  text_id INTEGER REFERENCES command_texts(id),
+  ts INTEGER,
+  host TEXT
 );
 
-CREATE TABLE IF NOT EXISTS command_embeddings (
-  command_id INTEGER PRIMARY KEY,
+CREATE TABLE IF NOT EXISTS command_texts (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  hash TEXT UNIQUE,
+  command TEXT,
+  keywords TEXT,
+  run_count INTEGER DEFAULT 0,
+  fail_count INTEGER DEFAULT 0,
+  first_seen TEXT,
+  last_seen TEXT
+);
+
+CREATE TABLE IF NOT EXISTS text_embeddings (
+  text_id INTEGER PRIMARY KEY,
   embedding BLOB,
-  FOREIGN KEY (command_id) REFERENCES commands(id)
+  model TEXT,
+  dim INTEGER,
+  version INTEGER,
+  encoding TEXT,
+  FOREIGN KEY (text_id) REFERENCES command_texts(id)
+);
+
+CREATE TABLE IF NOT EXISTS repty_meta (
+  key TEXT PRIMARY KEY,
+  value TEXT
 );
 EOF
 
+# Write-ahead logging lets searches read while shells log commands
+sqlite3 "$DB" "PRAGMA journal_mode = ${REPTY_JOURNAL_MODE:-wal};" >/dev/null
+
 # Add keywords column if it doesn't exist (for existing installations)
 sqlite3 "$DB" "PRAGMA table_info(commands);" | grep -q "keywords" || \
   sqlite3 "$DB" "ALTER TABLE commands ADD COLUMN keywords TEXT;"
 
-# Create Python scripts for advanced NLP
-mkdir -p "$REPTY_EXT_DIR"
+# Link executions to their distinct command text (for existing installations)
+sqlite3 "$DB" "PRAGMA table_info(commands);" | grep -q "|text_id|" || \
+  sqlite3 "$DB" "ALTER TABLE commands ADD COLUMN text_id INTEGER REFERENCES command_texts(id);"
+sqlite3 "$DB" "CREATE INDEX IF NOT EXISTS commands_text_id ON commands(text_id);"
+
+# How each embedding is stored (see repty.quantize); NULL is float32
+sqlite3 "$DB" "PRAGMA table_info(text_embeddings);" | grep -q "|encoding|" || \
+  sqlite3 "$DB" "ALTER TABLE text_embeddings ADD COLUMN encoding TEXT;"
+
+# Integer epoch time for indexed time filters, filled in for older rows
+sqlite3 "$DB" "PRAGMA table_info(commands);" | grep -q "|ts|" || \
+  sqlite3 "$DB" "ALTER TABLE commands ADD COLUMN ts INTEGER;"
+# Host of commands imported from another machine; NULL for this one
+sqlite3 "$DB" "PRAGMA table_info(commands);" | grep -q "|host|" || \
+  sqlite3 "$DB" "ALTER TABLE commands ADD COLUMN host TEXT;"
 
-cat > "$REPTY_EXT_DIR/generate_embeddings.py" << 'EOF'
-import sys
-import os
-import sqlite3
-import numpy as np
-
-try:
-    from sentence_transformers import SentenceTransformer
-except ImportError:
-    print("Error: sentence-transformers package not found.")
-    print("Please install it with: pip install sentence-transformers")
-    sys.exit(1)
-
-# Get database path from environment or use default
-db_path = os.environ.get('REPTY_DB', os.path.expanduser('~/.repty.db'))
-
-# Load a lightweight model
-try:
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-except Exception as e:
-    print(f"Error loading model: {e}")
-    sys.exit(1)
-
-# Connect to database
-try:
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-except Exception as e:
-    print(f"Error connecting to database: {e}")
-    sys.exit(1)
-
-# Get commands without embeddings
-try:
-    cursor.execute('''
-    SELECT id, command FROM commands 
-    WHERE id NOT IN (SELECT command_id FROM command_embeddings)
-    ''')
-    
-    commands = cursor.fetchall()
-    
-    if not commands:
-        print("No new commands to process.")
-        sys.exit(0)
-        
-    print(f"Generating embeddings for {len(commands)} commands...")
-    
-    # Generate embeddings in batches
-    batch_size = 100
-    for i in range(0, len(commands), batch_size):
-        batch = commands[i:i+batch_size]
-        ids = [cmd[0] for cmd in batch]
-        texts = [cmd[1] for cmd in batch]
-        
-        # Generate embeddings
-        embeddings = model.encode(texts)
-        
-        # Store embeddings
-        for j, embedding in enumerate(embeddings):
-            cmd_id = ids[j]
-            # Convert numpy array to bytes
-            embedding_bytes = np.array(embedding).tobytes()
-            cursor.execute('INSERT INTO command_embeddings (command_id, embedding) VALUES (?, ?)',
-                        (cmd_id, embedding_bytes))
-        
-        conn.commit()
-        print(f"Processed {min(i+batch_size, len(commands))}/{len(commands)} commands")
-    
-    print("Embeddings generated and stored in database")
-except Exception as e:
-    print(f"Error generating embeddings: {e}")
-    sys.exit(1)
-finally:
-    conn.close()
+sqlite3 "$DB" <<'EOF'
+UPDATE commands SET ts = CAST(strftime('%s', timestamp) AS INTEGER)
+WHERE ts IS NULL AND timestamp IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS commands_ts ON commands(ts);
+CREATE INDEX IF NOT EXISTS commands_cwd_ts ON commands(cwd, ts);
+CREATE INDEX IF NOT EXISTS commands_git_project_ts ON commands(git_project, ts);
+CREATE INDEX IF NOT EXISTS commands_session_ts ON commands(session_id, ts);
+CREATE INDEX IF NOT EXISTS commands_exit_code_ts ON commands(exit_code, ts);
 EOF
 
-cat > "$REPTY_EXT_DIR/semantic_search.py" << 'EOF'
-import sys
-import os
-import sqlite3
-import numpy as np
-
-try:
-    from sentence_transformers import SentenceTransformer
-except ImportError:
-    print("Error: sentence-transformers package not found.")
-    print("Please install it with: pip install sentence-transformers")
-    sys.exit(1)
-
-# Check arguments
-if len(sys.argv) < 2:
-    print("Usage: python semantic_search.py \"your query here\"")
-    sys.exit(1)
-
-# Get query from command line
-query = ' '.join(sys.argv[1:])
-
-# Get database path from environment or use default
-db_path = os.environ.get('REPTY_DB', os.path.expanduser('~/.repty.db'))
-
-# Load model - use a smaller model for faster inference
-try:
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-except Exception as e:
-    print(f"Error loading model: {e}")
-    sys.exit(1)
-
-# Generate embedding for query
-query_embedding = model.encode(query)
-query_embedding_bytes = np.array(query_embedding).tobytes()
-
-# Connect to database
-try:
-    conn = sqlite3.connect(db_path)
-except Exception as e:
-    print(f"Error connecting to database: {e}")
-    sys.exit(1)
-
-# Define cosine similarity function
-def cosine_similarity(x, y):
-    try:
-        x_arr = np.frombuffer(x, dtype=np.float32)
-        y_arr = np.frombuffer(y, dtype=np.float32)
-        return float(np.dot(x_arr, y_arr) / (np.linalg.norm(x_arr) * np.linalg.norm(y_arr)))
-    except:
-        return 0.0
-
-# Register the function with SQLite
-conn.create_function("cosine_similarity", 2, cosine_similarity)
-
-# Search for similar commands
-try:
-    cursor = conn.cursor()
-    
-    # Extract keywords from query to boost exact matches
-    keywords = query.lower().split()
-    keyword_conditions = ""
-    if keywords:
-        keyword_conditions = "OR " + " OR ".join([f"lower(c.command) LIKE '%{keyword}%'" for keyword in keywords])
-    
-    cursor.execute(f'''
-    SELECT c.id, c.command, c.timestamp, c.cwd, c.exit_code, 
-           cosine_similarity(e.embedding, ?) as similarity
-    FROM commands c
-    JOIN command_embeddings e ON c.id = e.command_id
-    WHERE similarity > 0.5 {keyword_conditions}
-    GROUP BY c.command
-    ORDER BY similarity DESC
-    LIMIT 10
-    ''', (query_embedding_bytes,))
-    
-    results = cursor.fetchall()
-    
-    if not results:
-        print("No similar commands found.")
-        sys.exit(0)
-    
-    # Print results in a format that can be parsed by the shell script
-    for result in results:
-        cmd_id, cmd, timestamp, cwd, exit_code, similarity = result
-        # Format: ID|TIMESTAMP|CWD|COMMAND|EXIT_CODE|SIMILARITY
-        print(f"{cmd_id}|{timestamp}|{cwd}|{cmd}|{exit_code}|{similarity:.4f}")
-        
-except Exception as e:
-    print(f"Error searching for similar commands: {e}")
-    sys.exit(1)
-finally:
-    conn.close()
+# Fill command_texts from older histories and move their embeddings over
+if command -v python3 &>/dev/null; then
+  PYTHONPATH="$(dirname "$(realpath "$0")")" REPTY_DB="$DB" python3 -m repty.history migrate >/dev/null || \
+    echo "Could not build the command_texts table; it will be built on the next search."
+fi
+
+# Full-text index over the distinct command texts and their keywords for
+# find and the keyword fallbacks, kept in sync by triggers. Built from the
+# existing texts the first time; skipped when this SQLite has no FTS5,
+# leaving the LIKE searches.
+sqlite3 "$DB" <<'EOF'
+DROP TRIGGER IF EXISTS commands_fts_insert;
+DROP TRIGGER IF EXISTS commands_fts_delete;
+DROP TRIGGER IF EXISTS commands_fts_update;
+DROP TABLE IF EXISTS commands_fts;
 EOF
 
-chmod +x "$REPTY_EXT_DIR/generate_embeddings.py"
-chmod +x "$REPTY_EXT_DIR/semantic_search.py"
+if [ -z "$(sqlite3 "$DB" "SELECT 1 FROM sqlite_master WHERE name = 'command_texts_fts';")" ]; then
+  sqlite3 "$DB" <<'EOF' 2>/dev/null || echo "SQLite FTS5 not available; searches will use LIKE matching."
+BEGIN;
+CREATE VIRTUAL TABLE command_texts_fts USING fts5(
+  command, keywords, content='command_texts', content_rowid='id', prefix='2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS command_texts_fts_insert AFTER INSERT ON command_texts BEGIN
+  INSERT INTO command_texts_fts (rowid, command, keywords) VALUES (new.id, new.command, new.keywords);
+END;
+
+CREATE TRIGGER IF NOT EXISTS command_texts_fts_delete AFTER DELETE ON command_texts BEGIN
+  INSERT INTO command_texts_fts (command_texts_fts, rowid, command, keywords) VALUES ('delete', old.id, old.command, old.keywords);
+END;
+
+CREATE TRIGGER IF NOT EXISTS command_texts_fts_update AFTER UPDATE OF command, keywords ON command_texts BEGIN
+  INSERT INTO command_texts_fts (command_texts_fts, rowid, command, keywords) VALUES ('delete', old.id, old.command, old.keywords);
+  INSERT INTO command_texts_fts (rowid, command, keywords) VALUES (new.id, new.command, new.keywords);
+END;
+
+INSERT INTO command_texts_fts (command_texts_fts) VALUES ('rebuild');
+COMMIT;
+EOF
+fi
+
+# The Python scripts for advanced NLP are installed alongside this file and
+# need the repty package next to them, so there is nothing to fall back to
+for script in generate_embeddings.py semantic_search.py fallback_search.py; do
+  if [ ! -f "$REPTY_EXT_DIR/$script" ]; then
+    echo "Missing $REPTY_EXT_DIR/$script; reinstall repty to restore it." >&2
+    exit 1
+  fi
+done
+chmod +x "$REPTY_EXT_DIR/generate_embeddings.py" "$REPTY_EXT_DIR/semantic_search.py"
 
 # Check if Python is available for advanced NLP features
-if command -v python3 &>/dev/null; then
+# (REPTY_SKIP_PIP=1 leaves the Python packages alone, e.g. for scratch databases)
+if [ -n "$REPTY_SKIP_PIP" ]; then
+  exit 0
+elif command -v python3 &>/dev/null; then
   echo "Python detected. Setting up advanced NLP capabilities..."
   
   # Check if pip is available
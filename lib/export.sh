@@ -1,34 +1,10 @@
 #!/bin/bash
+# Export the command history (repty.export): one streaming scan of the
+# history written as Markdown, JSONL or CSV, optionally gzipped.
+# Usage: export.sh [--format md|jsonl|csv] [--gzip] [--since DATE] [--until DATE]
+#                  [--project NAME] [--cwd DIR] [file|-]
+# With REPTY_EXPLAIN set, prints the query plan instead (bench/check_query_plans.py).
 
-DB="$HOME/.repty.db"
-OUT="$HOME/repty_history.md"
+REPTY_LIB_DIR="$(dirname "$(realpath "$0")")"
 
-echo "# Repty Command History" > "$OUT"
-echo "Generated on $(date)" >> "$OUT"
-echo "" >> "$OUT"
-
-TOTAL=$(sqlite3 "$DB" "SELECT COUNT(*) FROM commands;")
-echo "Total commands recorded: $TOTAL" >> "$OUT"
-echo "" >> "$OUT"
-
-echo "## Commands by Date" >> "$OUT"
-echo "" >> "$OUT"
-
-sqlite3 -cmd ".mode list" "$DB" "SELECT DISTINCT strftime('%Y-%m-%d', timestamp) FROM commands ORDER BY timestamp DESC;" | while read -r date; do
-  echo "### $date" >> "$OUT"
-  echo "" >> "$OUT"
-  
-  sqlite3 -cmd ".mode list" "$DB" "SELECT timestamp, command, cwd, exit_code FROM commands WHERE strftime('%Y-%m-%d', timestamp) = '$date' ORDER BY timestamp DESC;" | while IFS='|' read -r timestamp command cwd exit_code; do
-    time=$(echo "$timestamp" | cut -d' ' -f2)
-    status="Yes"
-    if [ "$exit_code" != "0" ]; then
-      status="No"
-    fi
-    
-    echo "- $status **$time** \`$command\` (in \`$cwd\`)" >> "$OUT"
-  done
-  
-  echo "" >> "$OUT"
-done
-
-echo "Exported to $OUT"
+PYTHONPATH="$REPTY_LIB_DIR" exec python3 -m repty.export "$@"
@@ -1,189 +1,303 @@
 import sys
 import os
+import time
+import glob
+import json
 import sqlite3
-import numpy as np
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
 
 # Force CPU-only mode for torch to avoid CUDA issues
 os.environ["CUDA_VISIBLE_DEVICES"] = ""
 os.environ["NO_CUDA"] = "1"
 os.environ["USE_TORCH"] = "0"  # Try to avoid torch if possible
 
-# Try to use scikit-learn if available
-try:
-    from sklearn.feature_extraction.text import TfidfVectorizer
-    USE_SCIKIT = True
-    print("Using scikit-learn for embeddings")
-except ImportError:
-    USE_SCIKIT = False
-    print("scikit-learn not available, trying sentence-transformers")
+from repty import get_db_path, get_index_dir
+from repty.db import connect, get_meta, set_meta, delete_meta
+from repty.embed_pool import Progress, default_workers, encode_batches
+from repty.quantize import storage_encoding
+from repty.embed_worker import HIGH_WATER_KEY, FINISHED_KEY, acquire, high_water_mark
+from repty.history import ensure_history_schema
+from repty.trace import NULL_TRACE, start
+from repty.embeddings import (TransformerEmbedder, ensure_embedding_schema, get_active_space,
+                              set_active_space, claim_space, embedding_text)
+
+FLAG_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), ".embeddings_processed")
+
+def write_flag(message):
+    """Record the outcome so failed runs are not retried on every search"""
+    with open(FLAG_FILE, "w") as f:
+        f.write(message)
+
+def get_embedder():
+    """Load sentence-transformers, or return None without it"""
     try:
-        from sentence_transformers.SentenceTransformer import SentenceTransformer
+        return TransformerEmbedder()
     except ImportError:
-        print("Error: Neither scikit-learn nor sentence-transformers package found.")
-        print("Please install one of them: pip install scikit-learn or pip install sentence-transformers")
-        
-        # Create a flag file to indicate we attempted to generate embeddings
-        # This prevents repeated attempts that will fail
-        flag_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), ".embeddings_processed")
-        with open(flag_file, "w") as f:
-            f.write("Embeddings processing attempted but dependencies missing")
-        
-        sys.exit(1)
+        return None
 
-# Get database path from environment or use default
-db_path = os.environ.get('REPTY_DB', os.path.expanduser('~/.repty.db'))
-
-# Connect to database
-try:
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-except Exception as e:
-    print(f"Error connecting to database: {e}")
-    sys.exit(1)
-
-# Create command_embeddings table if it doesn't exist
-try:
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS command_embeddings (
-        command_id INTEGER PRIMARY KEY,
-        embedding BLOB,
-        FOREIGN KEY (command_id) REFERENCES commands(id)
-    )
-    ''')
+def drop_tfidf_vectors(conn, db_path):
+    """Remove the TF-IDF vectors and vocabularies earlier versions stored;
+    no search reads them"""
+    active = get_active_space(conn)
+    if active and active[0] == 'tfidf':
+        delete_meta(conn, 'embedding_space')
+    target = get_meta(conn, 'reindex_space')
+    if target and json.loads(target)[0] == 'tfidf':
+        delete_meta(conn, 'reindex_space', 'reindex_last_id')
+    delete_meta(conn, 'tfidf_space_version')
+    conn.execute("DELETE FROM text_embeddings WHERE model = 'tfidf'")
     conn.commit()
-except Exception as e:
-    print(f"Error creating table: {e}")
-    sys.exit(1)
-
-# Check if keywords column exists in commands table
-try:
-    cursor.execute("PRAGMA table_info(commands)")
-    columns = [col[1] for col in cursor.fetchall()]
-    has_keywords = 'keywords' in columns
-    print(f"Keywords column exists: {has_keywords}")
-except Exception as e:
-    print(f"Error checking table schema: {e}")
-    has_keywords = False
-
-# Get commands without embeddings
-try:
-    if has_keywords:
-        cursor.execute('''
-        SELECT id, command, keywords FROM commands 
-        WHERE id NOT IN (SELECT command_id FROM command_embeddings)
-        ''')
-    else:
-        cursor.execute('''
-        SELECT id, command FROM commands 
-        WHERE id NOT IN (SELECT command_id FROM command_embeddings)
-        ''')
-    
-    commands = cursor.fetchall()
-    
-    if not commands:
-        print("No new commands to process.")
-        
-        # Create flag file to indicate processing completed
-        flag_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), ".embeddings_processed")
-        with open(flag_file, "w") as f:
-            f.write("No new commands to process")
-            
-        sys.exit(0)
-        
-    print(f"Processing {len(commands)} commands...")
-    
-    # Prepare command texts and ids
-    texts = []
-    ids = []
-    for cmd in commands:
-        command_id = cmd[0]
-        command_text = cmd[1]
-        
-        if has_keywords and len(cmd) > 2:
-            keywords = cmd[2] if cmd[2] else ""
-            
-            # Enrich text with keywords if available
-            if keywords:
-                enriched_text = f"{command_text} {keywords} {keywords}"
+    for path in glob.glob(os.path.join(get_index_dir(db_path), "tfidf_space_v*")):
+        os.remove(path)
+
+def index_tfidf(conn, db_path, refit=False, trace=NULL_TRACE):
+    """Bring the TF-IDF index scikit-learn searches score up to date,
+    returning how many command texts it took in.
+
+    The index is the only copy of the TF-IDF vectors: nothing is stored in
+    text_embeddings. With refit the vocabulary is fitted again over the
+    whole history.
+    """
+    from repty.semantic import SemanticIndex
+
+    drop_tfidf_vectors(conn, db_path)
+    index = SemanticIndex(db_path)
+    index.trace = trace
+    added = index.refresh(conn, refit)
+    # Every text up to the last one indexed is searchable now
+    set_meta(conn, HIGH_WATER_KEY, index.tfidf.last_id)
+    conn.commit()
+    return len(index) if refit else added
+
+def fetch_batch(conn, after_id, batch_size, missing_only):
+    """Return the next batch of (text_id, text) rows after `after_id`"""
+    sql = "SELECT id, command, keywords FROM command_texts t WHERE id > ?"
+    if missing_only:
+        sql += " AND NOT EXISTS (SELECT 1 FROM text_embeddings e WHERE e.text_id = t.id)"
+    rows = conn.execute(sql + " ORDER BY id LIMIT ?", (after_id, batch_size)).fetchall()
+    return [(row[0], embedding_text(row[1], row[2])) for row in rows]
+
+def write_vectors(conn, space, encoding, rows, blobs, trace=NULL_TRACE):
+    """Store a batch of encoded rows in `space`; the caller commits"""
+    with trace.stage("write"):
+        conn.executemany('''
+        INSERT OR REPLACE INTO text_embeddings (text_id, embedding, model, dim, version, encoding)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(text_id, blob) + space + (encoding,) for (text_id, _), blob in zip(rows, blobs)])
+
+def read_batches(conn, after_id, batch_size, missing_only, trace=NULL_TRACE):
+    """Yield batches of rows after `after_id` until none are left, timed as the "fetch" stage"""
+    while True:
+        with trace.stage("fetch") as stage:
+            rows = fetch_batch(conn, after_id, batch_size, missing_only)
+            stage.rows = len(rows)
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1][0]
+
+def sync_store(conn, embedder, db_path, trace=NULL_TRACE):
+    """Keep the memory-mapped matrix and its IVF index used by semantic search in sync"""
+    from repty.ann_index import IvfIndex
+    from repty.embedding_store import EmbeddingStore
+    with trace.stage("sync"):
+        store = EmbeddingStore(get_index_dir(db_path))
+        store.sync(conn, embedder.space)
+        IvfIndex(store.index_dir).update(store)
+
+def embed_new(conn, embedder, db_path, batch_size, workers=1, trace=NULL_TRACE):
+    """Embed command texts that have no vector yet, in the active space"""
+    if get_meta(conn, 'reindex_space') is not None:
+        print("A reindex is in progress, resuming it")
+        return reindex(conn, embedder, db_path, batch_size, workers, trace)
+    if not claim_space(conn, embedder.space):
+        if get_active_space(conn) is None:
+            # Vectors from before spaces were recorded: re-embed them all
+            return reindex(conn, embedder, db_path, batch_size, workers, trace)
+        model, dim, version = get_active_space(conn)
+        print(f"Stored embeddings are from {model}/{dim}/v{version}, not {embedder.space[0]}; run 'repty reindex'")
+        return None
+
+    # Work from the high-water mark; only the first run has to look for
+    # texts without a vector
+    last_id = high_water_mark(conn)
+    missing_only = last_id is None
+    if missing_only:
+        last_id = 0
+        covered = conn.execute("SELECT COALESCE(MAX(id), 0) FROM command_texts").fetchone()[0]
+
+    progress = Progress(None if missing_only else
+                        conn.execute("SELECT COUNT(*) FROM command_texts WHERE id > ?", (last_id,)).fetchone()[0])
+    space = embedder.space
+    encoding = storage_encoding()
+    for rows, blobs in encode_batches(embedder, read_batches(conn, last_id, batch_size, missing_only, trace),
+                                      encoding, workers, trace):
+        write_vectors(conn, space, encoding, rows, blobs, trace)
+        last_id = rows[-1][0]
+        # The mark is committed with the batch, so an interrupted run resumes here
+        with trace.stage("write"):
+            if not missing_only:
+                set_meta(conn, HIGH_WATER_KEY, last_id)
+            conn.commit()
+        progress.add(len(rows))
+    progress.finish()
+    trace.note(texts_per_s=round(progress.rate, 1))
+
+    if missing_only:
+        # Every text that existed when the run started has a vector now
+        set_meta(conn, HIGH_WATER_KEY, max(covered, last_id))
+        conn.commit()
+
+    sync_store(conn, embedder, db_path, trace)
+    return progress.done
+
+def reindex(conn, embedder, db_path, batch_size, workers=1, trace=NULL_TRACE):
+    """Re-embed the whole history in one space, resuming an interrupted run"""
+    target = get_meta(conn, 'reindex_space')
+    last_id = int(get_meta(conn, 'reindex_last_id', 0))
+
+    target = json.loads(target) if target else None
+    if target is None or tuple(target) != embedder.space:
+        last_id = 0
+
+    space = embedder.space
+    set_meta(conn, 'reindex_space', json.dumps(list(space)))
+    set_meta(conn, 'reindex_last_id', last_id)
+    conn.commit()
+
+    total = conn.execute("SELECT COUNT(*) FROM command_texts WHERE id > ?", (last_id,)).fetchone()[0]
+    print(f"Reindexing {total} command texts into {space[0]}/{space[1]}/v{space[2]}...")
+
+    progress = Progress(total)
+    encoding = storage_encoding()
+    for rows, blobs in encode_batches(embedder, read_batches(conn, last_id, batch_size, False, trace),
+                                      encoding, workers, trace):
+        write_vectors(conn, space, encoding, rows, blobs, trace)
+        last_id = rows[-1][0]
+        # Progress is committed with the batch, so an interrupted run resumes here
+        with trace.stage("write"):
+            set_meta(conn, 'reindex_last_id', last_id)
+            conn.commit()
+        progress.add(len(rows))
+    progress.finish()
+    trace.note(texts_per_s=round(progress.rate, 1))
+
+    # Every command text now has a vector in the new space; drop everything else
+    conn.execute("DELETE FROM text_embeddings WHERE model IS NOT ? OR dim IS NOT ? OR version IS NOT ?", space)
+    set_active_space(conn, space)
+    set_meta(conn, HIGH_WATER_KEY, last_id)
+    delete_meta(conn, 'reindex_space', 'reindex_last_id')
+    conn.commit()
+
+    sync_store(conn, embedder, db_path, trace)
+    return progress.done
+
+def refresh_search_index(conn, db_path, trace=NULL_TRACE):
+    """Append new command texts to the search indexes, refitting them when
+    due, so searches find nothing left to do"""
+    from repty.semantic import SemanticIndex
+
+    index = SemanticIndex(db_path)
+    if index.backend is not None:
+        index.trace = trace
+        index.refresh(conn)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate embeddings for repty commands")
+    parser.add_argument("--reindex", action="store_true",
+                        help="re-embed the whole history in a single consistent space")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="commands encoded and committed per batch")
+    parser.add_argument("--backfill", action="store_true",
+                        help="embed every waiting command text with a pool of worker processes")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="encoding processes (default: REPTY_EMBED_WORKERS or the CPU count for "
+                             "sentence-transformers with --backfill or --reindex, otherwise 1)")
+    parser.add_argument("--worker", action="store_true",
+                        help="run as the background worker: give way to a run in progress, "
+                             "then bring the search indexes up to date")
+    trace, argv = start('generate_embeddings')
+    args = parser.parse_args(argv[1:])
+
+    # Get database path from environment or use default
+    db_path = get_db_path()
+
+    # One run at a time; the background worker gives way, anything else waits
+    lock = acquire(db_path, wait=not args.worker)
+    if lock is None:
+        print("Another embedding run is in progress")
+        return
+
+    # Connect to database
+    try:
+        conn = connect(db_path)
+        ensure_history_schema(conn)
+        ensure_embedding_schema(conn)
+    except Exception as e:
+        print(f"Error connecting to database: {e}")
+        sys.exit(1)
+
+    try:
+        from repty.semantic import have_module
+        embedder = None
+        if have_module('sklearn'):
+            # Searches prefer scikit-learn, and score its TF-IDF index directly
+            print("Using scikit-learn: updating the TF-IDF search index")
+            processed = index_tfidf(conn, db_path, args.reindex, trace)
+            backend = 'tfidf'
+        else:
+            print("scikit-learn not available, trying sentence-transformers")
+            with trace.stage("load_model"):
+                embedder = get_embedder()
+            if embedder is None:
+                print("Error: Neither scikit-learn nor sentence-transformers package found.")
+                print("Please install one of them: pip install scikit-learn or pip install sentence-transformers")
+
+                # Create a flag file to indicate we attempted to generate embeddings
+                # This prevents repeated attempts that will fail
+                write_flag("Embeddings processing attempted but dependencies missing")
+                sys.exit(1)
+
+            workers = args.workers
+            if workers is None:
+                workers = default_workers() if args.backfill or args.reindex else 1
+
+            if args.reindex:
+                processed = reindex(conn, embedder, db_path, args.batch_size, workers, trace)
             else:
-                enriched_text = command_text
+                processed = embed_new(conn, embedder, db_path, args.batch_size, workers, trace)
+            backend = embedder.space[0]
+        trace.note(backend=backend, processed=processed)
+
+        if processed is None:
+            write_flag("Embedding space changed; waiting for repty reindex")
+        elif processed == 0:
+            print("No new command texts to process.")
+            write_flag("No new command texts to process")
         else:
-            enriched_text = command_text
-        
-        texts.append(enriched_text)
-        ids.append(command_id)
-    
-    # Create embeddings based on available libraries
-    success = False
-    
-    if USE_SCIKIT:
-        try:
-            # Create TF-IDF matrix
-            vectorizer = TfidfVectorizer(stop_words='english')
-            tfidf_matrix = vectorizer.fit_transform(texts)
-            
-            # Store each command's vector
-            for i, cmd_id in enumerate(ids):
-                vector = tfidf_matrix[i].toarray().flatten()
-                embedding_bytes = np.array(vector, dtype=np.float32).tobytes()
-                cursor.execute('INSERT INTO command_embeddings (command_id, embedding) VALUES (?, ?)',
-                              (cmd_id, embedding_bytes))
-            
-            conn.commit()
-            success = True
-            print(f"Generated TF-IDF embeddings for {len(ids)} commands")
-        except Exception as e:
-            print(f"Error generating TF-IDF embeddings: {e}")
-            import traceback
-            traceback.print_exc()
-    
-    if not success and not USE_SCIKIT:
+            print("Embeddings generated and stored in database" if embedder else "TF-IDF search index updated")
+            write_flag(f"Successfully processed {processed} command texts")
+        if args.worker and embedder is not None:
+            # The TF-IDF index was brought up to date above
+            refresh_search_index(conn, db_path, trace)
+    except Exception as e:
+        print(f"Error generating embeddings: {e}")
+        import traceback
+        traceback.print_exc()
+        write_flag("Attempted to process embeddings but encountered errors")
+        sys.exit(1)
+    finally:
+        # Failed runs count too, so a broken setup is not retried on every prompt
         try:
-            # Load model
-            model = SentenceTransformer('all-MiniLM-L6-v2', device="cpu")
-            
-            # Generate embeddings in batches
-            batch_size = 32
-            for i in range(0, len(texts), batch_size):
-                batch_texts = texts[i:i+batch_size]
-                batch_ids = ids[i:i+batch_size]
-                
-                # Generate embeddings
-                embeddings = model.encode(batch_texts)
-                
-                # Store embeddings
-                for j, embedding in enumerate(embeddings):
-                    cmd_id = batch_ids[j]
-                    # Convert numpy array to bytes
-                    embedding_bytes = np.array(embedding).tobytes()
-                    cursor.execute('INSERT INTO command_embeddings (command_id, embedding) VALUES (?, ?)',
-                                (cmd_id, embedding_bytes))
-            
+            set_meta(conn, FINISHED_KEY, int(time.time()))
             conn.commit()
-            success = True
-            print(f"Generated sentence-transformer embeddings for {len(ids)} commands")
-        except Exception as e:
-            print(f"Error generating sentence-transformer embeddings: {e}")
-            import traceback
-            traceback.print_exc()
-    
-    # Create flag file regardless of success to prevent repeated attempts
-    flag_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), ".embeddings_processed")
-    with open(flag_file, "w") as f:
-        if success:
-            f.write(f"Successfully processed {len(ids)} commands")
-        else:
-            f.write("Attempted to process embeddings but encountered errors")
-    
-    if success:
-        print("Embeddings generated and stored in database")
-    else:
-        print("Failed to generate embeddings. Keyword search will be used instead.")
-        
-except Exception as e:
-    print(f"Error processing commands: {e}")
-    import traceback
-    traceback.print_exc()
-    sys.exit(1)
-finally:
-    conn.close() 
\ No newline at end of file
+        except sqlite3.Error:
+            pass
+        conn.close()
+        lock.close()
+        trace.finish(db_path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/bin/bash
+#
+# Full-text matching shared by the search scripts. Source this file and call
+# match_source to get a subquery with the command, ts, cwd, exit_code and rank
+# columns of the matching commands, to use in a FROM clause:
+#
+#   match_source "$DB" "docker redis"
+#   sqlite3 "$DB" "SELECT command FROM $MATCH_SOURCE GROUP BY command ORDER BY MIN(rank)"
+#
+# Each distinct command text matches once, with its most recent run, or as
+# last seen when `repty compact` has archived all of its runs. An optional
+# third argument holds SQL conditions on the commands table (such as the
+# `where` line of `repty.query describe`); then only texts with a matching
+# run are returned, each with the most recent of those runs. With the
+# command_texts_fts index created by bootstrap.sh this is an indexed FTS5
+# MATCH ranked by bm25: every word must match as a prefix and "quoted text"
+# must match as a phrase. Without FTS5 it falls back to LIKE substring tests
+# over the texts with a constant rank.
+
+# Print the FTS5 query for free text: quoted phrases, then prefix terms
+fts_query() {
+  local text="$1"
+  local query="" phrase word
+
+  while [[ "$text" =~ \"([^\"]*)\" ]]; do
+    phrase="${BASH_REMATCH[1]}"
+    text="${text/\"$phrase\"/ }"
+    if [[ "$phrase" =~ [[:alnum:]] ]]; then
+      query+=" \"$phrase\""
+    fi
+  done
+
+  local words
+  read -ra words <<< "$text"
+  for word in "${words[@]}"; do
+    # Words without letters or digits have no tokens to match
+    if [[ "$word" =~ [[:alnum:]] ]]; then
+      query+=" \"${word//\"/\"\"}\"*"
+    fi
+  done
+
+  echo "${query# }"
+}
+
+# Print the LIKE conditions requiring every word or quoted phrase of the text
+like_conditions() {
+  local text="$1"
+  local conditions="" phrase term
+  local terms=()
+
+  while [[ "$text" =~ \"([^\"]*)\" ]]; do
+    phrase="${BASH_REMATCH[1]}"
+    text="${text/\"$phrase\"/ }"
+    terms+=("$phrase")
+  done
+  local words
+  read -ra words <<< "$text"
+  terms+=("${words[@]}")
+
+  for term in "${terms[@]}"; do
+    term="${term//\'/\'\'}"
+    conditions+="(command LIKE '%$term%' OR keywords LIKE '%$term%') AND "
+  done
+  echo "${conditions% AND }"
+}
+
+# Check once per database whether the command_texts_fts index exists
+fts_available() {
+  local db="$1"
+  if [ "$REPTY_FTS_DB" != "$db" ]; then
+    REPTY_FTS_DB="$db"
+    REPTY_FTS=$(sqlite3 "$db" "SELECT 1 FROM sqlite_master WHERE name = 'command_texts_fts'" 2>/dev/null)
+  fi
+  [ "$REPTY_FTS" = "1" ]
+}
+
+# Set MATCH_SOURCE to a subquery of the commands matching the text, and any
+# run conditions, with a rank column where lower is better
+match_source() {
+  local db="$1"
+  local text="$2"
+  local runs="$3"
+  local texts=""
+
+  if fts_available "$db"; then
+    local query
+    query=$(fts_query "$text")
+    if [ -n "$query" ]; then
+      texts="(SELECT t.*, command_texts_fts.rank AS rank
+        FROM command_texts_fts JOIN command_texts t ON t.id = command_texts_fts.rowid
+        WHERE command_texts_fts MATCH '${query//\'/\'\'}')"
+    fi
+  fi
+  if [ -z "$texts" ]; then
+    local conditions
+    conditions=$(like_conditions "$text")
+    texts="(SELECT *, 0 AS rank FROM command_texts WHERE ${conditions:-1})"
+  fi
+
+  local run="SELECT MAX(id) FROM commands WHERE text_id = t.id" matched=""
+  if [ -n "$runs" ]; then
+    run+=" AND $runs"
+    matched="WHERE c.id IS NOT NULL"
+  fi
+
+  MATCH_SOURCE="(SELECT t.command AS command,
+      COALESCE(c.ts, CAST(strftime('%s', t.last_seen) AS INTEGER)) AS ts,
+      COALESCE(c.cwd, '') AS cwd, COALESCE(c.exit_code, t.fail_count >= t.run_count) AS exit_code,
+      t.rank AS rank
+    FROM $texts t
+    LEFT JOIN commands c ON c.id = ($run) $matched)"
+}
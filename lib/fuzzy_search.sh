@@ -1,6 +1,8 @@
 #!/bin/bash
 
-DB="$HOME/.repty.db"
+DB="${REPTY_DB:-$HOME/.repty.db}"
+REPTY_LIB_DIR="$(dirname "$(realpath "$0")")"
+source "$REPTY_LIB_DIR/fts.sh"
 QUERY="$*"
 MAX_RESULTS=10  # Limit the number of results displayed
 
@@ -20,16 +22,17 @@ fi
 echo -e "${BOLD}${GREEN}Searching for commands containing: '${QUERY}'${NC}"
 echo -e "${CYAN}----------------------------------------${NC}"
 
-# Use SQLite to search for commands containing the query term
+# Use the full-text index (or LIKE without FTS5) to find matching commands,
+# best match first and the most recent run of each command
+match_source "$DB" "$QUERY"
 sqlite3 -cmd ".mode column" -cmd ".headers on" -cmd ".width 20 40 10" "$DB" "
-SELECT DISTINCT
-  datetime(timestamp) AS \"${BOLD}Timestamp${NC}\",
+SELECT
+  datetime(MAX(ts), 'unixepoch') AS \"${BOLD}Timestamp${NC}\",
   substr(cwd, 1, 40) AS \"${BOLD}Directory${NC}\",
   substr(command, 1, 40) AS \"${BOLD}Command${NC}\",
   exit_code AS \"${BOLD}Code${NC}\"
-FROM commands
-WHERE command LIKE '%$QUERY%' OR keywords LIKE '%$QUERY%'
+FROM $MATCH_SOURCE
 GROUP BY command
-ORDER BY timestamp DESC
+ORDER BY MIN(rank), MAX(ts) DESC
 LIMIT $MAX_RESULTS;
 "
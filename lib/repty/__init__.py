@@ -0,0 +1,29 @@
+"""Shared Python code for the repty search and indexing scripts"""
+import os
+
+
+def get_db_path():
+    """Return the repty database path from the environment or the default"""
+    return os.environ.get('REPTY_DB', os.path.expanduser('~/.repty.db'))
+
+
+def get_index_dir(db_path=None):
+    """Return the directory holding on-disk search indexes for a database"""
+    return (db_path or get_db_path()) + '.index'
+
+
+def replace_file(path, write):
+    """Write a file through a temporary name so readers never see it half done.
+
+    Each writer gets its own temporary file, as the search daemon, `repty nlp`
+    and the embedding worker may all rebuild the same index at once.
+    """
+    import tempfile
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
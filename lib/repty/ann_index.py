@@ -0,0 +1,251 @@
+"""Approximate nearest-neighbour search over the embedding store.
+
+An inverted-file (IVF) index in pure NumPy: spherical k-means splits the
+normalised vectors into `nlist` cells, and a query only scores the rows in the
+`nprobe` cells whose centroids are closest to it. Raising nprobe trades
+latency for recall; nprobe == nlist is an exact search.
+
+Rows are kept grouped by cell in `ivf_order.npy`/`ivf_offsets.npy`. Vectors
+appended to the store later are assigned to their nearest centroid and kept
+in a small unsorted tail (`ivf_assign.i32`) that is folded into the groups
+once it grows, and the centroids are retrained when the store has grown well
+past the size they were trained on.
+
+Usage:
+    python3 -m repty.ann_index build
+    python3 -m repty.ann_index recall [--nprobe 1,4,8,16] [--queries 200]
+"""
+import os
+import sys
+import json
+import time
+import numpy as np
+
+from repty.embedding_store import top_k
+
+# Use the index only once brute force stops being cheap
+MIN_ROWS = int(os.environ.get('REPTY_ANN_MIN_ROWS', '50000'))
+# Cells scored per query: the recall/latency knob
+NPROBE = int(os.environ.get('REPTY_ANN_NPROBE', '8'))
+
+def choose_nlist(rows):
+    """Roughly 4 * sqrt(rows) cells, the usual IVF rule of thumb"""
+    return max(1, min(rows, int(4 * np.sqrt(rows))))
+
+def assign_cells(vectors, centroids, batch_size=16384):
+    """Return the nearest centroid of every vector"""
+    cells = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch_size):
+        batch = np.asarray(vectors[start:start + batch_size], dtype=np.float32)
+        cells[start:start + batch_size] = np.argmax(batch @ centroids.T, axis=1)
+    return cells
+
+def train_centroids(vectors, nlist, iterations=15, sample_size=None, seed=0):
+    """Spherical k-means on a sample of the (normalised) vectors"""
+    rng = np.random.default_rng(seed)
+    sample_size = sample_size or min(len(vectors), max(nlist * 64, 10000))
+    sample_rows = np.sort(rng.choice(len(vectors), size=sample_size, replace=False))
+    sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        cells = assign_cells(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, cells, sample)
+        counts = np.bincount(cells, minlength=nlist)
+
+        # Re-seed empty cells from random sample rows
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()), replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = sums / norms
+    return centroids.astype(np.float32)
+
+class IvfIndex:
+    """IVF index over an EmbeddingStore, saved next to it in `index_dir`"""
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self.meta_path = os.path.join(index_dir, "ivf.json")
+        self.centroids_path = os.path.join(index_dir, "ivf_centroids.npy")
+        self.order_path = os.path.join(index_dir, "ivf_order.npy")
+        self.offsets_path = os.path.join(index_dir, "ivf_offsets.npy")
+        self.tail_path = os.path.join(index_dir, "ivf_assign.i32")
+        self.meta = None
+        self.centroids = None
+        self.order = None
+        self.offsets = None
+        self.tail = None
+
+    @property
+    def indexed_rows(self):
+        return self.meta["grouped_rows"] + len(self.tail) if self.meta else 0
+
+    def load(self, store):
+        """Load the index if it was built over this store, returning success"""
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            centroids = np.load(self.centroids_path)
+            order = np.load(self.order_path, mmap_mode='r')
+            offsets = np.load(self.offsets_path)
+            tail = np.fromfile(self.tail_path, dtype=np.int32)
+        except (OSError, ValueError):
+            return False
+
+        if store.space is None or tuple(meta["space"]) != store.space:
+            return False
+        if len(order) != meta["grouped_rows"] or meta["grouped_rows"] + len(tail) > len(store):
+            return False
+
+        self.meta = meta
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.tail = tail
+        return True
+
+    def _save_groups(self, cells, grouped_rows):
+        """Write rows [0, grouped_rows) grouped by cell, with an empty tail"""
+        nlist = len(self.centroids)
+        order = np.argsort(cells[:grouped_rows], kind='stable').astype(np.int64)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells[:grouped_rows], minlength=nlist), out=offsets[1:])
+
+        np.save(self.order_path, order)
+        np.save(self.offsets_path, offsets)
+        open(self.tail_path, "wb").close()
+        with open(self.meta_path, "w") as f:
+            json.dump(self.meta, f)
+
+        self.order = order
+        self.offsets = offsets
+        self.tail = np.zeros(0, dtype=np.int32)
+
+    def build(self, store, nlist=None):
+        """Train centroids on the store and group every row by cell"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        rows = len(store)
+        nlist = nlist or choose_nlist(rows)
+        self.centroids = train_centroids(store.matrix, nlist)
+        np.save(self.centroids_path, self.centroids)
+
+        cells = assign_cells(store.matrix, self.centroids)
+        self.meta = {"space": list(store.space), "nlist": nlist, "trained_rows": rows, "grouped_rows": rows}
+        self._save_groups(cells, rows)
+
+    def update(self, store):
+        """Index rows appended to the store since the last build or update"""
+        # Always start from the saved state: another process may have updated it
+        if not self.load(store):
+            self.meta = None
+            if len(store) >= MIN_ROWS:
+                self.build(store)
+            return
+
+        # Retrain once the store has grown well past the training set
+        if len(store) > 4 * self.meta["trained_rows"]:
+            self.build(store)
+            return
+
+        new_rows = len(store) - self.indexed_rows
+        if new_rows <= 0:
+            return
+        cells = assign_cells(store.matrix[self.indexed_rows:], self.centroids)
+        with open(self.tail_path, "ab") as f:
+            f.write(cells.tobytes())
+        self.tail = np.concatenate([self.tail, cells])
+
+        # Fold a large tail into the cell groups
+        if len(self.tail) > 0.1 * self.meta["grouped_rows"]:
+            all_cells = np.empty(self.indexed_rows, dtype=np.int32)
+            grouped = self.meta["grouped_rows"]
+            for cell in range(len(self.centroids)):
+                all_cells[self.order[self.offsets[cell]:self.offsets[cell + 1]]] = cell
+            all_cells[grouped:] = self.tail
+            self.meta["grouped_rows"] = self.indexed_rows
+            self._save_groups(all_cells, self.indexed_rows)
+
+    def candidates(self, query_vector, nprobe=None):
+        """Return store row positions in the nprobe cells nearest the query"""
+        nprobe = min(nprobe or NPROBE, len(self.centroids))
+        cells = top_k(self.centroids @ query_vector, nprobe)
+
+        parts = [np.asarray(self.order[self.offsets[cell]:self.offsets[cell + 1]]) for cell in cells]
+        if len(self.tail):
+            tail_rows = np.nonzero(np.isin(self.tail, cells))[0] + self.meta["grouped_rows"]
+            parts.append(tail_rows)
+        return np.sort(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+    def scores(self, store, query_vector, nprobe=None):
+        """Return (ids, scores) for the candidate rows of a query"""
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query_vector)
+        if norm > 0:
+            query_vector = query_vector / norm
+        rows = self.candidates(query_vector, nprobe)
+        return np.asarray(store.ids[rows]), np.asarray(store.matrix[rows]) @ query_vector
+
+def measure_recall(store, index, nprobes, queries=200, k=10, seed=0):
+    """Compare top-k against brute force for stored vectors used as queries"""
+    rng = np.random.default_rng(seed)
+    query_rows = rng.choice(len(store), size=min(queries, len(store)), replace=False)
+    results = []
+
+    exact = []
+    start = time.perf_counter()
+    for row in query_rows:
+        exact.append(set(store.search(store.matrix[row], k)[0].tolist()))
+    brute_ms = (time.perf_counter() - start) * 1000 / len(query_rows)
+
+    for nprobe in nprobes:
+        hits = 0
+        start = time.perf_counter()
+        for row, truth in zip(query_rows, exact):
+            ids, scores = index.scores(store, store.matrix[row], nprobe)
+            found = ids[top_k(scores, k)]
+            hits += len(truth.intersection(found.tolist()))
+        elapsed_ms = (time.perf_counter() - start) * 1000 / len(query_rows)
+        results.append((nprobe, hits / (len(query_rows) * k), elapsed_ms))
+    return brute_ms, results
+
+def main():
+    import argparse
+    from repty import get_index_dir
+    from repty.embedding_store import EmbeddingStore
+
+    parser = argparse.ArgumentParser(description="Build or check the approximate nearest-neighbour index")
+    parser.add_argument("action", choices=["build", "recall"])
+    parser.add_argument("--nlist", type=int, help="number of cells (default: 4 * sqrt(rows))")
+    parser.add_argument("--nprobe", default="1,4,8,16,32", help="comma separated nprobe values to check")
+    parser.add_argument("--queries", type=int, default=200, help="sampled queries for the recall check")
+    args = parser.parse_args()
+
+    store = EmbeddingStore(get_index_dir())
+    store.open()
+    if len(store) == 0:
+        print("No embeddings stored yet; run generate_embeddings.py first")
+        return 1
+
+    index = IvfIndex(store.index_dir)
+    if args.action == "build" or not index.load(store):
+        start = time.perf_counter()
+        index.build(store, args.nlist)
+        print(f"Built IVF index: {len(store)} rows, {index.meta['nlist']} cells "
+              f"in {time.perf_counter() - start:.1f}s")
+    if args.action == "build":
+        return 0
+
+    nprobes = [int(value) for value in args.nprobe.split(",")]
+    brute_ms, results = measure_recall(store, index, nprobes, args.queries)
+    print(f"Brute force: {brute_ms:.2f} ms/query over {len(store)} rows")
+    print(f"{'nprobe':>6}  {'recall@10':>9}  {'ms/query':>8}")
+    for nprobe, recall, elapsed_ms in results:
+        print(f"{nprobe:>6}  {recall:>9.3f}  {elapsed_ms:>8.2f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
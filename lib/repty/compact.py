@@ -0,0 +1,250 @@
+"""Retention for old history: archive old runs, keep their counts, reclaim space.
+
+Usage:
+    python3 -m repty.compact [--keep-days N] [--archive-dir DIR] [--no-archive] [--no-vacuum] [--dry-run]
+
+Executions older than --keep-days (REPTY_KEEP_DAYS, default 365), counted
+from UTC midnight, are:
+
+    archived   written to DIR/commands-before-YYYY-MM-DD.jsonl.gz (DIR is
+               REPTY_ARCHIVE_DIR or <db>.archive) in the JSONL format of
+               `repty export`, streamed a block of rows at a time; a later
+               compaction up to the same day writes
+               commands-before-YYYY-MM-DD.N.jsonl.gz instead, as an
+               existing archive is never overwritten
+    collapsed  into runs and failures per command text and UTC date in
+               command_days, and then deleted from commands, in one
+               transaction after the archive is written
+
+Only runs already in the database when compaction starts are archived and
+collapsed; old runs that `repty import` adds meanwhile are left for the
+next compaction, so none is deleted without being archived.
+
+The cutoff is kept in repty_meta as compacted_before, and `repty import`
+skips runs older than it, so importing an archive again does not count its
+runs twice.
+
+The command_texts dictionary keeps every text with its counts and first
+and last use, and the full-text index, TF-IDF index and embeddings are kept
+per text, so searches still find compacted commands and show them as last
+seen. Filters on time, directory, project or exit status only match the
+runs left in commands. The stats rollups (repty.stats) are left as they were.
+
+Embeddings of texts no longer in command_texts are pruned, the query cache
+is cleared, and free pages are returned to the file system with an
+incremental vacuum (a full VACUUM the first time, to turn on
+auto_vacuum = INCREMENTAL). The database size and the latency of a few
+searches are reported before and after.
+"""
+import os
+import sys
+import glob
+import time
+import socket
+import sqlite3
+import argparse
+import statistics
+
+from repty import get_db_path, get_index_dir
+from repty.db import connect, get_meta, set_meta, table_columns
+from repty.history import ensure_history_schema
+
+DEFAULT_KEEP_DAYS = 365
+# Searches timed for the report, as well as a scan of every run
+LATENCY_QUERIES = ("git commit", "docker compose up", "failed commands last week")
+FAILED = "SUM(CASE WHEN COALESCE(exit_code, 0) != 0 THEN 1 ELSE 0 END)"
+# repty_meta key: epoch seconds before which runs only live in command_days
+COMPACTED_KEY = 'compacted_before'
+
+def keep_days():
+    try:
+        return max(0, int(os.environ.get('REPTY_KEEP_DAYS', DEFAULT_KEEP_DAYS)))
+    except ValueError:
+        return DEFAULT_KEEP_DAYS
+
+def archive_dir(db_path):
+    return os.environ.get('REPTY_ARCHIVE_DIR') or db_path + '.archive'
+
+def cutoff_epoch(days, now=None):
+    """UTC midnight `days` days ago; runs before it are compacted"""
+    now = int(now if now is not None else time.time())
+    return now - now % 86400 - days * 86400
+
+def measure(conn, db_path, repeat=5):
+    """Sizes and search latencies of the database, as a dict"""
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    result = {
+        'file': os.path.getsize(db_path),
+        'free': conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size,
+        'commands': conn.execute("SELECT COUNT(*) FROM commands").fetchone()[0],
+        'texts': conn.execute("SELECT COUNT(*) FROM command_texts").fetchone()[0],
+        'embeddings': conn.execute("SELECT COUNT(*) FROM text_embeddings").fetchone()[0]
+        if 'text_id' in table_columns(conn, 'text_embeddings') else 0,
+    }
+    from repty.search import search
+    # Time the searches themselves, not the query cache
+    cache_size = os.environ.get('REPTY_QUERY_CACHE_SIZE')
+    os.environ['REPTY_QUERY_CACHE_SIZE'] = '0'
+    try:
+        for query in LATENCY_QUERIES:
+            times = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                search(db_path, conn, query, backends=('keyword',))
+                times.append((time.perf_counter() - started) * 1000)
+            result[query] = statistics.median(times)
+        started = time.perf_counter()
+        conn.execute(f"SELECT COUNT(*), {FAILED} FROM commands").fetchone()
+        result['full scan'] = (time.perf_counter() - started) * 1000
+    finally:
+        if cache_size is None:
+            del os.environ['REPTY_QUERY_CACHE_SIZE']
+        else:
+            os.environ['REPTY_QUERY_CACHE_SIZE'] = cache_size
+    return result
+
+def print_report(before, after):
+    print(f"\n{'':<34} {'before':>12} {'after':>12}")
+    for key, label in (('file', 'database file'), ('free', 'free pages')):
+        print(f"{label:<34} {before[key] / 1048576:>9.1f} MB {after[key] / 1048576:>9.1f} MB")
+    for key, label in (('commands', 'executions'), ('texts', 'command texts'), ('embeddings', 'embeddings')):
+        print(f"{label:<34} {before[key]:>12} {after[key]:>12}")
+    for key in LATENCY_QUERIES + ('full scan',):
+        label = f"search '{key}'" if key in LATENCY_QUERIES else key
+        print(f"{label:<34} {before[key]:>9.1f} ms {after[key]:>9.1f} ms")
+
+def archive(conn, directory, cutoff, last_id):
+    """Write the runs before `cutoff`, up to id `last_id`, to a new gzipped
+    JSONL file in `directory`, returning its path and how many runs it holds"""
+    from repty.export import FIELDS, open_output, rows, write_jsonl
+
+    day = time.strftime("%Y-%m-%d", time.gmtime(cutoff))
+    partial = os.path.join(directory, f"commands-before-{day}.{os.getpid()}.partial")
+    out = open_output(partial, compress=True)
+    try:
+        sql = f"SELECT {', '.join(FIELDS)} FROM commands WHERE ts < ? AND id <= ? ORDER BY ts, id"
+        count = write_jsonl(out, rows(conn, sql, (cutoff, last_id)), socket.gethostname())
+    finally:
+        out.close()
+    # The runs are deleted next, so the archive must be on disk first
+    with open(partial, "rb") as f:
+        os.fsync(f.fileno())
+    # The runs in an earlier archive are gone from the database, so take the
+    # first free name; link() fails rather than replace an existing file
+    sequence = 0
+    while True:
+        suffix = f".{sequence}" if sequence else ""
+        path = os.path.join(directory, f"commands-before-{day}{suffix}.jsonl.gz")
+        try:
+            os.link(partial, path)
+            break
+        except FileExistsError:
+            sequence += 1
+    os.remove(partial)
+    return path, count
+
+def collapse(conn, cutoff, last_id):
+    """Count the runs before `cutoff`, up to id `last_id`, in command_days,
+    delete them and record the cutoff; the caller commits"""
+    conn.execute(f'''
+    INSERT INTO command_days (text_id, day, runs, failures)
+    SELECT text_id, substr(timestamp, 1, 10), COUNT(*), {FAILED} FROM commands
+    WHERE ts < ? AND id <= ? GROUP BY text_id, substr(timestamp, 1, 10)
+    ON CONFLICT(text_id, day) DO UPDATE SET runs = runs + excluded.runs, failures = failures + excluded.failures
+    ''', (cutoff, last_id))
+    set_meta(conn, COMPACTED_KEY, max(cutoff, compacted_before(conn)))
+    return conn.execute("DELETE FROM commands WHERE ts < ? AND id <= ?", (cutoff, last_id)).rowcount
+
+def compacted_before(conn):
+    """Epoch seconds before which runs were compacted, 0 if never"""
+    try:
+        return int(get_meta(conn, COMPACTED_KEY, 0))
+    except ValueError:
+        return 0
+
+def prune_embeddings(conn, db_path):
+    """Delete embeddings of texts that are gone; the caller commits"""
+    pruned = conn.execute('''
+    DELETE FROM text_embeddings WHERE text_id NOT IN (SELECT id FROM command_texts)
+    ''').rowcount
+    if pruned:
+        # The memory-mapped store and the ANN index only ever append, so
+        # they are rebuilt from the table on the next search
+        for path in glob.glob(os.path.join(get_index_dir(db_path), "embeddings.*")) + \
+                glob.glob(os.path.join(get_index_dir(db_path), "ivf*")):
+            os.remove(path)
+    return pruned
+
+def vacuum(conn):
+    """Return free pages to the file system"""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        # Switching to incremental auto-vacuum takes one full VACUUM
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    else:
+        # Each step frees one page, and execute() only takes the first step
+        conn.executescript("PRAGMA incremental_vacuum")
+    # In WAL mode the freed pages only leave the file once checkpointed
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+def main():
+    parser = argparse.ArgumentParser(prog="repty compact", description="Archive and compact old history")
+    parser.add_argument("--keep-days", type=int, default=keep_days(),
+                        help="days of executions to keep in full (default: $REPTY_KEEP_DAYS or 365)")
+    parser.add_argument("--archive-dir", help="where archives are written (default: $REPTY_ARCHIVE_DIR or <db>.archive)")
+    parser.add_argument("--no-archive", action="store_true", help="drop old executions without archiving them")
+    parser.add_argument("--no-vacuum", action="store_true", help="leave the free pages in the database file")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be compacted")
+    args = parser.parse_args()
+
+    db_path = get_db_path()
+    try:
+        conn = connect(db_path)
+        ensure_history_schema(conn)
+    except sqlite3.Error as e:
+        print(f"Error connecting to database: {e}", file=sys.stderr)
+        return 1
+
+    cutoff = cutoff_epoch(max(0, args.keep_days))
+    day = time.strftime("%Y-%m-%d", time.gmtime(cutoff))
+    try:
+        old = conn.execute("SELECT COUNT(*) FROM commands WHERE ts < ?", (cutoff,)).fetchone()[0]
+        print(f"{old} executions from before {day} to compact")
+        if args.dry_run or not old:
+            return 0
+
+        before = measure(conn, db_path)
+        # Runs logged or imported from here on are left for the next
+        # compaction, so the archive and the delete cover the same runs
+        last_id = conn.execute("SELECT MAX(id) FROM commands").fetchone()[0]
+        if not args.no_archive:
+            directory = args.archive_dir or archive_dir(db_path)
+            os.makedirs(directory, exist_ok=True)
+            started = time.perf_counter()
+            path, archived = archive(conn, directory, cutoff, last_id)
+            print(f"Archived {archived} executions to {path} in {time.perf_counter() - started:.1f}s")
+
+        with conn:
+            collapsed = collapse(conn, cutoff, last_id)
+            pruned = prune_embeddings(conn, db_path)
+        # Cached rankings of filtered searches may list compacted runs
+        from repty import query_cache
+        query_cache.clear(conn)
+        print(f"Collapsed {collapsed} executions into per-day command counts")
+        if pruned:
+            print(f"Pruned {pruned} orphaned embeddings")
+
+        if not args.no_vacuum:
+            started = time.perf_counter()
+            vacuum(conn)
+            print(f"Vacuumed in {time.perf_counter() - started:.1f}s")
+        print_report(before, measure(conn, db_path))
+    except (OSError, sqlite3.Error) as e:
+        print(f"Error compacting history: {e}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
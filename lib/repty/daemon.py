@@ -0,0 +1,143 @@
+"""Long-lived local search daemon for `repty nlp`.
+
+The daemon keeps a SemanticIndex warm and answers queries over a Unix socket,
+so a search no longer pays for importing the backend, loading the model and
+reading the whole commands table. New rows are picked up incrementally before
+each query, and while it sits idle it starts the background embedding worker
+for the commands logged since the last run. Nothing depends on it running:
+the shell scripts fall back to the one-shot search scripts when the socket
+is missing.
+
+Usage:
+    python3 -m repty.daemon start|stop|status
+    python3 -m repty.daemon serve             # run in the foreground
+    python3 -m repty.daemon query "your query"
+"""
+import sys
+import os
+import time
+import socketserver
+
+from repty import get_db_path, unix_server
+from repty.db import connect
+from repty.embed_worker import idle_seconds, maybe_start
+from repty.unix_server import JsonHandler, send_request
+
+NAME = "Search daemon"
+
+def get_socket_path():
+    """Return the daemon socket path from the environment or the default"""
+    return os.environ.get('REPTY_SOCKET', os.path.expanduser('~/.repty.sock'))
+
+class SearchServer(socketserver.UnixStreamServer):
+    """Unix socket server owning a warm SemanticIndex"""
+
+    def __init__(self, socket_path, db_path):
+        from repty.semantic import SemanticIndex
+
+        self.db_path = db_path
+        self.stopping = False
+        self.index = SemanticIndex(db_path)
+        if self.index.backend is None:
+            raise RuntimeError("Neither scikit-learn nor sentence-transformers is available")
+        self.conn = connect(db_path)
+
+        # Warm up the backend and load the existing history before serving
+        self.index.refresh(self.conn)
+        self.index.search(self.conn, "warm up", use_cache=False)
+
+        super().__init__(socket_path, JsonHandler)
+        # handle_timeout runs every second without a request, to check the
+        # stop flag; the worker is only started after idle_seconds() of that
+        self.timeout = 1
+        self.last_active = time.monotonic()
+
+    def dispatch(self, request):
+        self.last_active = time.monotonic()
+        cmd = request.get("cmd", "search")
+        if cmd == "ping":
+            return {"ok": True, "backend": self.index.backend, "commands": len(self.index)}
+        if cmd == "shutdown":
+            self.stopping = True
+            return {"ok": True}
+        if cmd != "search":
+            return {"ok": False, "error": f"Unknown command: {cmd}"}
+
+        # Refuse to answer for a different database than the one we indexed
+        if os.path.realpath(request.get("db", self.db_path)) != os.path.realpath(self.db_path):
+            return {"ok": False, "error": "Daemon is serving a different database"}
+
+        from repty.search import format_result
+        filters = None
+        if request.get("filters"):
+            from repty.query import ParsedQuery
+            filters = ParsedQuery.from_dict(request["filters"])
+        results = self.index.search(self.conn, request["query"], request.get("limit", 10), filters)
+        return {"ok": True, "lines": [format_result(result) for result in results]}
+
+    def handle_timeout(self):
+        """Embed the commands logged since the last run while nobody is searching"""
+        if time.monotonic() - self.last_active < idle_seconds():
+            return
+        # Look again only after another idle period
+        self.last_active = time.monotonic()
+        maybe_start(self.conn, self.db_path, idle=True)
+
+    def serve_until_stopped(self):
+        while not self.stopping:
+            self.handle_request()
+        self.conn.close()
+
+def status(socket_path):
+    """Print whether the daemon is running and what it has indexed"""
+    info = unix_server.ping(NAME, socket_path)
+    if info is None:
+        return 1
+    print(f"{NAME} running on {socket_path} ({info['backend']}, {info['commands']} commands indexed)")
+    return 0
+
+def query(socket_path, db_path, text):
+    """Run a search through the daemon, printing results like repty.search"""
+    try:
+        response = send_request(socket_path, {"cmd": "search", "query": text, "db": db_path})
+    except (OSError, ValueError) as e:
+        print(f"Search daemon unavailable: {e}", file=sys.stderr)
+        return 1
+
+    if not response.get("ok"):
+        print(f"Search daemon error: {response.get('error')}", file=sys.stderr)
+        return 1
+    if not response["lines"]:
+        print("No similar commands found.")
+    for line in response["lines"]:
+        print(line)
+    return 0
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__.strip().split("Usage:")[1])
+        return 1
+
+    socket_path = get_socket_path()
+    db_path = get_db_path()
+    action = sys.argv[1]
+
+    def make_server():
+        return SearchServer(socket_path, db_path)
+
+    if action == "start":
+        return unix_server.start(NAME, socket_path, make_server)
+    if action == "serve":
+        return unix_server.serve(NAME, socket_path, make_server)
+    if action == "stop":
+        return unix_server.stop(NAME, socket_path)
+    if action == "status":
+        return status(socket_path)
+    if action == "query" and len(sys.argv) > 2:
+        return query(socket_path, db_path, ' '.join(sys.argv[2:]))
+
+    print(f"Unknown daemon command: {action}", file=sys.stderr)
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""Small helpers shared by the scripts that talk to the repty database"""
+import os
+import sqlite3
+
+from repty import get_db_path
+
+JOURNAL_MODES = ('wal', 'delete', 'truncate', 'persist')
+
+def busy_timeout():
+    """Seconds to wait for another writer's lock, from REPTY_BUSY_TIMEOUT (default 10)"""
+    try:
+        return max(0.0, float(os.environ.get('REPTY_BUSY_TIMEOUT', '10')))
+    except ValueError:
+        return 10.0
+
+def journal_mode():
+    """Journal mode of the database, from REPTY_JOURNAL_MODE (default wal)"""
+    mode = os.environ.get('REPTY_JOURNAL_MODE', 'wal').strip().lower()
+    return mode if mode in JOURNAL_MODES else 'wal'
+
+def connect(db_path=None, timeout=None):
+    """Open the repty database.
+
+    The database is switched to write-ahead logging, so searches never block
+    the shells logging commands and writers only wait for each other, and
+    the connection waits up to busy_timeout() seconds for a lock instead of
+    failing with "database is locked".
+    """
+    conn = sqlite3.connect(db_path or get_db_path(), timeout=busy_timeout() if timeout is None else timeout)
+    set_journal_mode(conn)
+    return conn
+
+def set_journal_mode(conn):
+    """Switch the database to journal_mode() if it is not in it yet"""
+    mode = journal_mode()
+    try:
+        if conn.execute("PRAGMA journal_mode").fetchone()[0] != mode:
+            conn.execute(f"PRAGMA journal_mode = {mode}")
+    except sqlite3.OperationalError:
+        # Leaving WAL needs the database to itself; try again next time
+        pass
+
+def ensure_meta_table(conn):
+    """Create the key/value table used for schema and progress bookkeeping"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS repty_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    ''')
+
+def get_meta(conn, key, default=None):
+    """Read a value from repty_meta"""
+    row = conn.execute("SELECT value FROM repty_meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+def set_meta(conn, key, value):
+    """Store a value in repty_meta; the caller commits"""
+    conn.execute("INSERT OR REPLACE INTO repty_meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+def delete_meta(conn, *keys):
+    """Remove values from repty_meta; the caller commits"""
+    conn.executemany("DELETE FROM repty_meta WHERE key = ?", [(key,) for key in keys])
+
+def table_columns(conn, table):
+    """Return the column names of a table"""
+    return [col[1] for col in conn.execute(f"PRAGMA table_info({table})").fetchall()]
@@ -0,0 +1,95 @@
+"""Encode command texts in a pool of worker processes for bulk backfills.
+
+Batches of (text_id, text) rows are encoded by `workers` processes, each
+with its own copy of the embedder, packed into the blobs stored in
+text_embeddings (repty.quantize) and handed back in the order they were
+read, so the caller can write and checkpoint them one batch at a time.
+Batches are read lazily and at most two per worker are in flight, so memory
+is bounded by the batch size however long the history is.
+
+Workers are spawned rather than forked: a forked copy of a loaded
+sentence-transformers model can deadlock in its thread pools. Each worker
+gets an even share of the CPU threads.
+"""
+import os
+import sys
+import time
+from collections import deque
+
+from repty.trace import NULL_TRACE
+
+_embedder = None
+
+def default_workers():
+    """Worker processes for a backfill, from REPTY_EMBED_WORKERS or the CPU count"""
+    try:
+        return max(1, int(os.environ.get('REPTY_EMBED_WORKERS', '0')) or os.cpu_count() or 1)
+    except ValueError:
+        return os.cpu_count() or 1
+
+def _init_worker(threads):
+    """Load the model once per worker process"""
+    global _embedder
+    for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[name] = str(threads)
+    from repty.embeddings import TransformerEmbedder
+    _embedder = TransformerEmbedder()
+
+def _encode(texts, encoding):
+    from repty.quantize import encode
+    return encode(_embedder.encode(texts), encoding)
+
+def encode_batches(embedder, batches, encoding, workers=1, trace=NULL_TRACE):
+    """Yield (rows, blobs) for each batch of (text_id, text) rows, in order"""
+    if workers <= 1:
+        from repty.quantize import encode
+        for rows in batches:
+            with trace.stage("encode") as stage:
+                blobs = encode(embedder.encode([text for _, text in rows]), encoding)
+                stage.rows = len(rows)
+            yield rows, blobs
+        return
+
+    import multiprocessing
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers, initializer=_init_worker, initargs=(threads,)) as pool:
+        in_flight = deque()
+
+        def collect():
+            rows, result = in_flight.popleft()
+            with trace.stage("encode") as stage:
+                blobs = result.get()
+                stage.rows = len(rows)
+            return rows, blobs
+
+        for rows in batches:
+            in_flight.append((rows, pool.apply_async(_encode, ([text for _, text in rows], encoding))))
+            if len(in_flight) >= 2 * workers:
+                yield collect()
+        while in_flight:
+            yield collect()
+
+class Progress:
+    """Prints texts processed and the throughput so far"""
+
+    def __init__(self, total=None):
+        self.total = total
+        self.done = 0
+        self.started = time.perf_counter()
+
+    @property
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def add(self, count):
+        self.done += count
+        done = f"{self.done}/{self.total}" if self.total is not None else str(self.done)
+        print(f"Processed {done} command texts ({self.rate:.0f} texts/s)")
+        sys.stdout.flush()
+
+    def finish(self):
+        if self.done:
+            print(f"Embedded {self.done} command texts in {time.perf_counter() - self.started:.1f}s "
+                  f"({self.rate:.0f} texts/s)")
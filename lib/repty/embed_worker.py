@@ -0,0 +1,154 @@
+"""Background worker that keeps embeddings and search indexes current.
+
+Embedding new command texts never happens on the query path. The worker
+(ext/generate_embeddings.py --worker) embeds the command texts past a
+high-water mark, the highest command_texts.id embedded so far, kept in
+repty_meta, so finding the work left is an id range rather than an anti-join
+against text_embeddings. It then brings the search indexes up to date, so
+searches find nothing to append or refit either.
+
+The worker is started detached, at most one at a time:
+
+    - by `repty ingest`, `repty log` and searches, once REPTY_EMBED_EVERY
+      (default 100) command texts are waiting, or once any are waiting and
+      the worker has not run for REPTY_EMBED_IDLE_SECONDS (default 300)
+    - by the search daemon whenever it has been idle that long
+
+Runs start at least a minute apart. REPTY_EMBED_EVERY=0 turns the
+automatic runs off. Searches use whatever is indexed and score the
+unembedded tail by keywords.
+
+Usage:
+    python3 -m repty.embed_worker status|start
+"""
+import os
+import sys
+import time
+import fcntl
+import sqlite3
+
+from repty import get_db_path
+from repty.db import get_meta
+
+# repty_meta keys: highest command text id embedded, and when the worker last finished
+HIGH_WATER_KEY = 'embedded_last_id'
+FINISHED_KEY = 'embedded_at'
+
+# Minimum time between the end of one run and the start of the next
+MIN_INTERVAL = 60
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'ext',
+                             'generate_embeddings.py')
+
+def embed_every():
+    """Waiting command texts that start the worker; 0 for never"""
+    try:
+        return max(0, int(os.environ.get('REPTY_EMBED_EVERY', '100')))
+    except ValueError:
+        return 100
+
+def idle_seconds():
+    """How long the worker may stay idle while command texts are waiting"""
+    try:
+        return max(1, int(os.environ.get('REPTY_EMBED_IDLE_SECONDS', '300')))
+    except ValueError:
+        return 300
+
+def high_water_mark(conn):
+    """Highest command text id embedded, or None before the first worker run"""
+    try:
+        value = get_meta(conn, HIGH_WATER_KEY)
+    except sqlite3.OperationalError:
+        # No repty_meta table yet
+        return None
+    return int(value) if value is not None else None
+
+def pending(conn, limit=-1):
+    """Number of command texts past the high-water mark, counting no further than `limit`"""
+    return conn.execute("SELECT COUNT(*) FROM (SELECT 1 FROM command_texts WHERE id > ? LIMIT ?)",
+                        (high_water_mark(conn) or 0, limit)).fetchone()[0]
+
+def lock_path(db_path=None):
+    return (db_path or get_db_path()) + '.embed.lock'
+
+def acquire(db_path=None, wait=False):
+    """Take the worker lock, returning the open lock file or None if it is held"""
+    lock = open(lock_path(db_path), "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+    except OSError:
+        lock.close()
+        return None
+    return lock
+
+def running(db_path=None):
+    """Check whether a worker holds the lock"""
+    lock = acquire(db_path)
+    if lock is None:
+        return True
+    lock.close()
+    return False
+
+def backend_available():
+    """Whether an embedding backend is installed, without importing it"""
+    import importlib.util
+    return any(importlib.util.find_spec(name) is not None for name in ('sklearn', 'sentence_transformers'))
+
+def start(db_path=None):
+    """Start a detached worker"""
+    import subprocess
+
+    env = dict(os.environ, REPTY_DB=db_path or get_db_path())
+    subprocess.Popen([sys.executable, WORKER_SCRIPT, "--worker"], env=env, stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+def maybe_start(conn, db_path=None, idle=False):
+    """Start the worker if enough command texts are waiting, returning whether it was started.
+
+    With idle set (the daemon has had nothing to do) any waiting text is enough.
+    """
+    every = embed_every()
+    if every == 0:
+        return False
+    try:
+        since = time.time() - float(get_meta(conn, FINISHED_KEY, 0))
+        if since < MIN_INTERVAL:
+            return False
+        # This runs after every logged command, so count no further than needed
+        waiting = pending(conn, every)
+    except sqlite3.Error:
+        return False
+    if waiting == 0 or (not idle and waiting < every and since < idle_seconds()):
+        return False
+    if running(db_path) or not backend_available():
+        return False
+    start(db_path)
+    return True
+
+def main():
+    from repty.db import connect
+
+    if len(sys.argv) != 2 or sys.argv[1] not in ('status', 'start'):
+        print("Usage: python3 -m repty.embed_worker status|start", file=sys.stderr)
+        return 1
+    conn = connect()
+    try:
+        if sys.argv[1] == 'start':
+            if running():
+                print("The embedding worker is already running")
+            else:
+                start()
+                print("Started the embedding worker")
+            return 0
+        mark = high_water_mark(conn)
+        finished = float(get_meta(conn, FINISHED_KEY, 0))
+        print(f"high-water mark: {mark if mark is not None else 'none'}")
+        print(f"waiting:         {pending(conn)} command texts")
+        print(f"last run:        {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(finished)) if finished else 'never'}")
+        print(f"running:         {'yes' if running() else 'no'}")
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""Memory-mapped matrix of command text embeddings.
+
+The vectors from the text_embeddings table are kept L2-normalised in one
+contiguous file, with an aligned file of command text ids, in the index
+directory next to the database. The file holds float32, float16 or int8
+rows with a file of per-row scales, as REPTY_EMBED_STORAGE chooses
+(repty.quantize). int8 rows are scored a block at a time with the scales
+applied to the products; float16 rows are upcast to float32 once, when
+first searched, as NumPy converts half floats far slower than it multiplies
+them, so a warm store (the search daemon) only pays for that on its first
+query, at the cost of a float32 copy in memory. Searching is a single matrix-vector product
+followed by an argpartition top-k, so query time no longer depends on
+re-encoding or decoding the history. New rows are appended by `sync`, which
+follows the text_embeddings table by increasing text_id.
+
+A store holds vectors from exactly one (model, dim, version) space. Meeting a
+row from any other space is an error: the history has to be reindexed before
+it can be searched again.
+"""
+import os
+import json
+import numpy as np
+
+from repty.quantize import Int8Matrix, decode_rows, quantize_rows, storage_encoding
+
+# Suffix of the matrix file for each encoding
+SUFFIXES = {'float32': 'f32', 'float16': 'f16', 'int8': 'i8'}
+# Rows converted to float32 at a time when scoring or upcasting a compact matrix
+SCORE_BLOCK = 1024
+
+class MixedEmbeddingSpaceError(Exception):
+    """text_embeddings holds vectors from more than one space"""
+
+def top_k(scores, k):
+    """Return the positions of the k largest scores, best first"""
+    k = min(k, len(scores))
+    if k == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < len(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind='stable')]
+
+class EmbeddingStore:
+    """Pre-normalised embeddings stored in `index_dir`"""
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self.ids_path = os.path.join(index_dir, "embeddings.ids")
+        self.scales_path = os.path.join(index_dir, "embeddings.scale")
+        self.meta_path = os.path.join(index_dir, "embeddings.json")
+        self.space = None
+        self.encoding = 'float32'
+        self.dim = None
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        # float32 copy of a float16 matrix, made on the first search
+        self.upcast = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def vectors_path(self):
+        return os.path.join(self.index_dir, "embeddings." + SUFFIXES[self.encoding])
+
+    @property
+    def dtype(self):
+        return np.dtype(self.encoding)
+
+    @property
+    def last_id(self):
+        return int(self.ids[-1]) if len(self.ids) else 0
+
+    def open(self):
+        """Map the stored matrix, dropping any half-written trailing row"""
+        self.upcast = None
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            self.space = tuple(meta["space"])
+            # Stores from before compact encodings are float32
+            self.encoding = meta.get("encoding", 'float32')
+            self.dim = self.space[1]
+            paths = [self.vectors_path, self.ids_path] + ([self.scales_path] if self.encoding == 'int8' else [])
+            sizes = [os.path.getsize(path) for path in paths]
+        except (OSError, ValueError, KeyError):
+            self.space = None
+            self.dim = None
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+            self.ids = np.zeros(0, dtype=np.int64)
+            return
+
+        row_bytes = [self.dim * self.dtype.itemsize, 8, 4]
+        count = min(size // width for size, width in zip(sizes, row_bytes))
+
+        # Vectors are appended before ids, so an interrupted sync can leave
+        # them out of step; cut them all back to the rows they have in common
+        for path, size, width in zip(paths, sizes, row_bytes):
+            if size != count * width:
+                os.truncate(path, count * width)
+
+        if count:
+            matrix = np.memmap(self.vectors_path, dtype=self.dtype, mode='r', shape=(count, self.dim))
+            if self.encoding == 'int8':
+                matrix = Int8Matrix(matrix, np.memmap(self.scales_path, dtype=np.float32, mode='r', shape=(count,)))
+            self.matrix = matrix
+            self.ids = np.memmap(self.ids_path, dtype=np.int64, mode='r', shape=(count,))
+        else:
+            self.matrix = np.zeros((0, self.dim), dtype=np.float32)
+            self.ids = np.zeros(0, dtype=np.int64)
+
+    def reset(self, space, encoding='float32'):
+        """Start an empty store for vectors of the given (model, dim, version) space"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        for suffix in list(SUFFIXES.values()) + ["scale"]:
+            try:
+                os.remove(os.path.join(self.index_dir, "embeddings." + suffix))
+            except FileNotFoundError:
+                pass
+        self.encoding = encoding
+        for path in (self.vectors_path, self.ids_path) + ((self.scales_path,) if encoding == 'int8' else ()):
+            open(path, "wb").close()
+        with open(self.meta_path, "w") as f:
+            json.dump({"space": list(space), "encoding": encoding}, f)
+        self.open()
+
+    def append(self, ids, vectors):
+        """Normalise and append vectors for the given text ids"""
+        if not len(ids):
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dim)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors = vectors / norms
+
+        if self.encoding == 'int8':
+            vectors, scales = quantize_rows(vectors)
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(vectors).tobytes())
+            with open(self.scales_path, "ab") as f:
+                f.write(scales.tobytes())
+        else:
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(vectors, dtype=self.dtype).tobytes())
+        with open(self.ids_path, "ab") as f:
+            f.write(np.asarray(ids, dtype=np.int64).tobytes())
+        self.open()
+
+    def sync(self, conn, space, batch_size=10000):
+        """Append embeddings added to text_embeddings since the last sync"""
+        space = tuple(space)
+        encoding = storage_encoding()
+        self.open()
+        if self.space != space or self.encoding != encoding:
+            self.reset(space, encoding)
+
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT text_id, embedding, model, dim, version, encoding FROM text_embeddings
+        WHERE text_id > ? ORDER BY text_id
+        ''', (self.last_id,))
+        added = 0
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                if (row[2], row[3], row[4]) != space:
+                    raise MixedEmbeddingSpaceError(
+                        f"Embedding for command text {row[0]} is from {row[2]}/{row[3]}/v{row[4]}, "
+                        f"not {space[0]}/{space[1]}/v{space[2]}; run 'repty reindex'")
+            vectors = decode_rows([(row[1], row[5]) for row in rows], space[1])
+            self.append([row[0] for row in rows], vectors)
+            added += len(rows)
+        return added
+
+    def scores(self, query_vector, rows=None):
+        """Return the cosine similarity of the query to every stored vector,
+        or to those at positions `rows`"""
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query_vector)
+        if norm > 0:
+            query_vector = query_vector / norm
+        if rows is not None:
+            return np.asarray(self.matrix[rows], dtype=np.float32) @ query_vector
+        if self.encoding == 'float32' or not len(self):
+            return self.matrix @ query_vector
+        if self.encoding == 'int8':
+            return self.matrix.dot(query_vector, SCORE_BLOCK)
+        return self.float32_matrix() @ query_vector
+
+    def float32_matrix(self):
+        """The float16 matrix as float32, converted a block at a time on first use"""
+        if self.upcast is None:
+            upcast = np.empty(self.matrix.shape, dtype=np.float32)
+            for start in range(0, len(self), SCORE_BLOCK):
+                upcast[start:start + SCORE_BLOCK] = self.matrix[start:start + SCORE_BLOCK]
+            self.upcast = upcast
+        return self.upcast
+
+    def search(self, query_vector, k):
+        """Return (ids, scores) of the k stored vectors most similar to the query"""
+        scores = self.scores(query_vector)
+        top = top_k(scores, k)
+        return np.asarray(self.ids[top]), scores[top]
@@ -0,0 +1,88 @@
+"""Embedding backends and the versioned vector space they write into.
+
+Every row in text_embeddings records the space it was produced in as
+(model, dim, version). Vectors from different spaces cannot be compared, so
+the active space is kept in repty_meta and search refuses rows from any other
+space until `repty reindex` has re-embedded the history in a single space.
+
+Sentence-transformers vectors are defined by the model name and
+EMBEDDING_VERSION. TF-IDF vectors are not stored here: scikit-learn searches
+score the TF-IDF index they keep themselves (repty.tfidf_index).
+
+How each row's vector is stored (float32, float16 or int8) is recorded in
+its encoding column; see repty.quantize.
+
+NumPy is only imported by the embedders, so reading the active space stays
+cheap for searches answered from the query cache.
+"""
+import json
+
+from repty.db import ensure_meta_table, get_meta, set_meta, table_columns
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+# Bump when the text fed to the model changes, e.g. how keywords are added
+EMBEDDING_VERSION = 1
+
+def ensure_embedding_schema(conn):
+    """Create text_embeddings, one vector per distinct command text"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS text_embeddings (
+        text_id INTEGER PRIMARY KEY,
+        embedding BLOB,
+        model TEXT,
+        dim INTEGER,
+        version INTEGER,
+        encoding TEXT,
+        FOREIGN KEY (text_id) REFERENCES command_texts(id)
+    )
+    ''')
+    if 'encoding' not in table_columns(conn, 'text_embeddings'):
+        # Rows from before encodings were recorded are float32 (NULL)
+        conn.execute("ALTER TABLE text_embeddings ADD COLUMN encoding TEXT")
+    ensure_meta_table(conn)
+    conn.commit()
+
+def get_active_space(conn):
+    """Return the (model, dim, version) every stored vector belongs to, if any"""
+    value = get_meta(conn, 'embedding_space')
+    return tuple(json.loads(value)) if value else None
+
+def set_active_space(conn, space):
+    set_meta(conn, 'embedding_space', json.dumps(list(space)))
+
+def claim_space(conn, space):
+    """Check that vectors from `space` may be stored and searched.
+
+    An empty table adopts the space; otherwise it must match the active one.
+    """
+    active = get_active_space(conn)
+    if active is None and conn.execute("SELECT 1 FROM text_embeddings LIMIT 1").fetchone() is None:
+        set_active_space(conn, space)
+        conn.commit()
+        return True
+    return active == tuple(space)
+
+def embedding_text(command, keywords):
+    """Text fed to the embedding backends for a command text"""
+    command = command or ""
+    # Enrich text with keywords if available
+    if keywords:
+        return f"{command} {keywords} {keywords}"
+    return command
+
+class TransformerEmbedder:
+    """Sentence-transformers embeddings"""
+
+    model_name = MODEL_NAME
+
+    def __init__(self):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(MODEL_NAME, device="cpu")
+
+    @property
+    def space(self):
+        return (MODEL_NAME, self.model.get_sentence_embedding_dimension(), EMBEDDING_VERSION)
+
+    def encode(self, texts):
+        import numpy as np
+        return np.asarray(self.model.encode(texts), dtype=np.float32)
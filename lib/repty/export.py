@@ -0,0 +1,184 @@
+"""Stream the command history to Markdown, JSONL or CSV.
+
+Usage:
+    python3 -m repty.export [--format md|jsonl|csv] [--gzip] [--since DATE] [--until DATE]
+                            [--project NAME] [--cwd DIR] [OUTPUT]
+
+OUTPUT defaults to ~/repty_history.<format>, and - writes to stdout. The
+format and compression follow the extension of OUTPUT (.md, .jsonl, .csv,
+with .gz for gzip) unless given. --since and --until take YYYY-MM-DD dates
+(local midnight; --until is exclusive) or epoch seconds; --cwd keeps runs
+in that directory or below it.
+
+The export is one query over the time index, or the project or directory
+index when filtering by those (the same conditions searches use, see
+repty.query), read a block of rows at a time and written as it is read,
+so memory use does not depend on the size of the history. Markdown lists
+the newest runs first, grouped by date; JSONL and CSV list the oldest
+first, one run per line, with the fields `repty import` reads:
+
+    command, timestamp, ts, cwd, exit_code, git_project, session_id, host
+
+Runs from this machine are exported with its host name. With
+REPTY_EXPLAIN set, the query plan is printed instead.
+"""
+import io
+import os
+import re
+import sys
+import csv
+import gzip
+import json
+import time
+import socket
+import sqlite3
+import argparse
+
+from repty import get_db_path
+from repty.db import connect
+from repty.query import ParsedQuery, parse_date
+
+FORMATS = ('md', 'jsonl', 'csv')
+FIELDS = ('command', 'timestamp', 'ts', 'cwd', 'exit_code', 'git_project', 'session_id', 'host')
+
+def parse_bound(text):
+    """Epoch seconds of a YYYY-MM-DD date or an epoch given as text"""
+    if re.fullmatch(r"\d{4}-\d{2}-\d{2}", text):
+        return parse_date(text)
+    if text.isdigit():
+        return int(text)
+    raise argparse.ArgumentTypeError(f"expected YYYY-MM-DD or epoch seconds, not {text!r}")
+
+def export_sql(conn, filters, newest_first):
+    """The export query and its parameters"""
+    conditions, params = filters.conditions(conn)
+    where = " AND ".join(["ts IS NOT NULL"] + conditions)
+    order = "DESC" if newest_first else "ASC"
+    return (f"SELECT {', '.join(FIELDS)} FROM commands WHERE {where} ORDER BY ts {order}, id {order}",
+            params)
+
+def rows(conn, sql, params, block=1000):
+    """Yield the rows of a query a block at a time"""
+    cursor = conn.execute(sql, params)
+    while True:
+        batch = cursor.fetchmany(block)
+        if not batch:
+            return
+        yield from batch
+
+def write_markdown(out, records):
+    """Newest first, with a heading for every date; returns the row count"""
+    out.write("# Repty Command History\n")
+    out.write(f"Generated on {time.strftime('%a %b %d %H:%M:%S %Z %Y')}\n\n")
+    out.write("## Commands by Date\n\n")
+    current_date = None
+    count = 0
+    for command, timestamp, _, cwd, exit_code, _, _, _ in records:
+        date, clock = timestamp[:10], timestamp[11:19]
+        if date != current_date:
+            if current_date is not None:
+                out.write("\n")
+            out.write(f"### {date}\n\n")
+            current_date = date
+        status = "Yes" if exit_code == 0 else "No"
+        out.write(f"- {status} **{clock}** `{command}` (in `{cwd}`)\n")
+        count += 1
+    out.write(f"\nTotal commands exported: {count}\n")
+    return count
+
+def write_jsonl(out, records, host):
+    count = 0
+    for record in records:
+        values = dict(zip(FIELDS, record))
+        values["host"] = values["host"] or host
+        out.write(json.dumps(values, ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+def write_csv(out, records, host):
+    writer = csv.writer(out)
+    writer.writerow(FIELDS)
+    count = 0
+    for record in records:
+        writer.writerow(record[:-1] + (record[-1] or host,))
+        count += 1
+    return count
+
+def open_output(path, compress):
+    """A text stream for the output path, or stdout for -"""
+    if path == "-":
+        binary = sys.stdout.buffer
+        if compress:
+            binary = gzip.GzipFile(fileobj=binary, mode="wb", compresslevel=6)
+        return io.TextIOWrapper(binary, encoding="utf-8", newline="", write_through=False)
+    if compress:
+        return io.TextIOWrapper(gzip.open(path, "wb", compresslevel=6), encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+def export(conn, out, fmt, filters):
+    """Write every run matching the filters to `out`, returning how many"""
+    records = rows(conn, *export_sql(conn, filters, newest_first=fmt == 'md'))
+    if fmt == 'md':
+        return write_markdown(out, records)
+    host = socket.gethostname()
+    if fmt == 'jsonl':
+        return write_jsonl(out, records, host)
+    return write_csv(out, records, host)
+
+def main():
+    parser = argparse.ArgumentParser(prog="repty export", description="Export the command history")
+    parser.add_argument("output", nargs="?", help="output file, - for stdout (default: ~/repty_history.<format>)")
+    parser.add_argument("--format", choices=FORMATS, help="output format (default: from the extension, or md)")
+    parser.add_argument("--gzip", action="store_true", help="gzip the output (default: for .gz outputs)")
+    parser.add_argument("--since", type=parse_bound, help="only runs from this date on")
+    parser.add_argument("--until", type=parse_bound, help="only runs before this date")
+    parser.add_argument("--project", help="only runs in this git project")
+    parser.add_argument("--cwd", help="only runs in this directory or below it")
+    args = parser.parse_args()
+
+    output = args.output
+    name = (output or "").lower()
+    compress = args.gzip or name.endswith(".gz")
+    fmt = args.format
+    if fmt is None:
+        base = name[:-3] if name.endswith(".gz") else name
+        fmt = next((ext for ext in FORMATS if base.endswith("." + ext)), 'md')
+    if output is None:
+        output = os.path.expanduser(f"~/repty_history.{fmt}" + (".gz" if compress else ""))
+    cwd = None
+    if args.cwd:
+        cwd = os.path.abspath(os.path.expanduser(args.cwd)).rstrip("/") or "/"
+    filters = ParsedQuery(since=args.since, until=args.until, git_project=args.project, cwd=cwd)
+
+    try:
+        conn = connect()
+    except sqlite3.Error as e:
+        print(f"Error connecting to database: {e}", file=sys.stderr)
+        return 1
+
+    try:
+        if os.environ.get('REPTY_EXPLAIN'):
+            sql, params = export_sql(conn, filters, newest_first=fmt == 'md')
+            print("\n".join(["QUERY PLAN"] + [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]))
+            return 0
+        out = open_output(output, compress)
+        try:
+            count = export(conn, out, fmt, filters)
+        finally:
+            out.close()
+    except BrokenPipeError:
+        # The reader of stdout went away (e.g. `| head`); nothing left to write to
+        os.dup2(os.open(os.devnull, os.O_WRONLY), 1)
+        return 0
+    except (OSError, sqlite3.Error) as e:
+        print(f"Error exporting history: {e}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+
+    if output != "-":
+        print(f"Exported {count} commands to {output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"""Command executions and the deduplicated command_texts dictionary.
+
+Every distinct command text is stored once in command_texts, keyed by the
+SHA-1 of the text, together with its keywords, how often it ran and failed,
+and when it was first and last seen. Each row in commands is one execution
+and points at its text through commands.text_id.
+
+Embeddings, the TF-IDF index and the full-text index are built per text, so
+a history full of repeated `git status` is embedded and searched once per
+distinct command instead of once per run.
+
+Executions also carry their time as integer epoch seconds in commands.ts,
+indexed alone and after cwd, git_project, session_id and exit_code, so time
+and context filters are index range lookups instead of scans that apply
+date functions to the timestamp text.
+
+Usage:
+    python3 -m repty.history migrate
+"""
+import os
+import sys
+import calendar
+import hashlib
+from datetime import datetime
+
+from repty import get_db_path, get_index_dir
+from repty.db import connect, ensure_meta_table, get_meta, set_meta, table_columns
+from repty.stats import add_runs, ensure_rollups, ensure_stats_schema
+from repty.terms import extract_keywords
+
+# Index files keyed by commands.id before texts were deduplicated
+COMMAND_ID_INDEX_FILES = (
+    "tfidf_vocab.json", "tfidf_idf.npy", "tfidf_matrix.npz", "tfidf_ids.npy", "tfidf_meta.json",
+    "embeddings.f32", "embeddings.ids", "embeddings.json",
+    "ivf.json", "ivf_centroids.npy", "ivf_order.npy", "ivf_offsets.npy", "ivf_assign.i32",
+)
+
+# Indexes used by the time and context filters, as (name, columns)
+COMMAND_INDEXES = (
+    ("commands_ts", "ts"),
+    ("commands_cwd_ts", "cwd, ts"),
+    ("commands_git_project_ts", "git_project, ts"),
+    ("commands_session_ts", "session_id, ts"),
+    ("commands_exit_code_ts", "exit_code, ts"),
+)
+
+def epoch_seconds(timestamp):
+    """Epoch seconds of a 'YYYY-MM-DD HH:MM:SS' UTC timestamp, or None"""
+    # fromisoformat is several times faster than strptime on bulk inserts,
+    # but accepts more than the one format timestamps are written in
+    if not isinstance(timestamp, str) or len(timestamp) != 19 or timestamp[10] != " ":
+        return None
+    try:
+        return calendar.timegm(datetime.fromisoformat(timestamp).timetuple())
+    except ValueError:
+        return None
+
+def text_hash(command):
+    """Content hash identifying a command text"""
+    return hashlib.sha1((command or "").encode("utf-8", "surrogatepass")).hexdigest()
+
+def ensure_history_schema(conn):
+    """Create command_texts, link older executions to it and commit"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS command_texts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        hash TEXT UNIQUE,
+        command TEXT,
+        keywords TEXT,
+        run_count INTEGER DEFAULT 0,
+        fail_count INTEGER DEFAULT 0,
+        first_seen TEXT,
+        last_seen TEXT
+    )
+    ''')
+    columns = table_columns(conn, 'commands')
+    if 'text_id' not in columns:
+        conn.execute("ALTER TABLE commands ADD COLUMN text_id INTEGER REFERENCES command_texts(id)")
+    if 'ts' not in columns:
+        conn.execute("ALTER TABLE commands ADD COLUMN ts INTEGER")
+    if 'host' not in columns:
+        conn.execute("ALTER TABLE commands ADD COLUMN host TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS commands_text_id ON commands(text_id)")
+    for name, index_columns in COMMAND_INDEXES:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON commands({index_columns})")
+    ensure_meta_table(conn)
+    ensure_stats_schema(conn)
+    conn.commit()
+
+    if conn.execute("SELECT 1 FROM commands WHERE ts IS NULL AND timestamp IS NOT NULL LIMIT 1").fetchone():
+        backfill_ts(conn)
+
+    if get_meta(conn, 'command_texts') is None:
+        migrate(conn)
+    elif conn.execute("SELECT 1 FROM commands WHERE text_id IS NULL LIMIT 1").fetchone():
+        # Rows written by something other than record_commands
+        backfill_texts(conn)
+    ensure_rollups(conn)
+
+def _upsert_texts(conn, texts):
+    """Add or update command_texts rows and return {hash: text_id}.
+
+    `texts` maps each hash to [hash, command, keywords, runs, failures,
+    first_seen, last_seen] for the executions being added.
+    """
+    conn.executemany('''
+    INSERT INTO command_texts (hash, command, keywords, run_count, fail_count, first_seen, last_seen)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(hash) DO UPDATE SET
+        run_count = run_count + excluded.run_count,
+        fail_count = fail_count + excluded.fail_count,
+        first_seen = MIN(COALESCE(first_seen, excluded.first_seen), COALESCE(excluded.first_seen, first_seen)),
+        last_seen = MAX(COALESCE(last_seen, excluded.last_seen), COALESCE(excluded.last_seen, last_seen))
+    ''', list(texts.values()))
+
+    hashes = list(texts)
+    text_ids = {}
+    for start in range(0, len(hashes), 500):
+        chunk = hashes[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        for hash_, text_id in conn.execute(
+                f"SELECT hash, id FROM command_texts WHERE hash IN ({placeholders})", chunk):
+            text_ids[hash_] = text_id
+    return text_ids
+
+def _add_run(texts, command, keywords, timestamp, exit_code, hashes=None):
+    """Count one execution of a command text, remembering its hash in `hashes`"""
+    if hashes is None:
+        key = text_hash(command)
+    else:
+        key = hashes.get(command)
+        if key is None:
+            key = hashes[command] = text_hash(command)
+    failed = 1 if exit_code else 0
+    entry = texts.get(key)
+    if entry is None:
+        texts[key] = [key, command, keywords, 1, failed, timestamp, timestamp]
+    else:
+        entry[3] += 1
+        entry[4] += failed
+        if timestamp and (entry[5] is None or timestamp < entry[5]):
+            entry[5] = timestamp
+        if timestamp and (entry[6] is None or timestamp > entry[6]):
+            entry[6] = timestamp
+    return key
+
+def record_commands(conn, rows):
+    """Insert executions and count them in command_texts and the stats
+    rollups (repty.stats); the caller commits.
+
+    `rows` are (command, timestamp, cwd, exit_code, git_project, session_id,
+    keywords) tuples, optionally followed by the host the command ran on
+    (None for this machine).
+    """
+    if not rows:
+        return
+    texts = {}
+    # Batches repeat the same commands, so hash each once
+    hashes = {}
+    keys = [_add_run(texts, row[0], row[6], row[1], row[3], hashes) for row in rows]
+    text_ids = _upsert_texts(conn, texts)
+    conn.executemany('''
+    INSERT INTO commands (command, timestamp, cwd, exit_code, git_project, session_id, keywords, host, text_id, ts)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [tuple(row[:7]) + (row[7] if len(row) > 7 else None, text_ids[key], epoch_seconds(row[1]))
+          for row, key in zip(rows, keys)])
+    add_runs(conn, [(row[1], row[2], row[3], row[4], text_ids[key]) for row, key in zip(rows, keys)])
+
+def backfill_ts(conn):
+    """Fill commands.ts from the timestamp text of older rows and commit"""
+    conn.execute('''
+    UPDATE commands SET ts = CAST(strftime('%s', timestamp) AS INTEGER)
+    WHERE ts IS NULL AND timestamp IS NOT NULL
+    ''')
+    conn.commit()
+
+def latest_runs(conn, text_ids, conditions=(), params=()):
+    """Return {text_id: (text_id, command, timestamp, cwd, exit_code)} of the
+    most recent run of each command text, for displaying search results.
+
+    With conditions on the commands table (see repty.query), the most recent
+    run that satisfies them is shown. Without, texts whose runs were all
+    compacted away (repty.compact) are shown as last seen, with no directory.
+    """
+    runs = {}
+    text_ids = [int(text_id) for text_id in text_ids]
+    where = "".join(f" AND {condition}" for condition in conditions)
+    join = "JOIN" if conditions else "LEFT JOIN"
+    for start in range(0, len(text_ids), 500):
+        chunk = text_ids[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        for row in conn.execute(f'''
+        SELECT t.id, t.command, COALESCE(c.timestamp, t.last_seen), COALESCE(c.cwd, ''),
+               COALESCE(c.exit_code, t.fail_count >= t.run_count)
+        FROM command_texts t {join} commands c
+            ON c.id = (SELECT MAX(id) FROM commands WHERE text_id = t.id{where})
+        WHERE t.id IN ({placeholders})
+        ''', list(params) + chunk):
+            runs[row[0]] = row
+    return runs
+
+def backfill_texts(conn, batch_size=10000):
+    """Link executions without a text_id to command_texts, committing per batch"""
+    keywords = "keywords" if 'keywords' in table_columns(conn, 'commands') else "NULL"
+    linked = 0
+    while True:
+        rows = conn.execute(f'''
+        SELECT id, command, timestamp, exit_code, {keywords}, cwd, git_project FROM commands
+        WHERE text_id IS NULL ORDER BY id LIMIT ?
+        ''', (batch_size,)).fetchall()
+        if not rows:
+            return linked
+
+        texts = {}
+        keys = [_add_run(texts, command, kw if kw is not None else extract_keywords(command or ""), timestamp, code)
+                for _, command, timestamp, code, kw, _, _ in rows]
+        text_ids = _upsert_texts(conn, texts)
+        conn.executemany("UPDATE commands SET text_id = ? WHERE id = ?",
+                         [(text_ids[key], row[0]) for row, key in zip(rows, keys)])
+        add_runs(conn, [(timestamp, cwd, code, project, text_ids[key])
+                        for (_, _, timestamp, code, _, cwd, project), key in zip(rows, keys)])
+        conn.commit()
+        linked += len(rows)
+
+def migrate(conn):
+    """Move a history from per-execution to per-text indexing"""
+    from repty.embeddings import ensure_embedding_schema
+
+    linked = backfill_texts(conn)
+    ensure_embedding_schema(conn)
+
+    # Identical texts have identical vectors, so keep one per text
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'command_embeddings'").fetchone():
+        columns = table_columns(conn, 'command_embeddings')
+        space = ", ".join(f"e.{col}" if col in columns else "NULL" for col in ("model", "dim", "version"))
+        conn.execute(f'''
+        INSERT OR IGNORE INTO text_embeddings (text_id, embedding, model, dim, version)
+        SELECT c.text_id, e.embedding, {space}
+        FROM command_embeddings e JOIN commands c ON c.id = e.command_id
+        ORDER BY e.command_id
+        ''')
+        conn.execute("DROP TABLE command_embeddings")
+
+    set_meta(conn, 'command_texts', 1)
+    conn.commit()
+
+    # On-disk indexes were keyed by command id; they are rebuilt per text
+    index_dir = get_index_dir(conn_path(conn))
+    for name in COMMAND_ID_INDEX_FILES:
+        try:
+            os.remove(os.path.join(index_dir, name))
+        except FileNotFoundError:
+            pass
+    return linked
+
+def conn_path(conn):
+    """Return the file name of the main database of a connection"""
+    for _, name, path in conn.execute("PRAGMA database_list"):
+        if name == "main":
+            return path
+    return get_db_path()
+
+def main():
+    if sys.argv[1:] != ['migrate']:
+        print("Usage: python3 -m repty.history migrate", file=sys.stderr)
+        return 1
+    conn = connect()
+    try:
+        ensure_history_schema(conn)
+        texts = conn.execute("SELECT COUNT(*) FROM command_texts").fetchone()[0]
+        runs = conn.execute("SELECT COUNT(*) FROM commands").fetchone()[0]
+        print(f"{runs} commands, {texts} distinct command texts")
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
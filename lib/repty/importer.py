@@ -0,0 +1,319 @@
+"""Bulk importer for existing shell history files and repty exports.
+
+Usage:
+    python3 -m repty.importer [--format auto|zsh|bash|jsonl] [--host NAME] [--batch-size N] [FILE ...]
+
+FILE defaults to $REPTY_HISTORY_FILE (~/.zsh_history), and - reads stdin;
+files ending in .gz are decompressed as they are read. The format is
+detected from the first line:
+
+    zsh    extended history, ": <epoch>:<duration>;<command>", with
+           backslash-continued lines for multi-line commands
+    bash   one command per line, each at the time of the last "#<epoch>"
+           line before it (written with HISTTIMEFORMAT set); lines before
+           the first are dated a second apart, ending just before it or at
+           the file's modification time, and held in memory until then
+    jsonl  one object per line as written by `repty export --format jsonl`:
+           command, timestamp ("YYYY-MM-DD HH:MM:SS" UTC) or ts (epoch),
+           cwd, exit_code, git_project, session_id, host
+
+Shell history files do not record the directory or exit status, so their
+commands are imported with no directory and exit code 0. Commands logged on
+another machine keep its host name; runs from this machine have no host.
+
+Files are read a line at a time and imported in batches of --batch-size
+rows, each one transaction, so memory stays constant however long the
+history is. A run already in the database with the same command, time
+and host is skipped, and so is a run from before the cutoff of the last
+`repty compact`, which is only counted in command_days now. Importing a
+file again, or an archive written by `repty compact`, only adds what is new.
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import socket
+import sqlite3
+import argparse
+
+from repty import get_db_path
+from repty.compact import compacted_before
+from repty.db import connect
+from repty.history import ensure_history_schema, epoch_seconds, record_commands
+from repty.terms import extract_keywords
+from repty.trace import NULL_TRACE, start
+
+FORMATS = ('zsh', 'bash', 'jsonl')
+# Commands whose keywords are remembered between batches
+KEYWORD_CACHE_SIZE = 100000
+
+def history_file():
+    return os.environ.get('REPTY_HISTORY_FILE') or os.path.expanduser("~/.zsh_history")
+
+def unmetafy(line):
+    """Undo zsh's escaping of bytes it treats specially in history files"""
+    if b"\x83" not in line:
+        return line
+    out = bytearray()
+    meta = False
+    for byte in line:
+        if meta:
+            out.append(byte ^ 32)
+            meta = False
+        elif byte == 0x83:
+            meta = True
+        else:
+            out.append(byte)
+    return bytes(out)
+
+def detect_format(first_line):
+    """Guess the format of a history file from its first non-empty line"""
+    if first_line.startswith(b": ") and b";" in first_line:
+        return 'zsh'
+    if first_line.lstrip().startswith(b"{"):
+        return 'jsonl'
+    return 'bash'
+
+def parse_zsh(lines):
+    """Yield (epoch, command) from zsh extended history"""
+    entry = None
+    for raw in lines:
+        line = unmetafy(raw.rstrip(b"\n")).decode("utf-8", "replace")
+        if entry is not None:
+            # The previous line ended in a backslash: this one continues it
+            entry[1] = entry[1][:-1] + "\n" + line
+        elif line.startswith(": ") and ";" in line:
+            header, command = line[2:].split(";", 1)
+            try:
+                entry = [int(header.split(":", 1)[0]), command]
+            except ValueError:
+                continue
+        else:
+            # Plain history lines have no time to import them at
+            continue
+        if not entry[1].endswith("\\"):
+            yield entry[0], entry[1]
+            entry = None
+    if entry is not None:
+        yield entry[0], entry[1]
+
+def parse_bash(lines, default_epoch):
+    """Yield (epoch, command) from bash history, one command per line as
+    bash reads it back, each at the last #<epoch> line before it.
+
+    Commands before the first #<epoch> line get times a second apart that
+    end before it, or at `default_epoch` when there is none, so repeated
+    commands stay separate runs instead of being taken for one.
+    """
+    epoch = None
+    untimed = []
+    for raw in lines:
+        line = raw.rstrip(b"\n").decode("utf-8", "replace")
+        if line.startswith("#") and line[1:].isdigit():
+            if epoch is None:
+                yield from _spread(untimed, int(line[1:]) - 1)
+                untimed = []
+            epoch = int(line[1:])
+        elif line:
+            if epoch is None:
+                untimed.append(line)
+            else:
+                yield epoch, line
+    yield from _spread(untimed, default_epoch)
+
+def _spread(commands, last_epoch):
+    """Yield the commands a second apart, the last at `last_epoch`"""
+    first = last_epoch - len(commands) + 1
+    for n, command in enumerate(commands):
+        yield first + n, command
+
+def parse_jsonl(lines):
+    """Yield row dicts from a repty JSONL export, skipping lines that are not one"""
+    for raw in lines:
+        try:
+            record = json.loads(raw)
+        except ValueError:
+            continue
+        if isinstance(record, dict) and record.get("command"):
+            yield record
+
+class Importer:
+    """Turns parsed records into commands rows and loads them in batches"""
+
+    def __init__(self, conn, host=None, batch_size=50000, trace=NULL_TRACE):
+        self.conn = conn
+        self.local_host = socket.gethostname()
+        self.host = self.normalise_host(host)
+        self.batch_size = batch_size
+        self.trace = trace
+        self.keywords = {}
+        self.batch = []
+        self.read = 0
+        self.imported = 0
+        # Runs before this were archived and counted by `repty compact`
+        self.cutoff = compacted_before(conn)
+        self.compacted = 0
+        conn.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS import_keys (pos INTEGER PRIMARY KEY, ts INTEGER, command TEXT, host TEXT)
+        ''')
+
+    def normalise_host(self, host):
+        """Runs from this machine are stored without a host"""
+        return None if not host or host == self.local_host else host
+
+    def keywords_of(self, command):
+        keywords = self.keywords.get(command)
+        if keywords is None:
+            if len(self.keywords) >= KEYWORD_CACHE_SIZE:
+                self.keywords.clear()
+            keywords = self.keywords[command] = extract_keywords(command)
+        return keywords
+
+    def add(self, command, epoch, cwd="", exit_code=0, git_project="", session_id="import", host=None):
+        """Queue one run, importing the batch once it is full"""
+        self.read += 1
+        if not command.strip() or command.startswith("repty"):
+            return
+        if epoch < self.cutoff:
+            self.compacted += 1
+            return
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(epoch))
+        self.batch.append((epoch, (command, timestamp, cwd or "", exit_code or 0, git_project or "", session_id,
+                                   self.keywords_of(command), host)))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def add_record(self, record):
+        """Queue a run from a JSONL record"""
+        epoch = record.get("ts")
+        if epoch is None:
+            epoch = epoch_seconds(record.get("timestamp"))
+        try:
+            epoch = int(epoch)
+            exit_code = int(record.get("exit_code") or 0)
+        except (TypeError, ValueError):
+            self.read += 1
+            return
+        # --host only stands in for records that do not name theirs
+        host = self.normalise_host(record["host"]) if record.get("host") else self.host
+        self.add(record["command"], epoch, record.get("cwd"), exit_code, record.get("git_project"),
+                 record.get("session_id") or "import", host)
+
+    def existing(self, keys):
+        """Positions of the (ts, command, host) keys already in commands"""
+        self.conn.execute("DELETE FROM import_keys")
+        self.conn.executemany("INSERT INTO import_keys VALUES (?, ?, ?, ?)",
+                              [(pos,) + key for pos, key in enumerate(keys)])
+        return {row[0] for row in self.conn.execute('''
+        SELECT k.pos FROM import_keys k
+        WHERE EXISTS (SELECT 1 FROM commands c WHERE c.ts = k.ts AND c.command = k.command AND c.host IS k.host)
+        ''')}
+
+    def flush(self):
+        """Import the queued runs that are not in the database yet, in one transaction"""
+        if not self.batch:
+            return
+        with self.trace.stage("dedup") as stage:
+            seen = set()
+            rows = []
+            keys = []
+            for epoch, row in self.batch:
+                key = (epoch, row[0], row[7])
+                if key not in seen:
+                    seen.add(key)
+                    rows.append(row)
+                    keys.append(key)
+            known = self.existing(keys)
+            rows = [row for pos, row in enumerate(rows) if pos not in known]
+            stage.rows = len(rows)
+        with self.trace.stage("insert") as stage:
+            with self.conn:
+                record_commands(self.conn, rows)
+            stage.rows = len(rows)
+        self.imported += len(rows)
+        self.batch = []
+
+def read_lines(path):
+    """Open a history file for reading lines as bytes, gunzipping .gz files"""
+    if path == "-":
+        return sys.stdin.buffer
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+def import_file(importer, path, fmt='auto'):
+    """Import one history file, returning the format it was read as"""
+    f = read_lines(path)
+    try:
+        with importer.trace.stage("parse") as stage:
+            read_before = importer.read
+            first = f.readline()
+            while first and not first.strip():
+                first = f.readline()
+            if fmt == 'auto':
+                fmt = detect_format(first)
+            lines = _chain(first, f)
+            if fmt == 'jsonl':
+                for record in parse_jsonl(lines):
+                    importer.add_record(record)
+            elif fmt == 'zsh':
+                for epoch, command in parse_zsh(lines):
+                    importer.add(command, epoch, host=importer.host)
+            else:
+                default = int(os.path.getmtime(path)) if path != "-" else int(time.time())
+                for epoch, command in parse_bash(lines, default):
+                    importer.add(command, epoch, host=importer.host)
+            stage.rows = importer.read - read_before
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+    return fmt
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+def main():
+    parser = argparse.ArgumentParser(prog="repty import", description="Import shell history or repty exports")
+    parser.add_argument("files", nargs="*", help="history files, - for stdin (default: $REPTY_HISTORY_FILE)")
+    parser.add_argument("--format", choices=('auto',) + FORMATS, default='auto')
+    parser.add_argument("--host", help="host the shell history was recorded on (default: this machine)")
+    parser.add_argument("--batch-size", type=int, default=50000, help="runs imported per transaction")
+    trace, argv = start('import')
+    args = parser.parse_args(argv[1:])
+
+    db_path = get_db_path()
+    files = args.files or [history_file()]
+    try:
+        conn = connect(db_path)
+        ensure_history_schema(conn)
+    except sqlite3.Error as e:
+        print(f"Error connecting to database: {e}", file=sys.stderr)
+        return 1
+
+    started = time.perf_counter()
+    importer = Importer(conn, args.host, max(1, args.batch_size), trace)
+    try:
+        for path in files:
+            imported = importer.imported
+            fmt = import_file(importer, path, args.format)
+            importer.flush()
+            print(f"{path}: {importer.imported - imported} new commands ({fmt})")
+        from repty.embed_worker import maybe_start
+        maybe_start(conn, db_path)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Error importing history: {e}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+        trace.finish(db_path)
+
+    elapsed = time.perf_counter() - started
+    print(f"Imported {importer.imported} of {importer.read} commands read in {elapsed:.1f}s "
+          f"({importer.read / elapsed if elapsed else 0:.0f} lines/s)")
+    if importer.compacted:
+        day = time.strftime("%Y-%m-%d", time.gmtime(importer.cutoff))
+        print(f"Skipped {importer.compacted} commands from before {day}, already compacted")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""Batch ingester for commands spooled by the shell hook.
+
+With REPTY_LOG_MODE=spool (the default) the prompt hook in repty.sh only
+appends one tab-separated line per command to the spool file, using shell
+builtins so no process is started on the prompt path:
+
+    epoch_seconds <TAB> session_id <TAB> exit_code <TAB> cwd <TAB> command
+
+Backslashes, tabs and newlines in cwd and command are escaped as \\\\, \\t
+and \\n; `repty log` appends records the same way when the database stays
+locked for longer than REPTY_BUSY_TIMEOUT. This module claims the spool by
+renaming it, does the keyword extraction and git project lookup for every
+record, and inserts the batch in a single transaction. A shell that opened
+the spool just before the rename appends to the claimed batch instead, so
+the batch is read again after SETTLE_SECONDS and only deleted once nothing
+more has arrived. After inserting,
+ingesting and logging start the background embedding worker when enough new
+command texts are waiting (see repty.embed_worker).
+
+Usage:
+    python3 -m repty.ingest
+    python3 -m repty.ingest log [--timings] <exit_code> <command>   # record one command now
+
+Both are traced with REPTY_TRACE or --timings (see repty.trace). When
+logging, --timings is only recognised before the exit code, so a logged
+command containing it is kept intact.
+"""
+import os
+import sys
+import glob
+import time
+import fcntl
+import sqlite3
+
+from repty import get_db_path
+from repty.db import connect
+from repty.embed_worker import maybe_start
+from repty.history import ensure_history_schema, record_commands
+from repty.terms import extract_keywords
+from repty.trace import NULL_TRACE, start
+
+# How long a claimed spool is watched for appends from shells that opened
+# it just before it was renamed
+SETTLE_SECONDS = 0.05
+
+def get_spool_path(db_path=None):
+    """Return the spool file the shell hook appends to"""
+    return os.environ.get('REPTY_SPOOL', (db_path or get_db_path()) + '.spool')
+
+def unescape(field):
+    """Undo the escaping done by the shell hook"""
+    if "\\" not in field:
+        return field
+    out = []
+    chars = iter(field)
+    for ch in chars:
+        if ch == "\\":
+            nxt = next(chars, "")
+            out.append({"t": "\t", "n": "\n", "\\": "\\"}.get(nxt, "\\" + nxt))
+        else:
+            out.append(ch)
+    return "".join(out)
+
+def escape(field):
+    """Escape a field the way the shell hook does"""
+    return field.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+def append_spool(epoch, session_id, exit_code, cwd, command, db_path=None):
+    """Append one record to the spool, for the next ingest to pick up"""
+    line = "\t".join((str(epoch), session_id, str(exit_code), escape(cwd), escape(command))) + "\n"
+    # One write call, so concurrent appends from other shells never interleave
+    fd = os.open(get_spool_path(db_path), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(fd, line.encode("utf-8"))
+    finally:
+        os.close(fd)
+
+class GitProjects:
+    """Resolve the git project name of a directory, caching every lookup"""
+
+    def __init__(self):
+        self.cache = {}
+
+    def __call__(self, cwd):
+        if cwd in self.cache:
+            return self.cache[cwd]
+        parent = os.path.dirname(cwd)
+        if os.path.exists(os.path.join(cwd, ".git")):
+            project = os.path.basename(cwd)
+        elif not cwd or parent == cwd:
+            project = ""
+        else:
+            project = self(parent)
+        self.cache[cwd] = project
+        return project
+
+def parse_spool(path, git_project, offset=0):
+    """Return commands table rows for the complete records in a spool file
+    from byte `offset` on, and the offset just past the last of them"""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    rows = []
+    for line in data[:end].decode("utf-8", "replace").split("\n")[:-1]:
+        fields = line.split("\t", 4)
+        if len(fields) != 5:
+            continue
+        epoch, session_id, exit_code, cwd, command = fields
+        command = unescape(command)
+        cwd = unescape(cwd)
+        # Skip empty commands and repty's own commands
+        if not command.strip() or command.startswith("repty"):
+            continue
+        try:
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(int(epoch)))
+            exit_code = int(exit_code)
+        except ValueError:
+            continue
+        rows.append((command, timestamp, cwd, exit_code, git_project(cwd), session_id,
+                     extract_keywords(command)))
+    return rows, offset + end
+
+def ingest(db_path=None, spool_path=None, trace=NULL_TRACE):
+    """Move every spooled record into the database, returning how many"""
+    db_path = db_path or get_db_path()
+    spool_path = spool_path or get_spool_path(db_path)
+
+    with open(spool_path + ".lock", "w") as lock:
+        # Only one ingester at a time; the others have nothing left to do
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return 0
+
+        # Claim the spool: shells append to a fresh file from here on.
+        # Batches left behind by an interrupted run are picked up as well.
+        settled = time.monotonic()
+        if os.path.exists(spool_path):
+            os.rename(spool_path, f"{spool_path}.{time.time_ns()}.{os.getpid()}.batch")
+            settled += SETTLE_SECONDS
+        batches = sorted(glob.glob(spool_path + ".*.batch"))
+        if not batches:
+            return 0
+
+        git_project = GitProjects()
+        offsets = dict.fromkeys(batches, 0)
+        count = 0
+        conn = connect(db_path)
+        try:
+            ensure_history_schema(conn)
+            while True:
+                with trace.stage("parse") as stage:
+                    rows = []
+                    for batch in batches:
+                        batch_rows, offsets[batch] = parse_spool(batch, git_project, offsets[batch])
+                        rows.extend(batch_rows)
+                    stage.rows = len(rows)
+                if rows:
+                    with trace.stage("insert") as stage:
+                        with conn:
+                            record_commands(conn, rows)
+                        stage.rows = len(rows)
+                    count += len(rows)
+                wait = settled - time.monotonic()
+                if wait <= 0 and not rows:
+                    break
+                # Read what was appended meanwhile before deleting the batches
+                time.sleep(max(0, wait))
+            maybe_start(conn, db_path)
+        finally:
+            conn.close()
+
+        for batch in batches:
+            os.remove(batch)
+        return count
+
+def log_command(exit_code, command, db_path=None, trace=NULL_TRACE):
+    """Record a single command straight away (REPTY_LOG_MODE=direct).
+
+    The row goes to the group-commit writer when one is running (see
+    repty.writer), into the database otherwise, and to the spool when the
+    database stays locked. Returns which of "writer", "database" or "spool"
+    it went to.
+    """
+    cwd = os.getcwd()
+    now = int(time.time())
+    session_id = os.environ.get('REPTY_SESSION_ID') or f"session-{now}"
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now))
+    with trace.stage("keywords"):
+        keywords = extract_keywords(command)
+    with trace.stage("git_project"):
+        project = GitProjects()(cwd)
+    row = (command, timestamp, cwd, exit_code, project, session_id, keywords)
+
+    with trace.stage("insert"):
+        from repty.writer import send_rows
+        if send_rows([row], db_path):
+            return "writer"
+        conn = connect(db_path)
+        try:
+            try:
+                ensure_history_schema(conn)
+                with conn:
+                    record_commands(conn, [row])
+            except sqlite3.OperationalError:
+                # Locked past the busy timeout: keep the command for the next ingest
+                append_spool(now, session_id, exit_code, cwd, command, db_path)
+                return "spool"
+            maybe_start(conn, db_path)
+        finally:
+            conn.close()
+        return "database"
+
+def main():
+    if sys.argv[1:2] == ['log']:
+        # The logged command may itself contain --timings
+        trace, head = start('log', sys.argv[:3])
+        argv = head + sys.argv[3:]
+    else:
+        trace, argv = start('ingest')
+    try:
+        if argv[1:2] == ['log'] and len(argv) > 3:
+            command = " ".join(argv[3:])
+            # Skip empty commands and repty's own commands
+            if command.strip() and not command.startswith("repty"):
+                log_command(int(argv[2]), command, trace=trace)
+            return 0
+        count = ingest(trace=trace)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"Error ingesting commands: {e}", file=sys.stderr)
+        return 1
+    finally:
+        trace.finish()
+    print(f"Ingested {count} commands")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""Keyword search for when scikit-learn and sentence-transformers are not available.
+
+Commands are scored by how many of the query's keywords they contain, with
+a bonus for adjacent keyword pairs and for matching them all. Only commands
+the full-text index finds are scored when it exists. Nothing here needs
+NumPy, so this backend starts as fast as Python itself.
+"""
+import re
+
+from repty import query_cache
+from repty.scan import TopK, iter_chunks
+from repty.terms import get_matcher
+from repty.trace import NULL_TRACE
+
+def normalize_text(text):
+    """Remove special characters and normalize whitespace"""
+    if not text:
+        return ""
+    text = text.lower()
+    text = re.sub(r'[^\w\s]', ' ', text)
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text
+
+def calculate_score(command, keywords):
+    """Calculate relevance score based on keyword matches"""
+    if not keywords:
+        return 0.0
+
+    command_text = normalize_text(command)
+
+    # Count how many keywords appear in the command
+    matches = sum(1 for keyword in keywords if keyword in command_text)
+
+    # Calculate score based on matches and proximity
+    if matches == 0:
+        return 0.0
+
+    score = matches / len(keywords)
+
+    # Boost for exact phrases
+    for i in range(len(keywords) - 1):
+        phrase = f"{keywords[i]} {keywords[i+1]}"
+        if phrase in command_text:
+            score += 0.2
+
+    # Boost if all keywords are found
+    if matches == len(keywords):
+        score *= 1.5
+
+    return min(score, 1.0)  # Cap score at 1.0
+
+def query_keywords(query):
+    """Normalised keywords of a query"""
+    return [normalize_text(term) for term in get_matcher().query_terms(query, min_length=2)]
+
+def score_texts(query, commands):
+    """Scores of a few commands for a query, for texts no other index covers yet"""
+    keywords = query_keywords(query)
+    return [calculate_score(command, keywords) for command in commands]
+
+def fts_query(keywords):
+    """FTS5 query for commands containing any of the keywords as a prefix"""
+    return " OR ".join('"' + keyword.replace('"', '""') + '"*' for keyword in keywords)
+
+def search(conn, query, limit=10, trace=NULL_TRACE, filters=None, use_cache=True):
+    """Return the top (id, command, timestamp, cwd, exit_code, score) rows.
+
+    With filters (a repty.query.ParsedQuery) only command texts with a
+    matching run are scored, and that run is the one shown. Rankings are
+    kept in the query cache and only newer runs are scored when the same
+    search comes again.
+    """
+    keywords = query_keywords(query)
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'command_texts_fts'")
+    use_fts = bool(cursor.fetchone() and keywords)
+    backend_id = "keyword/fts" if use_fts else "keyword/scan"
+
+    run_filter = ((), ())
+    if filters is not None and filters.filtered:
+        run_filter = filters.conditions(conn)
+
+    use_cache = use_cache and limit <= query_cache.CACHE_DEPTH and query_cache.cacheable(filters)
+    entry = None
+    if use_cache:
+        with trace.stage("cache"):
+            key = query_cache.cache_key("keyword", query, filters)
+            watermark = query_cache.current_watermark(conn)
+            entry = query_cache.lookup(conn, key)
+            if entry is not None and not entry.usable(backend_id, watermark, limit):
+                entry = None
+        if entry is not None and entry.watermark == watermark:
+            # Nothing was logged since, so the ranking is current
+            query_cache.touch(conn, key)
+            trace.note(cache="hit")
+            return query_cache.fetch(conn, entry.ranked, limit, run_filter, trace)
+
+    # The filters, or the runs newer than the cached ranking, become a
+    # subquery SQLite evaluates once
+    candidates_sql = None
+    params = []
+    if entry is not None:
+        candidates_sql, params = query_cache.new_runs_sql(conn, entry.watermark, filters)
+    elif filters is not None and filters.filtered:
+        candidates_sql, params = filters.candidates_sql(conn)
+
+    # Only score commands the full-text index finds; scan them all without it
+    with trace.stage("scan") as stage:
+        if use_fts:
+            sql = "SELECT rowid, command FROM command_texts_fts WHERE command_texts_fts MATCH ?"
+            if candidates_sql:
+                sql += f" AND rowid IN ({candidates_sql})"
+            cursor.execute(sql, [fts_query(keywords)] + params)
+        else:
+            sql = "SELECT id, command FROM command_texts"
+            if candidates_sql:
+                sql += f" WHERE id IN ({candidates_sql})"
+            cursor.execute(sql, params)
+
+        # Score the distinct commands a chunk at a time, keeping the best
+        best = TopK(max(limit, query_cache.CACHE_DEPTH) if use_cache else limit)
+        scanned = 0
+        for rows in iter_chunks(cursor):
+            for text_id, command in rows:
+                score = calculate_score(command, keywords)
+                if score > 0:
+                    best.push(score, text_id)
+            scanned += len(rows)
+        stage.rows = scanned
+    trace.note(fts=use_fts, keywords=len(keywords))
+    ranked = [[text_id, score, score] for score, text_id in best.results()]
+
+    if use_cache:
+        if entry is not None:
+            ranked = query_cache.merge(entry.ranked, ranked)
+        trace.note(cache="extended" if entry is not None else "miss")
+        query_cache.store(conn, key, backend_id, watermark, ranked)
+    # Display columns for the winners only, from their most recent run
+    return query_cache.fetch(conn, ranked, limit, run_filter, trace)
@@ -0,0 +1,88 @@
+"""Compact encodings for the vectors stored in text_embeddings.
+
+Every row records its encoding, so a history can hold rows written under
+different settings:
+
+    float32  4 bytes per dimension (rows from before encodings, NULL)
+    float16  2 bytes per dimension
+    int8     1 byte per dimension and a float32 scale: round(v / scale),
+             with scale = max|v| / 127
+
+Only sentence-transformers vectors are stored; scikit-learn searches score
+their own TF-IDF index (repty.tfidf_index). They are stored as set by
+REPTY_EMBED_STORAGE (float32, float16 or int8; default float32), which also
+picks the format of the memory-mapped matrix the search scores
+(repty.embedding_store). `python3 bench/embedding_storage.py` measures the
+size, load time and top-10 recall of each against float32.
+"""
+import os
+import numpy as np
+
+ENCODINGS = ('float32', 'float16', 'int8')
+
+def storage_encoding():
+    """Encoding new vectors are stored in"""
+    value = os.environ.get('REPTY_EMBED_STORAGE', '').strip().lower()
+    return value if value in ENCODINGS else 'float32'
+
+def encode(vectors, encoding):
+    """Return one blob per row of a matrix"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if encoding == 'float16':
+        return [row.tobytes() for row in vectors.astype(np.float16)]
+    if encoding == 'int8':
+        codes, scales = quantize_rows(vectors)
+        return [scale.tobytes() + row.tobytes() for row, scale in zip(codes, scales)]
+    return [row.tobytes() for row in vectors]
+
+def decode(blob, encoding, dim):
+    """Return a stored vector as a float32 array of `dim` values"""
+    encoding = encoding or 'float32'
+    if encoding == 'float16':
+        return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+    if encoding == 'int8':
+        scale = np.frombuffer(blob, dtype=np.float32, count=1)[0]
+        return np.frombuffer(blob, dtype=np.int8, offset=4).astype(np.float32) * scale
+    return np.frombuffer(blob, dtype=np.float32)
+
+def decode_rows(rows, dim):
+    """Stack (blob, encoding) pairs into a float32 matrix"""
+    if rows and all((encoding or 'float32') == 'float32' for _, encoding in rows):
+        return np.frombuffer(b"".join(blob for blob, _ in rows), dtype=np.float32).reshape(len(rows), dim)
+    matrix = np.empty((len(rows), dim), dtype=np.float32)
+    for position, (blob, encoding) in enumerate(rows):
+        matrix[position] = decode(blob, encoding, dim)
+    return matrix
+
+class Int8Matrix:
+    """Rows of int8 codes with one scale each, read back as float32 on indexing"""
+
+    def __init__(self, codes, scales):
+        self.codes = codes
+        self.scales = scales
+        self.shape = codes.shape
+        self.dtype = np.float32
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, key):
+        scales = np.asarray(self.scales[key], dtype=np.float32)
+        codes = np.asarray(self.codes[key], dtype=np.float32)
+        return codes * (scales[..., None] if codes.ndim > 1 else scales)
+
+    def dot(self, query, block):
+        """Dot product of every row with a float32 query, scaling the
+        products rather than the rows"""
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), block):
+            codes = np.asarray(self.codes[start:start + block], dtype=np.float32)
+            scores[start:start + block] = (codes @ query) * self.scales[start:start + block]
+        return scores
+
+def quantize_rows(vectors):
+    """Split float32 rows into int8 codes and per-row scales"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = (np.abs(vectors).max(axis=1) / 127).astype(np.float32) if len(vectors) else np.zeros(0, np.float32)
+    safe = np.where(scales > 0, scales, 1.0)[:, None]
+    return np.rint(vectors / safe).astype(np.int8), scales
@@ -0,0 +1,330 @@
+"""Turn a natural language search into filters plus the text left to rank.
+
+    "failed docker commands last week in ~/proj"
+
+parses into exit status != 0, a docker tool filter, ts >= now - 7 days and
+cwd under ~/proj, with no text left over. The filters become one SQL
+candidate query over the commands table that the ts, exit code, cwd, git
+project and session indexes answer, and semantic or keyword scoring then
+only looks at the command texts it returns. A search that is all filters
+lists the most recent matching commands instead.
+
+Understood phrases:
+
+    time       today, yesterday, this week|month|year, last|past [N] minutes|
+               hours|days|weeks|months|years, N days ago, since|after|before|
+               until|on YYYY-MM-DD
+    status     failed, errors, didn't work, ... / succeeded, worked, ... /
+               exit code N
+    location   in|under ~/path or /path, here, in this directory,
+               in project NAME, in the NAME repo, in this session
+    tool       docker commands, commands with|using kubectl
+
+Usage:
+    python3 -m repty.query describe "<query>"   # key terms, filters and their SQL, for nlp_search.sh
+    python3 -m repty.query parse "<query>"      # the parsed filters as JSON
+"""
+import os
+import re
+import sys
+import json
+import time
+
+from repty.terms import get_matcher, normalize
+
+UNITS = {"minute": 60, "hour": 3600, "day": 86400, "week": 7 * 86400, "month": 30 * 86400, "year": 365 * 86400}
+UNIT_NAMES = "minute|hour|day|week|month|year"
+
+# Words that only say "show me commands", with no meaning to rank by
+FILLER = set("""
+command commands cmd cmds ran run running executed typed show list find get give me all any some my
+everything things stuff anything something please recent recently
+""".split())
+
+FAILED_RE = re.compile(r"\b(?:that\s+|which\s+)?(?:failed|failing|fails|errored|errors?|broke|broken|crashed|"
+                       r"didn'?t\s+work|did\s+not\s+work|unsuccessful|non-?zero)\b")
+SUCCEEDED_RE = re.compile(r"\b(?:that\s+|which\s+)?(?:succeeded|successful(?:ly)?|worked|passed|passing)\b")
+EXIT_CODE_RE = re.compile(r"\bexit(?:ed)?\s*(?:code|status)?\s*(?:of|with|=)?\s*(\d{1,3})\b")
+
+PATH_RE = re.compile(r"(?<![\w/~.])(?:in|under|inside|within|from)\s+((?:~|\.\.?)(?:/\S*)?|/\S*)")
+HERE_RE = re.compile(r"\b(?:right\s+)?(?:here|in\s+(?:this|the\s+current)\s+(?:dir|directory|folder))\b")
+PROJECT_RES = [
+    re.compile(r"\b(?:in|for|on|from)\s+(?:the\s+)?(?:project|repo|repository)\s+([\w.-]+)"),
+    re.compile(r"\b(?:in|for|on|from)\s+(?:the\s+)?([\w.-]+)\s+(?:project|repo|repository)\b"),
+]
+SESSION_RE = re.compile(r"\b(?:in|from|during)?\s*this\s+(?:session|shell|terminal)\b")
+
+TOOL_RES = [
+    re.compile(r"\b([\w.+-]+)\s+commands?\b"),
+    re.compile(r"\bcommands?\s+(?:with|using|for|involving)\s+([\w.+-]+)"),
+]
+
+DATE_RE = r"(\d{4}-\d{2}-\d{2})"
+
+def start_of_day(epoch, days=0):
+    """Local midnight of the day `epoch` falls on, shifted by `days`"""
+    t = time.localtime(epoch)
+    return int(time.mktime((t.tm_year, t.tm_mon, t.tm_mday + days, 0, 0, 0, 0, 0, -1)))
+
+def parse_date(text):
+    """Local midnight of a YYYY-MM-DD date"""
+    return int(time.mktime(time.strptime(text, "%Y-%m-%d")))
+
+def time_ranges(now):
+    """(pattern, function of the match returning (since, until)) pairs"""
+    def this_period(match):
+        t = time.localtime(now)
+        if match.group(1) == "week":
+            return start_of_day(now, -t.tm_wday), None
+        month = 1 if match.group(1) == "year" else t.tm_mon
+        return int(time.mktime((t.tm_year, month, 1, 0, 0, 0, 0, 0, -1))), None
+
+    return [
+        (rf"\b(?:in\s+|during\s+|over\s+|within\s+)?(?:the\s+)?(?:last|past)\s+(\d+)\s+({UNIT_NAMES})s?\b",
+         lambda m: (now - int(m.group(1)) * UNITS[m.group(2)], None)),
+        (rf"\b(?:in\s+|during\s+|over\s+|within\s+)?(?:the\s+)?(?:last|past)\s+({UNIT_NAMES})\b",
+         lambda m: (now - UNITS[m.group(1)], None)),
+        (r"\b(\d+)\s+days?\s+ago\b",
+         lambda m: (start_of_day(now, -int(m.group(1))), start_of_day(now, 1 - int(m.group(1))))),
+        (r"\byesterday\b", lambda m: (start_of_day(now, -1), start_of_day(now))),
+        (r"\btoday\b", lambda m: (start_of_day(now), None)),
+        (r"\bthis\s+(week|month|year)\b", this_period),
+        (rf"\b(?:since|after|from)\s+{DATE_RE}\b", lambda m: (parse_date(m.group(1)), None)),
+        (rf"\b(?:before|until|till)\s+{DATE_RE}\b", lambda m: (None, parse_date(m.group(1)))),
+        (rf"\bon\s+{DATE_RE}\b", lambda m: (parse_date(m.group(1)), parse_date(m.group(1)) + 86400)),
+    ]
+
+def sql_literal(value):
+    """Quote a parameter for SQL that is run without parameters"""
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+def fts_available(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'command_texts_fts'").fetchone() is not None
+
+class ParsedQuery:
+    """Filters found in a search query and the free text left to rank by"""
+
+    FIELDS = ('text', 'since', 'until', 'failed', 'exit_code', 'cwd', 'git_project', 'session_id', 'tools')
+
+    def __init__(self, text="", since=None, until=None, failed=None, exit_code=None, cwd=None,
+                 git_project=None, session_id=None, tools=()):
+        self.text = text
+        self.since = since
+        self.until = until
+        # True for failed runs only, False for successful ones only
+        self.failed = failed
+        self.exit_code = exit_code
+        # Runs in this directory or below it
+        self.cwd = cwd
+        self.git_project = git_project
+        self.session_id = session_id
+        self.tools = list(tools)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(**{name: values[name] for name in cls.FIELDS if name in values})
+
+    @property
+    def filtered(self):
+        """Whether any filter narrows the commands to search"""
+        return any(value not in (None, [], "") for value in
+                   (self.since, self.until, self.failed, self.exit_code, self.cwd, self.git_project,
+                    self.session_id, self.tools))
+
+    @property
+    def has_text(self):
+        """Whether the free text has words worth ranking by"""
+        return any(word not in FILLER for word in get_matcher().words(self.text))
+
+    def describe(self):
+        """Human readable filters, for the search header"""
+        parts = []
+        fmt = lambda epoch: time.strftime("%Y-%m-%d %H:%M", time.localtime(epoch))
+        if self.since is not None and self.until is not None:
+            parts.append(f"between {fmt(self.since)} and {fmt(self.until)}")
+        elif self.since is not None:
+            parts.append(f"since {fmt(self.since)}")
+        elif self.until is not None:
+            parts.append(f"before {fmt(self.until)}")
+        if self.exit_code is not None:
+            parts.append(f"exit code {self.exit_code}")
+        elif self.failed is not None:
+            parts.append("failed" if self.failed else "succeeded")
+        if self.cwd:
+            parts.append(f"in {self.cwd}")
+        if self.git_project:
+            parts.append(f"project {self.git_project}")
+        if self.session_id:
+            parts.append("this session")
+        parts.extend(f"{tool} commands" for tool in self.tools)
+        return parts
+
+    def conditions(self, conn):
+        """SQL conditions on the commands table and their parameters"""
+        conditions = []
+        params = []
+        if self.since is not None:
+            conditions.append("ts >= ?")
+            params.append(self.since)
+        if self.until is not None:
+            conditions.append("ts < ?")
+            params.append(self.until)
+        if self.exit_code is not None:
+            conditions.append("exit_code = ?")
+            params.append(self.exit_code)
+        elif self.failed:
+            # Two ranges rather than !=, so the exit code index answers it
+            conditions.append("(exit_code < 0 OR exit_code > 0)")
+        elif self.failed is False:
+            conditions.append("exit_code = 0")
+        if self.cwd and self.cwd != "/":
+            # The directory itself or anything below it, as an index range
+            conditions.append("(cwd = ? OR (cwd > ? AND cwd < ?))")
+            params.extend([self.cwd, self.cwd + "/", self.cwd + "0"])
+        if self.git_project:
+            conditions.append("git_project = ?")
+            params.append(self.git_project)
+        if self.session_id:
+            conditions.append("session_id = ?")
+            params.append(self.session_id)
+        if self.tools:
+            fts = fts_available(conn)
+            for tool in self.tools:
+                if fts:
+                    conditions.append("text_id IN (SELECT rowid FROM command_texts_fts WHERE command_texts_fts MATCH ?)")
+                    params.append('"' + tool.replace('"', '""') + '"')
+                else:
+                    conditions.append("text_id IN (SELECT id FROM command_texts WHERE command LIKE ?)")
+                    params.append(f"%{tool}%")
+        return conditions, params
+
+    def where_sql(self, conn):
+        """The conditions with their parameters inlined, for nlp_search.sh"""
+        conditions, params = self.conditions(conn)
+        values = iter(params)
+        return re.sub(r"\?", lambda match: sql_literal(next(values)), " AND ".join(conditions))
+
+    def candidates_sql(self, conn):
+        """Query for the ids of the command texts with a matching run"""
+        conditions, params = self.conditions(conn)
+        return f"SELECT DISTINCT text_id FROM commands WHERE {' AND '.join(conditions) or '1'}", params
+
+    def candidate_ids(self, conn):
+        """Ascending ids of the command texts with a run matching every filter"""
+        sql, params = self.candidates_sql(conn)
+        return sorted(row[0] for row in conn.execute(sql, params) if row[0] is not None)
+
+    def recent_sql(self, conn, limit):
+        """Query for the command texts whose matching runs are most recent"""
+        conditions, params = self.conditions(conn)
+        if not conditions:
+            return "SELECT id FROM command_texts ORDER BY last_seen DESC LIMIT ?", [limit]
+        return (f"SELECT text_id FROM commands WHERE {' AND '.join(conditions)} "
+                f"GROUP BY +text_id ORDER BY MAX(ts) DESC LIMIT ?", params + [limit])
+
+def parse_query(query, now=None, cwd=None):
+    """Split a search query into a ParsedQuery"""
+    now = int(now if now is not None else time.time())
+    text = " " + query.lower() + " "
+    parsed = ParsedQuery()
+
+    def cut(match):
+        nonlocal text
+        text = text[:match.start()] + " " + text[match.end():]
+
+    for pattern, resolve in time_ranges(now):
+        while True:
+            match = re.search(pattern, text)
+            if not match:
+                break
+            try:
+                since, until = resolve(match)
+            except (ValueError, OverflowError):
+                break
+            if since is not None:
+                parsed.since = since if parsed.since is None else max(parsed.since, since)
+            if until is not None:
+                parsed.until = until if parsed.until is None else min(parsed.until, until)
+            cut(match)
+
+    match = EXIT_CODE_RE.search(text)
+    if match:
+        parsed.exit_code = int(match.group(1))
+        cut(match)
+    for regex, failed in ((FAILED_RE, True), (SUCCEEDED_RE, False)):
+        match = regex.search(text)
+        while match:
+            if parsed.exit_code is None:
+                parsed.failed = failed
+            cut(match)
+            match = regex.search(text)
+
+    # Paths keep their case, so find them in the original query
+    match = PATH_RE.search(query)
+    if match:
+        path = match.group(1).rstrip("/.,;") or "/"
+        parsed.cwd = os.path.normpath(os.path.join(cwd or os.getcwd(), os.path.expanduser(path)))
+        text = text.replace(" " + match.group(0).lower(), " ", 1)
+    match = HERE_RE.search(text)
+    if match and not parsed.cwd:
+        parsed.cwd = cwd or os.getcwd()
+        cut(match)
+    for regex in PROJECT_RES:
+        match = regex.search(text)
+        if match and not parsed.git_project:
+            # Project names keep their case as well
+            original = re.search(re.escape(match.group(1)), query, re.IGNORECASE)
+            parsed.git_project = original.group(0) if original else match.group(1)
+            cut(match)
+    match = SESSION_RE.search(text)
+    if match and os.environ.get('REPTY_SESSION_ID'):
+        parsed.session_id = os.environ['REPTY_SESSION_ID']
+        cut(match)
+
+    matcher = get_matcher()
+    action_terms = matcher.categories.get('action', set())
+    for regex in TOOL_RES:
+        for match in list(regex.finditer(text)):
+            word = normalize(match.group(1))
+            if word in matcher.canonical and word not in action_terms and word not in FILLER:
+                if word not in parsed.tools:
+                    parsed.tools.append(word)
+                text = text.replace(match.group(0), " ", 1)
+
+    parsed.text = " ".join(text.split())
+    return parsed
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ('describe', 'parse'):
+        print("Usage: python3 -m repty.query <describe|parse> <query>", file=sys.stderr)
+        return 1
+    query = " ".join(sys.argv[2:])
+    parsed = parse_query(query)
+    if sys.argv[1] == 'parse':
+        print(json.dumps(parsed.to_dict(), sort_keys=True))
+        return 0
+    terms = get_matcher().query_terms(parsed.text)
+    print("terms\t" + " ".join(terms))
+    print("filters\t" + ", ".join(parsed.describe()))
+    print("text\t" + parsed.text)
+    if parsed.filtered:
+        import sqlite3
+        from repty import get_db_path
+        from repty.db import connect
+        try:
+            conn = connect(get_db_path())
+            try:
+                print("where\t" + parsed.where_sql(conn))
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""Cache of ranked search results, kept current as commands are logged.
+
+Each entry is keyed by the kind of backend, the normalised query text and
+its filters, and records exactly what scored it (the TF-IDF fit, the
+embedding model space or the keyword scorer), the highest commands.id it
+covers (its watermark), the encoded query vector when the backend has a
+dense one, and the best command text ids with their scores, best first.
+
+Scores of command texts do not change while the backend stays the same, so
+an entry stays valid as history grows: a search whose entry is at the
+current watermark only fetches the runs to show, and one that is behind
+scores the command texts of the newer runs alone and merges them into the
+cached ranking. An entry from an older fit or model is replaced. The
+least recently used entries are evicted beyond REPTY_QUERY_CACHE_SIZE
+entries (default 256, 0 turns the cache off).
+
+Usage:
+    python3 -m repty.query_cache stats|clear
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+
+from repty.history import latest_runs
+from repty.trace import NULL_TRACE
+
+# Results kept per entry; searches for more results than this skip the cache
+CACHE_DEPTH = 50
+
+def cache_size():
+    """Maximum number of cached queries"""
+    try:
+        return max(0, int(os.environ.get('REPTY_QUERY_CACHE_SIZE', '256')))
+    except ValueError:
+        return 256
+
+def ensure_cache_table(conn):
+    """Create the query_cache table"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS query_cache (
+        key TEXT PRIMARY KEY,
+        backend TEXT,
+        watermark INTEGER,
+        vector BLOB,
+        results TEXT,
+        last_used REAL,
+        hits INTEGER DEFAULT 0
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS query_cache_last_used ON query_cache(last_used)")
+
+def cache_key(kind, query, filters=None):
+    """Backend kind, normalised query text and filters identifying a cached search"""
+    key = {"kind": kind, "text": " ".join(query.lower().split())}
+    if filters is not None and filters.filtered:
+        key.update((name, value) for name, value in filters.to_dict().items() if name != "text")
+    return json.dumps(key, sort_keys=True)
+
+def cacheable(filters=None):
+    """Whether a search may be cached.
+
+    Rolling time windows ("last 2 hours") move with every search, so their
+    keys would never be seen twice.
+    """
+    if cache_size() == 0:
+        return False
+    if filters is None:
+        return True
+    from repty.query import start_of_day
+    return all(bound is None or bound == start_of_day(bound) for bound in (filters.since, filters.until))
+
+def current_watermark(conn):
+    """Highest commands.id in the database"""
+    return conn.execute("SELECT MAX(id) FROM commands").fetchone()[0] or 0
+
+class CacheEntry:
+    """A cached ranking: [text_id, rank score, shown score] lists, best first"""
+
+    def __init__(self, key, backend, watermark, vector, ranked):
+        self.key = key
+        self.backend = backend
+        self.watermark = watermark
+        self.vector = vector
+        self.ranked = ranked
+
+    def usable(self, backend, watermark, limit):
+        """Whether the entry can be reused, as it is or extended by newer runs"""
+        return self.backend == backend and self.watermark <= watermark and limit <= CACHE_DEPTH
+
+def lookup(conn, key):
+    """Return the CacheEntry for a key, or None"""
+    try:
+        row = conn.execute("SELECT backend, watermark, vector, results FROM query_cache WHERE key = ?",
+                           (key,)).fetchone()
+    except sqlite3.OperationalError:
+        # No table yet
+        return None
+    if row is None:
+        return None
+    backend, watermark, vector, results = row
+    return CacheEntry(key, backend, watermark, vector, json.loads(results))
+
+def touch(conn, key):
+    """Mark an entry as just used"""
+    try:
+        with conn:
+            conn.execute("UPDATE query_cache SET last_used = ?, hits = hits + 1 WHERE key = ?",
+                         (time.time(), key))
+    except sqlite3.Error:
+        pass
+
+def store(conn, key, backend, watermark, ranked, vector=None):
+    """Save a ranking, evicting the least recently used entries over the cap"""
+    try:
+        with conn:
+            ensure_cache_table(conn)
+            conn.execute('''
+            INSERT OR REPLACE INTO query_cache (key, backend, watermark, vector, results, last_used, hits)
+            VALUES (?, ?, ?, ?, ?, ?, COALESCE((SELECT hits FROM query_cache WHERE key = ?), 0))
+            ''', (key, backend, watermark, vector, json.dumps(ranked[:CACHE_DEPTH]), time.time(), key))
+            conn.execute('''
+            DELETE FROM query_cache WHERE key IN
+                (SELECT key FROM query_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)
+            ''', (cache_size(),))
+    except sqlite3.Error as e:
+        # The cache is only an accelerator; a locked or read-only database
+        # must not fail the search
+        print(f"Could not update the query cache: {e}", file=sys.stderr)
+
+def new_runs_sql(conn, after_id, filters=None):
+    """Query for the ids of the command texts of runs logged after
+    `after_id` that match the filters, and its parameters"""
+    conditions, params = filters.conditions(conn) if filters is not None else ([], [])
+    sql = "SELECT DISTINCT text_id FROM commands WHERE " + " AND ".join(["id > ?"] + conditions)
+    return sql, [after_id] + params
+
+def new_text_ids(conn, after_id, filters=None):
+    """Ascending ids of the command texts with runs logged after `after_id`"""
+    sql, params = new_runs_sql(conn, after_id, filters)
+    return sorted(row[0] for row in conn.execute(sql, params) if row[0] is not None)
+
+def merge(ranked, scored):
+    """Merge newly scored [text_id, rank score, shown score] lists into a
+    ranking, best first and at most CACHE_DEPTH long"""
+    by_id = {entry[0]: entry for entry in ranked}
+    for entry in scored:
+        by_id[entry[0]] = entry
+    return sorted(by_id.values(), key=lambda entry: (-entry[1], -entry[2]))[:CACHE_DEPTH]
+
+def fetch(conn, ranked, limit, run_filter=((), ()), trace=NULL_TRACE):
+    """Display rows for the first `limit` ranked texts that still have a run"""
+    # Only texts deleted since they were ranked can be missing, so the
+    # first window almost always suffices
+    results = []
+    start = 0
+    window = limit
+    with trace.stage("fetch") as stage:
+        while len(results) < limit and start < len(ranked):
+            batch = ranked[start:start + window]
+            rows = latest_runs(conn, [entry[0] for entry in batch], *run_filter)
+            results.extend(rows[text_id] + (score,) for text_id, _, score in batch if text_id in rows)
+            start += window
+            window *= 4
+        stage.rows = len(results)
+    return results[:limit]
+
+def clear(conn):
+    """Drop every cached query, returning how many there were"""
+    try:
+        with conn:
+            return conn.execute("DELETE FROM query_cache").rowcount
+    except sqlite3.OperationalError:
+        return 0
+
+def main():
+    from repty.db import connect
+
+    if len(sys.argv) != 2 or sys.argv[1] not in ('stats', 'clear'):
+        print("Usage: python3 -m repty.query_cache stats|clear", file=sys.stderr)
+        return 1
+    conn = connect()
+    try:
+        if sys.argv[1] == 'clear':
+            print(f"Removed {clear(conn)} cached queries")
+            return 0
+        ensure_cache_table(conn)
+        entries, hits = conn.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM query_cache").fetchone()
+        print(f"{entries} cached queries (limit {cache_size()}), {hits} hits")
+        for key, backend, watermark, entry_hits in conn.execute(
+                "SELECT key, backend, watermark, hits FROM query_cache ORDER BY last_used DESC LIMIT 10"):
+            print(f"  {entry_hits:>5} hits  {backend:<24} up to #{watermark:<8} {json.loads(key)['text']}")
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""Bounded-memory scans for the search scripts.
+
+Searches that have to look at every command read the table once in chunks
+of CHUNK_ROWS rows, score each chunk as it arrives and keep only the best
+`limit` candidates in a heap, so memory stays flat however long the history
+grows. Display columns are fetched afterwards for the winners alone.
+"""
+import os
+import heapq
+
+# Rows read from the database per fetchmany() call
+CHUNK_ROWS = int(os.environ.get('REPTY_SCAN_CHUNK', '5000'))
+
+def iter_chunks(cursor, size=None):
+    """Yield the rows of an executed query in lists of at most `size`"""
+    size = size or CHUNK_ROWS
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield rows
+
+class TopK:
+    """The k highest scoring items offered so far, earlier items first on ties"""
+
+    def __init__(self, k):
+        self.k = k
+        # Min-heap of (score, -arrival, item): the root is the first to go
+        self.heap = []
+        self.offered = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, score, item):
+        """Offer one item"""
+        entry = (score, -self.offered, item)
+        self.offered += 1
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, entry)
+        elif entry[:2] > self.heap[0][:2]:
+            heapq.heapreplace(self.heap, entry)
+
+    def push_many(self, scores, items):
+        """Offer a chunk of scored items; only the chunk's own top k can enter"""
+        # NumPy is only needed here, so keyword scans work without it
+        import numpy as np
+
+        scores = np.asarray(scores)
+        candidates = np.arange(len(scores))
+        if len(scores) > self.k:
+            # Everything above the k-th best score, then the earliest ties
+            kth = np.partition(scores, len(scores) - self.k)[len(scores) - self.k]
+            above = np.nonzero(scores > kth)[0]
+            ties = np.nonzero(scores == kth)[0][:self.k - len(above)]
+            candidates = np.sort(np.concatenate([above, ties]))
+
+        arrival = self.offered
+        for pos in candidates:
+            entry = (float(scores[pos]), -(arrival + int(pos)), items[pos])
+            if len(self.heap) < self.k:
+                heapq.heappush(self.heap, entry)
+            elif entry[:2] > self.heap[0][:2]:
+                heapq.heapreplace(self.heap, entry)
+        self.offered += len(scores)
+
+    def results(self):
+        """Return (score, item) pairs, best first"""
+        return [(score, item) for score, _, item in sorted(self.heap, key=lambda e: e[:2], reverse=True)]
@@ -0,0 +1,189 @@
+"""Single entry point for `repty nlp`, trying every search backend in one process.
+
+Usage:
+    python3 -m repty.search [--timings] [--backends daemon,semantic,keyword] [--limit N] "query"
+
+The query is first split by repty.query into filters (time range, exit
+status, directory or git project, tool) and the free text left to rank.
+Every backend scores only the command texts with a run matching the
+filters and shows that run. Backends are tried in order until one returns
+results:
+
+    daemon    the warm search daemon, when its socket exists
+    semantic  SemanticIndex, with scikit-learn or sentence-transformers
+    keyword   keyword scoring over the full-text index, no dependencies
+
+The semantic and keyword backends keep their rankings in repty.query_cache:
+repeating a search only fetches the runs to show, or scores just the
+commands logged since. A query that is all filters ("failed commands
+yesterday") has nothing to rank by and lists the most recent matching
+commands instead. With REPTY_EXPLAIN set, the query plan of the filter
+query is printed instead of results.
+
+Each backend checks what it needs before importing it and heavy libraries
+are only imported on the branch that uses them: the keyword backend never
+loads NumPy, and a TF-IDF search over an existing index never loads
+scikit-learn. Falling through to the next backend costs no new interpreter.
+bench/check_startup.py keeps a cold search within its time budget.
+
+Results print as ID|TIMESTAMP|CWD|COMMAND|EXIT_CODE|SCORE lines; the exit
+status is 1 when no backend found anything.
+"""
+import os
+import sys
+import sqlite3
+
+from repty import get_db_path
+from repty.db import connect
+from repty.query import parse_query
+from repty.trace import NULL_TRACE, start
+
+BACKENDS = ('daemon', 'semantic', 'keyword')
+
+def format_result(result):
+    """Format a result row for the shell scripts"""
+    cmd_id, cmd, timestamp, cwd, exit_code, similarity = result
+    # Format: ID|TIMESTAMP|CWD|COMMAND|EXIT_CODE|SIMILARITY
+    return f"{cmd_id}|{timestamp}|{cwd}|{cmd}|{exit_code}|{similarity:.4f}"
+
+def search_daemon(db_path, conn, parsed, limit, trace):
+    """Result lines from a running search daemon, or None without one"""
+    from repty.daemon import get_socket_path
+    from repty.unix_server import send_request
+
+    socket_path = get_socket_path()
+    if not os.path.exists(socket_path):
+        return None
+    # Filters are parsed here, where "here" and ~ mean what the user meant
+    response = send_request(socket_path, {"cmd": "search", "query": parsed.text, "filters": parsed.to_dict(),
+                                          "db": db_path, "limit": limit})
+    if not response.get("ok"):
+        print(f"Search daemon error: {response.get('error')}", file=sys.stderr)
+        return None
+    return response["lines"]
+
+def search_semantic(db_path, conn, parsed, limit, trace):
+    """Result lines from SemanticIndex, or None without a backend for it"""
+    with trace.stage("import"):
+        from repty.semantic import SemanticIndex
+        index = SemanticIndex(db_path)
+    if index.backend is None:
+        return None
+    index.trace = trace
+    return [format_result(result) for result in index.search(conn, parsed.text, limit, parsed)]
+
+def search_keyword(db_path, conn, parsed, limit, trace):
+    """Result lines from the keyword scorer"""
+    from repty.keyword_search import search
+
+    return [format_result(result) for result in search(conn, parsed.text, limit, trace, parsed)]
+
+def search_recent(db_path, conn, parsed, limit, trace):
+    """Result lines for the most recent commands matching the filters"""
+    from repty.history import latest_runs
+
+    with trace.stage("recent") as stage:
+        sql, params = parsed.recent_sql(conn, limit)
+        ids = [row[0] for row in conn.execute(sql, params)]
+        runs = latest_runs(conn, ids, *parsed.conditions(conn))
+        stage.rows = len(runs)
+    return [format_result(runs[text_id] + (1.0,)) for text_id in ids if text_id in runs]
+
+SEARCHES = {'daemon': search_daemon, 'semantic': search_semantic, 'keyword': search_keyword,
+            'recent': search_recent}
+
+def explain(conn, parsed, limit=10):
+    """Return the query plan of the filter query a search would run"""
+    if parsed.has_text:
+        sql, params = parsed.candidates_sql(conn)
+    else:
+        sql, params = parsed.recent_sql(conn, limit)
+    plan = [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+    return "\n".join(["QUERY PLAN"] + plan)
+
+def search(db_path, conn, query, limit=10, backends=BACKENDS, trace=NULL_TRACE):
+    """Return (backend, result lines) from the first backend that finds anything"""
+    with trace.stage("parse"):
+        parsed = parse_query(query)
+    trace.note(filters=parsed.describe())
+    if not parsed.has_text:
+        backends = ('recent',)
+
+    for backend in backends:
+        try:
+            lines = SEARCHES[backend](db_path, conn, parsed, limit, trace)
+        except ImportError as e:
+            print(f"{backend} search unavailable: {e}", file=sys.stderr)
+            continue
+        except Exception as e:
+            print(f"Error in {backend} search: {e}", file=sys.stderr)
+            continue
+        if lines:
+            trace.note(backend_used=backend)
+            return backend, lines
+        print(f"No results from {backend} search", file=sys.stderr)
+    return None, []
+
+def parse_args(argv):
+    """Split leading options from the query words; the query may contain anything"""
+    options = {"backends": BACKENDS, "limit": 10}
+    args = list(argv)
+    while args and args[0] in ("--backends", "--limit") and len(args) > 1:
+        option, value = args[0], args[1]
+        if option == "--backends":
+            options["backends"] = tuple(name.strip() for name in value.split(",") if name.strip())
+        else:
+            options["limit"] = int(value)
+        args = args[2:]
+    options["query"] = " ".join(args)
+    return options
+
+def main(argv=None, name='search', backends=None):
+    trace, argv = start(name, sys.argv if argv is None else argv)
+    try:
+        options = parse_args(argv[1:])
+    except ValueError as e:
+        print(f"Invalid option: {e}", file=sys.stderr)
+        return 1
+    if backends is not None:
+        options["backends"] = backends
+    unknown = [backend for backend in options["backends"] if backend not in SEARCHES]
+    if unknown or not options["query"].strip():
+        if unknown:
+            print(f"Unknown backends: {', '.join(unknown)} (choose from {', '.join(BACKENDS)})", file=sys.stderr)
+        print(f"Usage: {os.path.basename(argv[0])} [--timings] [--backends {','.join(BACKENDS)}] "
+              "[--limit N] \"your query here\"", file=sys.stderr)
+        return 1
+
+    db_path = get_db_path()
+    try:
+        with trace.stage("connect"):
+            conn = connect(db_path)
+    except sqlite3.Error as e:
+        print(f"Error connecting to database: {e}", file=sys.stderr)
+        return 1
+
+    try:
+        if os.environ.get('REPTY_EXPLAIN'):
+            print(explain(conn, parse_query(options["query"]), options["limit"]))
+            return 0
+        backend, lines = search(db_path, conn, options["query"], options["limit"], options["backends"], trace)
+        if 'semantic' in options["backends"]:
+            # Embed what the results just had to do without, off the query path
+            from repty.embed_worker import maybe_start
+            maybe_start(conn, db_path)
+        if not lines:
+            print("No similar commands found.", file=sys.stderr)
+            return 1
+        print(f"Results from {backend} search", file=sys.stderr)
+        with trace.stage("render") as stage:
+            for line in lines:
+                print(line)
+            stage.rows = len(lines)
+        return 0
+    finally:
+        conn.close()
+        trace.finish(db_path)
+
+if __name__ == "__main__":
+    sys.exit(main())
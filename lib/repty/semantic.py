@@ -0,0 +1,373 @@
+"""Semantic search over the command history.
+
+SemanticIndex keeps the backend (a TF-IDF vectorizer or a sentence-transformers
+model) and the command rows in memory, so the same index can serve a single
+one-shot search or stay warm inside the search daemon.
+"""
+import sys
+import os
+
+from repty.history import ensure_history_schema
+from repty.terms import extract_key_terms
+from repty.scan import iter_chunks
+from repty.trace import NULL_TRACE
+
+# Force CPU-only mode for torch to avoid CUDA issues
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+os.environ["NO_CUDA"] = "1"
+os.environ["USE_TORCH"] = "0"  # Try to avoid torch if possible
+
+# Weight of key-term matches when re-ranking results
+BOOST_FACTOR = 1.5
+
+def have_module(name):
+    """Check whether a package is installed without paying for its import"""
+    import importlib.util
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+def load_backend():
+    """Return the name of the best available backend.
+
+    Nothing heavy is imported here: scikit-learn is only imported when the
+    TF-IDF vocabulary has to be fitted, sentence-transformers when the model
+    is loaded.
+    """
+    if have_module('sklearn'):
+        return 'scikit'
+    if not have_module('sentence_transformers'):
+        return None
+    return 'transformers'
+
+def positions_of(ids, wanted):
+    """Positions in the ascending array `ids` of the wanted ids it contains"""
+    import numpy as np
+
+    ids = np.asarray(ids)
+    wanted = np.asarray(wanted, dtype=np.int64)
+    if len(ids) == 0:
+        return np.zeros(0, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(ids, wanted), len(ids) - 1)
+    return positions[ids[positions] == wanted]
+
+class SemanticIndex:
+    """Search index over the distinct command texts.
+
+    With scikit-learn the TF-IDF vectors live in a persisted TfidfIndex; with
+    sentence-transformers the vectors from text_embeddings are searched
+    through a memory-mapped EmbeddingStore, or through its IVF index once the
+    history is large enough for brute force to be slow.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.backend = load_backend()
+
+        # scikit-learn state, loaded from the index directory
+        self.tfidf = None
+
+        # sentence-transformers state
+        self.embedder = None
+        self.store = None
+        self.ann = None
+        # (id, command) of the command texts not embedded yet, scored by keywords
+        self.tail = []
+
+        # Key-term features of every text, used for re-ranking
+        self.terms = None
+
+        # Stage timings; the scripts replace this with their own trace
+        self.trace = NULL_TRACE
+
+    def __len__(self):
+        if self.backend == 'scikit':
+            return len(self.tfidf) if self.tfidf is not None else 0
+        return (len(self.store) if self.store is not None else 0) + len(self.tail)
+
+    def _load_rows(self, conn, after_id):
+        """Return ids and search texts of the command texts with id > after_id"""
+        from repty.embeddings import embedding_text
+
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, command, keywords FROM command_texts WHERE id > ? ORDER BY id", (after_id,))
+
+        ids = []
+        texts = []
+        for text_id, command, keywords in cursor.fetchall():
+            ids.append(text_id)
+            texts.append(embedding_text(command, keywords))
+        return ids, texts
+
+    def refresh(self, conn, refit=False):
+        """Index command texts added since the last refresh, returning how many;
+        with refit, fit the TF-IDF vocabulary again over the whole history"""
+        with self.trace.stage("import"):
+            # NumPy and SciPy come with the indexes; cache hits never load them
+            import repty.term_index
+            if self.backend == 'scikit':
+                import repty.tfidf_index
+        ensure_history_schema(conn)
+        self._refresh_terms(conn)
+        if self.backend == 'scikit':
+            return self._refresh_tfidf(conn, refit)
+        return self._refresh_embeddings(conn)
+
+    def _refresh_terms(self, conn):
+        from repty import get_index_dir
+        from repty.term_index import TermIndex
+
+        if self.terms is None:
+            self.terms = TermIndex(get_index_dir(self.db_path))
+            self.terms.load()
+
+        # A database that was recreated reuses ids, so start over
+        max_id = conn.execute("SELECT MAX(id) FROM command_texts").fetchone()[0] or 0
+        if max_id < self.terms.last_id:
+            self.terms = TermIndex(self.terms.index_dir)
+
+        with self.trace.stage("terms") as stage:
+            cursor = conn.execute("SELECT id, command FROM command_texts WHERE id > ? ORDER BY id",
+                                  (self.terms.last_id,))
+            scanned = 0
+            for rows in iter_chunks(cursor):
+                self.terms.append([row[0] for row in rows], [row[1] for row in rows])
+                scanned += len(rows)
+            self.terms.save()
+            stage.rows = scanned
+
+    def _refresh_tfidf(self, conn, refit=False):
+        from repty import get_index_dir
+        from repty.tfidf_index import TfidfIndex
+
+        if self.tfidf is None:
+            with self.trace.stage("tfidf_load"):
+                self.tfidf = TfidfIndex(get_index_dir(self.db_path))
+                self.tfidf.load()
+
+        # A database that was recreated reuses ids, so start over
+        max_id = conn.execute("SELECT MAX(id) FROM command_texts").fetchone()[0] or 0
+        if max_id < self.tfidf.last_id:
+            self.tfidf = TfidfIndex(self.tfidf.index_dir)
+
+        with self.trace.stage("tfidf_append") as stage:
+            ids, texts = self._load_rows(conn, self.tfidf.last_id)
+            if ids and self.tfidf.vocabulary is not None:
+                self.tfidf.append(ids, texts)
+            stage.rows = len(ids)
+
+        if refit or self.tfidf.needs_refit():
+            with self.trace.stage("tfidf_fit") as stage:
+                all_ids, all_texts = self._load_rows(conn, 0)
+                if all_ids:
+                    self.tfidf.fit(all_ids, all_texts)
+                stage.rows = len(all_ids)
+
+        with self.trace.stage("tfidf_save"):
+            self.tfidf.save()
+        return len(ids)
+
+    def _refresh_embeddings(self, conn):
+        from repty import get_index_dir
+        from repty.ann_index import IvfIndex
+        from repty.embedding_store import EmbeddingStore
+        from repty.embeddings import ensure_embedding_schema, get_active_space
+
+        if self.store is None:
+            ensure_embedding_schema(conn)
+            self.store = EmbeddingStore(get_index_dir(self.db_path))
+            self.ann = IvfIndex(self.store.index_dir)
+
+        # New command texts are embedded by the background worker
+        # (repty.embed_worker); search the vectors it has stored so far
+        self.store.open()
+        added = 0
+        space = get_active_space(conn)
+        if space is not None:
+            with self.trace.stage("store_sync") as stage:
+                added = self.store.sync(conn, space)
+                stage.rows = added
+            with self.trace.stage("ann_update"):
+                self.ann.update(self.store)
+
+        # The worker embeds in id order, so the rest is what it has not reached
+        with self.trace.stage("tail") as stage:
+            self.tail = conn.execute("SELECT id, command FROM command_texts WHERE id > ? ORDER BY id",
+                                     (self.store.last_id,)).fetchall()
+            stage.rows = len(self.tail)
+        return added
+
+    def _encode_query(self, conn, query):
+        """Encode the query, loading the model the first time"""
+        from repty.embedding_store import MixedEmbeddingSpaceError
+        from repty.embeddings import TransformerEmbedder, claim_space
+
+        if self.embedder is None:
+            with self.trace.stage("load_model"):
+                self.embedder = TransformerEmbedder()
+        space = self.embedder.space
+        if not claim_space(conn, space):
+            raise MixedEmbeddingSpaceError(
+                f"Stored embeddings are not from {space[0]}/{space[1]}/v{space[2]}; run 'repty reindex'")
+        with self.trace.stage("encode_query"):
+            return self.embedder.encode([query])[0]
+
+    def _tail_scores(self, query, candidates=None):
+        """Keyword scores of the unembedded command texts, or of the candidates among them"""
+        from repty.keyword_search import score_texts
+
+        tail = self.tail
+        if candidates is not None:
+            wanted = set(int(text_id) for text_id in candidates)
+            tail = [row for row in tail if row[0] in wanted]
+        return [row[0] for row in tail], score_texts(query, [row[1] for row in tail])
+
+    def _saved_tfidf_meta(self):
+        """Metadata of the saved TF-IDF index, read without importing it and SciPy"""
+        import json
+        from repty import get_index_dir
+
+        try:
+            with open(os.path.join(get_index_dir(self.db_path), "tfidf_meta.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def backend_id(self, conn):
+        """Identify the vectors scores come from, so cached rankings from
+        another model or TF-IDF fit are not reused"""
+        if self.backend == 'scikit':
+            meta = self.tfidf.meta if self.tfidf is not None else self._saved_tfidf_meta()
+            return f"tfidf/{meta['fitted_at']}/{meta['fitted_rows']}" if meta else None
+        from repty.embeddings import get_active_space
+        space = get_active_space(conn)
+        return "/".join(str(part) for part in space) if space else None
+
+    def _similarities(self, query, candidates=None, query_vector=None):
+        """Return command text ids and their similarity to the query, for
+        every indexed text or only the candidate ids"""
+        import numpy as np
+
+        if self.backend == 'scikit':
+            try:
+                if candidates is not None:
+                    rows = positions_of(self.tfidf.ids, candidates)
+                    return self.tfidf.ids[rows], self.tfidf.scores(query, rows)
+                return self.tfidf.ids, self.tfidf.scores(query)
+            except Exception as e:
+                print(f"Error during TF-IDF calculation: {e}", file=sys.stderr)
+        elif self.backend == 'transformers':
+            try:
+                if query_vector is None or len(self.store) == 0:
+                    ids, scores = np.zeros(0, dtype=np.int64), np.zeros(0)
+                elif candidates is not None:
+                    # Filtered sets are small enough for exact scores
+                    rows = positions_of(self.store.ids, candidates)
+                    ids, scores = np.asarray(self.store.ids[rows]), self.store.scores(query_vector, rows)
+                elif self.ann.meta is not None and self.ann.indexed_rows == len(self.store):
+                    ids, scores = self.ann.scores(self.store, query_vector)
+                else:
+                    ids, scores = self.store.ids, self.store.scores(query_vector)
+                tail_ids, tail_scores = self._tail_scores(query, candidates)
+                return (np.concatenate([np.asarray(ids, dtype=np.int64), np.asarray(tail_ids, dtype=np.int64)]),
+                        np.concatenate([np.asarray(scores, dtype=np.float64), np.asarray(tail_scores)]))
+            except Exception as e:
+                print(f"Error during sentence-transformer encoding: {e}", file=sys.stderr)
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    def _rank(self, ids, scores, key_terms, depth):
+        """Boost every score at once and return the best [text_id, boosted
+        score, score] lists"""
+        import numpy as np
+        from repty.embedding_store import top_k
+
+        with self.trace.stage("boost") as stage:
+            boosted = self.terms.boost(ids, scores, key_terms, BOOST_FACTOR)
+            stage.rows = len(scores)
+        top = top_k(boosted, depth)
+        # Keep higher raw scores first on ties
+        top = top[np.lexsort((-scores[top], -boosted[top]))]
+        return [[int(ids[pos]), float(boosted[pos]), float(scores[pos])] for pos in top]
+
+    def search(self, conn, query, limit=10, filters=None, use_cache=True):
+        """Return the top (id, command, timestamp, cwd, exit_code, similarity) rows.
+
+        With filters (a repty.query.ParsedQuery) only the command texts with
+        a matching run are scored, and that run is the one shown. Rankings
+        are kept in the query cache and only newer runs are scored when the
+        same search comes again.
+        """
+        from repty import query_cache
+
+        run_filter = ((), ())
+        if filters is not None and filters.filtered:
+            run_filter = filters.conditions(conn)
+
+        use_cache = use_cache and limit <= query_cache.CACHE_DEPTH and query_cache.cacheable(filters)
+        entry = None
+        if use_cache:
+            with self.trace.stage("cache"):
+                key = query_cache.cache_key(self.backend, query, filters)
+                watermark = query_cache.current_watermark(conn)
+                entry = query_cache.lookup(conn, key)
+                if entry is not None and not entry.usable(self.backend_id(conn), watermark, limit):
+                    entry = None
+            if entry is not None and entry.watermark == watermark:
+                # Nothing was logged since, so the ranking is current
+                query_cache.touch(conn, key)
+                self.trace.note(backend=self.backend, cache="hit")
+                return query_cache.fetch(conn, entry.ranked, limit, run_filter, self.trace)
+
+        self.refresh(conn)
+        if len(self) == 0:
+            return []
+        backend_id = self.backend_id(conn) if use_cache else None
+        if entry is not None and entry.backend != backend_id:
+            # Refitted while refreshing; the cached scores are from the old fit
+            entry = None
+
+        candidates = None
+        if entry is not None:
+            # Only texts with newer runs can change the cached ranking
+            with self.trace.stage("candidates") as stage:
+                candidates = query_cache.new_text_ids(conn, entry.watermark, filters)
+                stage.rows = len(candidates)
+        elif filters is not None and filters.filtered:
+            with self.trace.stage("candidates") as stage:
+                candidates = filters.candidate_ids(conn)
+                stage.rows = len(candidates)
+            if len(candidates) == 0:
+                return []
+
+        # Extract key terms from the query
+        key_terms = extract_key_terms(query)
+        self.trace.note(key_terms=key_terms)
+
+        query_vector = None
+        if self.backend == 'transformers' and len(self.store):
+            if entry is not None and entry.vector is not None:
+                import numpy as np
+                query_vector = np.frombuffer(entry.vector, dtype=np.float32)
+            else:
+                query_vector = self._encode_query(conn, query)
+
+        with self.trace.stage("similarity") as stage:
+            ids, scores = self._similarities(query, candidates, query_vector)
+            stage.rows = len(scores)
+        self.trace.note(backend=self.backend, texts=len(self))
+        ranked = self._rank(ids, scores, key_terms, max(limit, query_cache.CACHE_DEPTH))
+
+        if use_cache:
+            if entry is not None:
+                ranked = query_cache.merge(entry.ranked, ranked)
+            self.trace.note(cache="extended" if entry is not None else "miss")
+            if self.tail:
+                # Runs of the keyword-scored texts are scored again once embedded
+                first = conn.execute("SELECT MIN(id) FROM commands WHERE text_id >= ?",
+                                     (self.tail[0][0],)).fetchone()[0]
+                if first is not None:
+                    watermark = min(watermark, first - 1)
+            query_cache.store(conn, key, backend_id, watermark, ranked,
+                              query_vector.tobytes() if query_vector is not None else None)
+        return query_cache.fetch(conn, ranked, limit, run_filter, self.trace)
@@ -0,0 +1,276 @@
+"""Command statistics from rollup tables kept up to date as commands are recorded.
+
+Counts are rolled up as executions are inserted (record_commands and
+backfill_texts in repty.history, in the same transaction), one upsert per
+distinct key in the batch:
+
+    stats_daily             runs and failures per UTC date
+    stats_hourly            runs and failures per UTC hour of the day
+    stats_projects          runs and failures per git project
+    stats_project_commands  runs and failures per git project and command text
+    stats_cwds              runs and failures per directory
+    stats_cwd_commands      runs and failures per directory and command text
+
+Per-command counts are the run_count and fail_count of command_texts.
+`repty compact` (repty.compact) deletes old executions but leaves their
+counts in place, and keeps runs and failures per command text and UTC date
+in command_days, so --rebuild can still count them by day and command.
+Every report reads an index or a table with at most a few hundred rows, so
+`repty stats` takes the same time however long the history is.
+
+Usage:
+    python3 -m repty.stats [--limit N] [--project NAME] [--cwd DIR]
+    python3 -m repty.stats --rebuild    # recompute every rollup from commands
+"""
+import os
+import sys
+import sqlite3
+import argparse
+
+from repty import get_db_path
+from repty.db import connect, get_meta, set_meta
+
+# Bumped when the rollups change, so they are rebuilt once
+ROLLUP_VERSION = 1
+
+ROLLUP_TABLES = ('stats_daily', 'stats_hourly', 'stats_projects', 'stats_project_commands',
+                 'stats_cwds', 'stats_cwd_commands')
+
+def ensure_stats_schema(conn):
+    """Create the rollup tables and the indexes the reports read"""
+    conn.executescript('''
+    CREATE TABLE IF NOT EXISTS stats_daily (day TEXT PRIMARY KEY, runs INTEGER, failures INTEGER);
+    CREATE TABLE IF NOT EXISTS stats_hourly (hour INTEGER PRIMARY KEY, runs INTEGER, failures INTEGER);
+    CREATE TABLE IF NOT EXISTS stats_projects (git_project TEXT PRIMARY KEY, runs INTEGER, failures INTEGER);
+    CREATE TABLE IF NOT EXISTS stats_project_commands (
+        git_project TEXT, text_id INTEGER, runs INTEGER, failures INTEGER,
+        PRIMARY KEY (git_project, text_id)
+    );
+    CREATE TABLE IF NOT EXISTS stats_cwds (cwd TEXT PRIMARY KEY, runs INTEGER, failures INTEGER);
+    CREATE TABLE IF NOT EXISTS stats_cwd_commands (
+        cwd TEXT, text_id INTEGER, runs INTEGER, failures INTEGER,
+        PRIMARY KEY (cwd, text_id)
+    );
+    CREATE TABLE IF NOT EXISTS command_days (
+        text_id INTEGER, day TEXT, runs INTEGER, failures INTEGER,
+        PRIMARY KEY (text_id, day)
+    );
+    CREATE INDEX IF NOT EXISTS stats_projects_runs ON stats_projects(runs);
+    CREATE INDEX IF NOT EXISTS stats_project_commands_runs ON stats_project_commands(git_project, runs);
+    CREATE INDEX IF NOT EXISTS stats_cwds_runs ON stats_cwds(runs);
+    CREATE INDEX IF NOT EXISTS stats_cwd_commands_runs ON stats_cwd_commands(cwd, runs);
+    CREATE INDEX IF NOT EXISTS command_texts_run_count ON command_texts(run_count);
+    CREATE INDEX IF NOT EXISTS command_texts_fail_count ON command_texts(fail_count) WHERE fail_count > 0;
+    ''')
+
+def _count(counts, key, failed):
+    entry = counts.get(key)
+    if entry is None:
+        counts[key] = [1, failed]
+    else:
+        entry[0] += 1
+        entry[1] += failed
+
+def add_runs(conn, runs):
+    """Count executions in the rollups; the caller commits.
+
+    `runs` are (timestamp, cwd, exit_code, git_project, text_id) tuples.
+    """
+    daily, hourly, projects, project_commands, cwds, cwd_commands = {}, {}, {}, {}, {}, {}
+    for timestamp, cwd, exit_code, git_project, text_id in runs:
+        failed = 1 if exit_code else 0
+        if timestamp:
+            _count(daily, timestamp[:10], failed)
+            if timestamp[11:13].isdigit():
+                _count(hourly, int(timestamp[11:13]), failed)
+        if git_project:
+            _count(projects, git_project, failed)
+            _count(project_commands, (git_project, text_id), failed)
+        if cwd:
+            _count(cwds, cwd, failed)
+            _count(cwd_commands, (cwd, text_id), failed)
+
+    for table, key_columns, counts in (
+            ('stats_daily', ('day',), daily),
+            ('stats_hourly', ('hour',), hourly),
+            ('stats_projects', ('git_project',), projects),
+            ('stats_project_commands', ('git_project', 'text_id'), project_commands),
+            ('stats_cwds', ('cwd',), cwds),
+            ('stats_cwd_commands', ('cwd', 'text_id'), cwd_commands)):
+        if not counts:
+            continue
+        columns = ", ".join(key_columns)
+        placeholders = ", ".join("?" * (len(key_columns) + 2))
+        conn.executemany(f'''
+        INSERT INTO {table} ({columns}, runs, failures) VALUES ({placeholders})
+        ON CONFLICT({columns}) DO UPDATE SET runs = runs + excluded.runs, failures = failures + excluded.failures
+        ''', [(key if isinstance(key, tuple) else (key,)) + tuple(count) for key, count in counts.items()])
+
+def rebuild(conn):
+    """Recompute the rollups and the command_texts counts from commands, in one transaction.
+
+    Runs compacted into command_days are counted by day and command; the
+    hourly, project and directory rollups can only count the runs left.
+    """
+    ensure_stats_schema(conn)
+    failed = "SUM(CASE WHEN COALESCE(exit_code, 0) != 0 THEN 1 ELSE 0 END)"
+    with conn:
+        for table in ROLLUP_TABLES:
+            conn.execute(f"DELETE FROM {table}")
+        for sql in (f'''
+        INSERT INTO stats_daily (day, runs, failures)
+        SELECT day, SUM(runs), SUM(failures) FROM (
+            SELECT substr(timestamp, 1, 10) AS day, COUNT(*) AS runs, {failed} AS failures FROM commands
+            WHERE timestamp IS NOT NULL AND timestamp != '' GROUP BY 1
+            UNION ALL
+            SELECT day, runs, failures FROM command_days
+        ) GROUP BY day
+        ''', f'''
+        INSERT INTO stats_hourly (hour, runs, failures)
+        SELECT CAST(substr(timestamp, 12, 2) AS INTEGER), COUNT(*), {failed} FROM commands
+        WHERE substr(timestamp, 12, 2) GLOB '[0-9][0-9]' GROUP BY 1
+        ''', f'''
+        INSERT INTO stats_project_commands (git_project, text_id, runs, failures)
+        SELECT git_project, text_id, COUNT(*), {failed} FROM commands
+        WHERE git_project IS NOT NULL AND git_project != '' GROUP BY git_project, text_id
+        ''', '''
+        INSERT INTO stats_projects (git_project, runs, failures)
+        SELECT git_project, SUM(runs), SUM(failures) FROM stats_project_commands GROUP BY git_project
+        ''', f'''
+        INSERT INTO stats_cwd_commands (cwd, text_id, runs, failures)
+        SELECT cwd, text_id, COUNT(*), {failed} FROM commands
+        WHERE cwd IS NOT NULL AND cwd != '' GROUP BY cwd, text_id
+        ''', '''
+        INSERT INTO stats_cwds (cwd, runs, failures)
+        SELECT cwd, SUM(runs), SUM(failures) FROM stats_cwd_commands GROUP BY cwd
+        '''):
+            conn.execute(sql)
+        conn.execute(f'''
+        UPDATE command_texts SET (run_count, fail_count, first_seen, last_seen) = (
+            SELECT COALESCE(SUM(runs), 0), COALESCE(SUM(failures), 0),
+                   -- The first runs of a compacted text are only in the archive
+                   CASE WHEN MAX(compacted) THEN command_texts.first_seen ELSE MIN(first) END,
+                   COALESCE(MAX(last), command_texts.last_seen)
+            FROM (
+                SELECT COUNT(*) AS runs, {failed} AS failures, MIN(timestamp) AS first, MAX(timestamp) AS last,
+                       0 AS compacted
+                FROM commands WHERE text_id = command_texts.id
+                UNION ALL
+                SELECT runs, failures, NULL, NULL, 1 FROM command_days WHERE text_id = command_texts.id
+            )
+        )
+        ''')
+        set_meta(conn, 'stats_rollups', ROLLUP_VERSION)
+
+def ensure_rollups(conn):
+    """Build the rollups of a history that has none yet (or older ones)"""
+    ensure_stats_schema(conn)
+    if get_meta(conn, 'stats_rollups') != str(ROLLUP_VERSION):
+        rebuild(conn)
+
+def print_table(title, headers, rows):
+    """Print rows as aligned columns under a title"""
+    print(f"\n{title}")
+    if not rows:
+        print("  (none)")
+        return
+    cells = [[str(value) for value in row] for row in rows]
+    widths = [max(len(header), *(len(row[i]) for row in cells)) for i, header in enumerate(headers)]
+    # The first column is text and left aligned; the counts are right aligned
+    print("  " + "  ".join(h.ljust(w) if i == 0 else h.rjust(w) for i, (h, w) in enumerate(zip(headers, widths))))
+    for row in cells:
+        print("  " + "  ".join(v.ljust(w) if i == 0 else v.rjust(w) for i, (v, w) in enumerate(zip(row, widths))))
+
+def rate(failures, runs):
+    return f"{100 * failures / runs:.0f}%" if runs else "-"
+
+def print_overview(conn, limit):
+    total, failures = conn.execute(
+        "SELECT COALESCE(SUM(runs), 0), COALESCE(SUM(failures), 0) FROM stats_daily").fetchone()
+    print(f"Total commands: {total} ({rate(failures, total)} failed)")
+
+    print_table(f"Top {limit} commands", ("Command", "Runs", "Failed"), [
+        (command, runs, rate(fails, runs)) for command, runs, fails in conn.execute(
+            "SELECT command, run_count, fail_count FROM command_texts ORDER BY run_count DESC LIMIT ?", (limit,))])
+
+    print_table("Most failures", ("Command", "Failures", "Rate"), [
+        (command, fails, rate(fails, runs)) for command, fails, runs in conn.execute('''
+        SELECT command, fail_count, run_count FROM command_texts WHERE fail_count > 0
+        ORDER BY fail_count DESC LIMIT ?
+        ''', (limit,))])
+
+    print_table("Recent days", ("Date", "Commands", "Failed"), [
+        (day, runs, rate(fails, runs)) for day, runs, fails in conn.execute(
+            "SELECT day, runs, failures FROM stats_daily ORDER BY day DESC LIMIT 7")])
+
+    print_table("Busiest hours (UTC)", ("Hour", "Commands", "Failed"), [
+        (f"{hour:02d}:00", runs, rate(fails, runs)) for hour, runs, fails in conn.execute(
+            "SELECT hour, runs, failures FROM stats_hourly ORDER BY runs DESC LIMIT 5")])
+
+    print_table("Top projects", ("Project", "Commands", "Failed"), [
+        (name, runs, rate(fails, runs)) for name, runs, fails in conn.execute(
+            "SELECT git_project, runs, failures FROM stats_projects ORDER BY runs DESC LIMIT ?", (limit,))])
+
+    print_table("Top directories", ("Directory", "Commands", "Failed"), [
+        (name, runs, rate(fails, runs)) for name, runs, fails in conn.execute(
+            "SELECT cwd, runs, failures FROM stats_cwds ORDER BY runs DESC LIMIT ?", (limit,))])
+
+def print_place(conn, kind, name, limit):
+    """Top commands of one git project or directory"""
+    totals, commands, column = {'project': ('stats_projects', 'stats_project_commands', 'git_project'),
+                                'cwd': ('stats_cwds', 'stats_cwd_commands', 'cwd')}[kind]
+    row = conn.execute(f"SELECT runs, failures FROM {totals} WHERE {column} = ?", (name,)).fetchone()
+    if row is None:
+        print(f"No commands recorded in {name}")
+        return
+    print(f"Commands in {name}: {row[0]} ({rate(row[1], row[0])} failed)")
+    print_table(f"Top {limit} commands", ("Command", "Runs", "Failed"), [
+        (command, runs, rate(fails, runs)) for command, runs, fails in conn.execute(f'''
+        SELECT t.command, s.runs, s.failures FROM {commands} s JOIN command_texts t ON t.id = s.text_id
+        WHERE s.{column} = ? ORDER BY s.runs DESC LIMIT ?
+        ''', (name, limit))])
+
+def main():
+    parser = argparse.ArgumentParser(prog="repty stats", description="Show command statistics")
+    parser.add_argument("--limit", type=int, default=10, help="rows per list")
+    parser.add_argument("--project", help="top commands in this git project")
+    parser.add_argument("--cwd", help="top commands in this directory")
+    parser.add_argument("--rebuild", action="store_true", help="recompute the rollups from the full history")
+    args = parser.parse_args()
+
+    from repty.history import ensure_history_schema
+    try:
+        conn = connect()
+    except sqlite3.Error as e:
+        print(f"Error connecting to database: {e}", file=sys.stderr)
+        return 1
+
+    try:
+        ensure_history_schema(conn)
+        if args.rebuild:
+            rebuild(conn)
+            total = conn.execute("SELECT COALESCE(SUM(runs), 0) FROM stats_daily").fetchone()[0]
+            print(f"Rebuilt statistics from {total} commands")
+            compacted = conn.execute("SELECT COALESCE(SUM(runs), 0) FROM command_days").fetchone()[0]
+            if compacted:
+                print(f"{compacted} of them were compacted and only count towards days and commands")
+            return 0
+
+        print("Repty Stats")
+        print("-----------------------")
+        if args.project:
+            print_place(conn, 'project', args.project, args.limit)
+        elif args.cwd:
+            cwd = os.path.abspath(os.path.expanduser(args.cwd)).rstrip("/") or "/"
+            print_place(conn, 'cwd', cwd, args.limit)
+        else:
+            print_overview(conn, args.limit)
+    except sqlite3.Error as e:
+        print(f"Error reading statistics: {e}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""Cached key-term features of every command text for re-ranking.
+
+Search results are boosted by the dictionary terms they share with the query
+and by the concept categories (tool, db, action) they combine. Instead of
+scanning each candidate command at query time, the terms of every command
+text are found once when it is indexed and kept as a sparse term-presence
+matrix in CSR form, next to a per-row concept multiplier:
+
+    terms_ids.npy      command text id of every row, ascending
+    terms_indptr.npy   row i has term columns indices[indptr[i]:indptr[i + 1]]
+    terms_indices.npy  term columns, positions in the dictionary
+    terms_concept.npy  concept multiplier of every row
+    terms_meta.json    the dictionary the columns refer to and the last id
+
+A query then costs one pass over the non-zero entries to count matched terms
+per row and a few vectorised NumPy operations. The cache is rebuilt when the
+dictionary changes, for instance after editing ~/.repty.terms.
+"""
+import os
+import json
+import zipfile
+import numpy as np
+
+from repty import replace_file
+from repty.terms import get_matcher
+
+def concept_boost(categories):
+    """Multiplier for commands that combine tools, databases and actions"""
+    combined = len(categories & {'tool', 'db', 'action'})
+    if combined == 3:
+        return 2.0  # Extra boost for commands that combine all three concepts
+    if combined == 2:
+        return 1.5  # Boost for commands that combine concepts
+    return 1.0
+
+def boost_scores(scores, matched, key_term_count, concept, boost_factor):
+    """Vectorised boost of similarity scores by matched key terms.
+
+    Commands with every key term get boost_factor * 1.5, commands with some
+    get 1 + the matched fraction * boost_factor, both times their concept
+    multiplier; commands with none keep their score.
+    """
+    if key_term_count == 0:
+        return scores
+    multiplier = np.where(
+        matched == key_term_count,
+        boost_factor * 1.5 * concept,
+        np.where(matched > 0, (1 + matched / key_term_count * boost_factor) * concept, 1.0))
+    return scores * multiplier
+
+class TermIndex:
+    """Term-presence matrix over the command texts, stored in `index_dir`"""
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self.matcher = get_matcher()
+        self.vocabulary = self.matcher.terms
+        self.columns = {term: col for col, term in enumerate(self.vocabulary)}
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.concept = np.zeros(0, dtype=np.float32)
+        self.dirty = False
+
+    def _path(self, name):
+        return os.path.join(self.index_dir, f"terms_{name}")
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def last_id(self):
+        return int(self.ids[-1]) if len(self.ids) else 0
+
+    def load(self):
+        """Load the cache, returning False if it is missing, inconsistent or stale"""
+        try:
+            with open(self._path("meta.json")) as f:
+                meta = json.load(f)
+            ids = np.load(self._path("ids.npy"))
+            indptr = np.load(self._path("indptr.npy"))
+            indices = np.load(self._path("indices.npy"))
+            concept = np.load(self._path("concept.npy"))
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+            # Missing, or cut short by a writer that died
+            return False
+
+        if meta.get("terms") != self.vocabulary:
+            return False
+        # Files are replaced one at a time, so make sure they belong together
+        if len(indptr) != len(ids) + 1 or len(concept) != len(ids) or indptr[-1] != len(indices):
+            return False
+        if len(ids) and int(ids[-1]) != meta["last_id"]:
+            return False
+
+        self.ids = ids
+        self.indptr = indptr
+        self.indices = indices
+        self.concept = concept
+        self.dirty = False
+        return True
+
+    def save(self):
+        """Write the cache to disk if it changed"""
+        if not self.dirty:
+            return
+        os.makedirs(self.index_dir, exist_ok=True)
+        replace_file(self._path("ids.npy"), lambda f: np.save(f, self.ids))
+        replace_file(self._path("indptr.npy"), lambda f: np.save(f, self.indptr))
+        replace_file(self._path("indices.npy"), lambda f: np.save(f, self.indices))
+        replace_file(self._path("concept.npy"), lambda f: np.save(f, self.concept))
+        meta = {"terms": self.vocabulary, "last_id": self.last_id}
+        replace_file(self._path("meta.json"), lambda f: f.write(json.dumps(meta).encode()))
+        self.dirty = False
+
+    def append(self, ids, commands):
+        """Find the terms of new command texts, given in ascending id order"""
+        if not ids:
+            return
+        indices = []
+        counts = np.zeros(len(ids), dtype=np.int64)
+        concept = np.empty(len(ids), dtype=np.float32)
+        for row, command in enumerate(commands):
+            found = self.matcher.find(command or "")
+            indices.extend(self.columns[term] for term in found)
+            counts[row] = len(found)
+            concept[row] = concept_boost(self.matcher.categories_of(found))
+
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        self.indptr = np.concatenate([self.indptr, self.indptr[-1] + np.cumsum(counts)])
+        self.indices = np.concatenate([self.indices, np.asarray(indices, dtype=np.int32)])
+        self.concept = np.concatenate([self.concept, concept])
+        self.dirty = True
+
+    def boost(self, ids, scores, key_terms, boost_factor):
+        """Return the boosted scores of the command texts `ids`"""
+        key_columns = [self.columns[term] for term in key_terms if term in self.columns]
+        if not key_terms or not key_columns or len(self.ids) == 0:
+            return scores
+
+        # Matched key terms per row, from the non-zero entries alone
+        hits = np.nonzero(np.isin(self.indices, key_columns))[0]
+        rows = np.searchsorted(self.indptr, hits, side='right') - 1
+        matched_all = np.bincount(rows, minlength=len(self.ids))
+
+        # Rows of the candidates; ids not cached yet count as matching nothing
+        ids = np.asarray(ids, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        known = self.ids[positions] == ids
+        matched = np.where(known, matched_all[positions], 0)
+        concept = np.where(known, self.concept[positions], 1.0)
+        return boost_scores(np.asarray(scores, dtype=np.float64), matched, len(key_terms), concept, boost_factor)
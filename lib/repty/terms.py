@@ -0,0 +1,198 @@
+"""Term and keyword extraction shared by logging and every search backend.
+
+All known terms and phrases are compiled into one regular expression, so a
+command or query is scanned once however large the dictionary grows. Terms
+match whole words: "git" matches "git push" but not "github", and phrases
+also match when joined by hyphens, as in "docker-compose".
+
+The built-in dictionary can be extended without editing the code through
+REPTY_TERMS_FILE (default ~/.repty.terms), an INI-like file with one phrase
+or any number of whitespace-separated terms per line:
+
+    [tool]
+    podman helm
+    [db]
+    clickhouse
+    [phrase]
+    helm upgrade
+    [stopword]
+    please
+
+Sections are term, tool, db, action (tools, databases and actions are also
+terms), phrase and stopword.
+
+Usage from the shell scripts:
+    python3 -m repty.terms keywords "<command>"
+    python3 -m repty.terms query "<query>"
+"""
+import os
+import re
+import sys
+
+TERMS = """
+git docker npm node python pip aws curl wget ssh scp rsync tar zip unzip grep find sed awk
+head tail cat less more chmod chown mkdir rm cp mv ls ps kill systemctl service apt yum brew
+kubernetes k8s kubectl terraform ansible bash zsh fish vim emacs nano code make gcc clang javac go rust
+start stop run install update remove create delete build deploy up down clone push pull commit
+checkout branch stash merge status list config add restart init compose exec login logout test serve
+redis postgres postgresql mysql mongodb mongo db elasticsearch nginx apache tomcat wordpress rabbitmq
+kafka zookeeper cassandra memcached jenkins jira
+azure gcp google cloud ec2 s3 lambda cloudformation heroku netlify vercel
+react vue angular svelte express flask django spring rails laravel dotnet tensorflow pytorch
+pandas numpy scikit jupyter jupyter-notebook notebook
+"""
+
+# Concept categories used when boosting search results
+CATEGORIES = {
+    'tool': "docker git npm python kubectl terraform ansible",
+    'db': "redis postgres mysql mongodb elasticsearch cassandra",
+    'action': "run start stop deploy build install update up down",
+}
+
+PHRASES = [
+    "docker compose", "git commit", "git push", "git pull", "git clone", "git checkout",
+    "npm install", "npm run", "pip install", "kubectl get", "kubectl apply",
+]
+
+STOPWORDS = """
+the a an in on at to for with by about of from as this that these those etc then than and or but if
+when where how why who whom whose what which i you he she they them we us it my your his her their our
+its am is are was were be been being have has had having do does did doing can could shall should
+will would may might must need
+"""
+
+SECTIONS = ('term', 'tool', 'db', 'action', 'phrase', 'stopword')
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+def normalize(term):
+    """Canonical form of a term: lower case, single spaces between words"""
+    return " ".join(re.split(r"[\s-]+", term.strip().lower()))
+
+def load_user_terms(path):
+    """Read extra dictionary entries as {section: [entries]}"""
+    extra = {section: [] for section in SECTIONS}
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except OSError:
+        return extra
+
+    section = 'term'
+    for line in lines:
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        if line.startswith("[") and line.endswith("]"):
+            section = line[1:-1].strip().lower()
+            if section not in SECTIONS:
+                print(f"Warning: unknown section [{section}] in {path}", file=sys.stderr)
+            continue
+        if section == 'phrase':
+            extra['phrase'].append(line)
+        elif section in extra:
+            extra[section].extend(line.split())
+    return extra
+
+class TermMatcher:
+    """Finds every dictionary term and phrase in a text in a single regex pass"""
+
+    def __init__(self, terms, phrases, categories, stopwords):
+        self.categories = {name: {normalize(t) for t in members} for name, members in categories.items()}
+        self.stopwords = {normalize(w) for w in stopwords}
+
+        # Canonical spelling for every normalised form, e.g. jupyter notebook -> jupyter-notebook
+        self.canonical = {}
+        for term in list(terms) + list(phrases) + [t for members in categories.values() for t in members]:
+            self.canonical.setdefault(normalize(term), term.strip().lower())
+
+        # Every term find() can return, in a stable order
+        self.terms = sorted(set(self.canonical.values()))
+
+        # Longest first, so phrases win over the words they contain
+        forms = sorted(self.canonical, key=len, reverse=True)
+        alternatives = "|".join(r"[\s-]+".join(re.escape(word) for word in form.split()) for form in forms)
+        self.pattern = re.compile(rf"(?<![a-z0-9_])(?:{alternatives})(?![a-z0-9_])")
+
+    def find(self, text):
+        """Return the terms in a text, each once, in order of appearance.
+
+        A phrase is followed by the terms it is made of.
+        """
+        found = []
+        seen = set()
+        for match in self.pattern.finditer((text or "").lower()):
+            form = normalize(match.group())
+            parts = form.split()
+            for candidate in [form] + (parts if len(parts) > 1 else []):
+                if candidate in self.canonical and candidate not in seen:
+                    seen.add(candidate)
+                    found.append(self.canonical[candidate])
+        return found
+
+    def categories_of(self, terms):
+        """Return the names of the concept categories a list of terms touches"""
+        terms = {normalize(term) for term in terms}
+        return {name for name, members in self.categories.items() if terms & members}
+
+    def words(self, text, min_length=2):
+        """Return the significant words of a text, skipping stopwords"""
+        return [word for word in WORD_RE.findall((text or "").lower())
+                if len(word) >= min_length and word not in self.stopwords]
+
+    def keywords(self, command, limit=12):
+        """Keywords stored with a logged command: its terms, then other words"""
+        keywords = self.find(command)
+        for word in self.words(command):
+            if len(keywords) >= limit:
+                break
+            if word not in keywords:
+                keywords.append(word)
+        return " ".join(keywords)
+
+    def query_terms(self, query, min_length=3):
+        """Terms of a search query followed by its other significant words"""
+        terms = self.find(query)
+        for word in self.words(query, min_length):
+            if word not in terms:
+                terms.append(word)
+        return terms
+
+_matcher = None
+
+def get_matcher():
+    """Return the matcher for the built-in and user dictionaries, compiled once"""
+    global _matcher
+    if _matcher is None:
+        path = os.environ.get('REPTY_TERMS_FILE', os.path.expanduser('~/.repty.terms'))
+        extra = load_user_terms(path)
+        categories = {name: members.split() + extra[name] for name, members in CATEGORIES.items()}
+        _matcher = TermMatcher(TERMS.split() + extra['term'], PHRASES + extra['phrase'],
+                               categories, STOPWORDS.split() + extra['stopword'])
+    return _matcher
+
+def extract_keywords(command):
+    """Keywords stored with a logged command"""
+    return get_matcher().keywords(command)
+
+def extract_key_terms(query):
+    """Dictionary terms and phrases found in a search query"""
+    return get_matcher().find(query)
+
+def extract_query_terms(query):
+    """Dictionary terms and other significant words of a search query"""
+    return get_matcher().query_terms(query)
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ('keywords', 'query'):
+        print("Usage: python3 -m repty.terms <keywords|query> <text>", file=sys.stderr)
+        return 1
+    text = " ".join(sys.argv[2:])
+    if sys.argv[1] == 'keywords':
+        print(extract_keywords(text))
+    else:
+        print(" ".join(extract_query_terms(text)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
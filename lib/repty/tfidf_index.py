@@ -0,0 +1,169 @@
+"""Persisted, incrementally updated TF-IDF index.
+
+The vocabulary, IDF weights and L2-normalised document matrix are saved in the
+index directory next to the database, so a query only has to transform the
+query string and do one sparse matrix-vector product. New command texts are
+transformed with the existing vocabulary and appended; the vocabulary and IDF
+weights are refitted over the whole history only once enough new rows have
+accumulated or the last fit is old enough. Terms that first appear after the
+last fit are ignored until that refresh.
+
+Only fitting needs scikit-learn. Transforming queries and new rows with a
+fitted vocabulary is done here with the same tokenisation, so searches and
+appends skip the second or so it takes to import scikit-learn.
+"""
+import os
+import re
+import json
+import time
+import zipfile
+import numpy as np
+import scipy.sparse
+
+from repty import replace_file
+
+# Refit once appended rows exceed this fraction of the rows seen at fit time
+REFRESH_RATIO = float(os.environ.get('REPTY_TFIDF_REFRESH_RATIO', '0.2'))
+# ...or once the last fit is older than this and there are new rows
+REFRESH_SECONDS = int(os.environ.get('REPTY_TFIDF_REFRESH_SECONDS', str(7 * 24 * 3600)))
+
+# TfidfVectorizer's default token_pattern; stop words need no special
+# handling since they never make it into a vocabulary fitted without them
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+def transform(vocabulary, idf, texts):
+    """L2-normalised TF-IDF rows of `texts`, as TfidfVectorizer.transform gives"""
+    data = []
+    indices = []
+    indptr = [0]
+    for text in texts:
+        counts = {}
+        for token in TOKEN_PATTERN.findall(text.lower()):
+            col = vocabulary.get(token)
+            if col is not None:
+                counts[col] = counts.get(col, 0) + 1
+        cols = sorted(counts)
+        indices.extend(cols)
+        data.extend(counts[col] for col in cols)
+        indptr.append(len(indices))
+
+    indices = np.asarray(indices, dtype=np.int32)
+    indptr = np.asarray(indptr, dtype=np.int64)
+    data = np.asarray(data, dtype=np.float64) * idf[indices]
+    # Row norms from the non-zero entries alone
+    rows = np.repeat(np.arange(len(texts)), np.diff(indptr))
+    norms = np.sqrt(np.bincount(rows, weights=data * data, minlength=len(texts)))
+    norms[norms == 0] = 1.0
+    data = (data / norms[rows]).astype(np.float32)
+    return scipy.sparse.csr_matrix((data, indices, indptr), shape=(len(texts), len(idf)))
+
+class TfidfIndex:
+    """TF-IDF vectors for every distinct command text, stored in `index_dir`"""
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        # term -> column and IDF weight per column, None until fitted
+        self.vocabulary = None
+        self.idf = None
+        self.matrix = None
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.meta = {"fitted_rows": 0, "appended_rows": 0, "last_id": 0, "fitted_at": 0}
+        self.dirty = False
+
+    def _path(self, name):
+        return os.path.join(self.index_dir, f"tfidf_{name}")
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def last_id(self):
+        return self.meta["last_id"]
+
+    def load(self):
+        """Load the index from disk, returning False if it is missing or inconsistent"""
+        try:
+            with open(self._path("meta.json")) as f:
+                meta = json.load(f)
+            with open(self._path("vocab.json")) as f:
+                vocabulary = json.load(f)
+            idf = np.load(self._path("idf.npy"))
+            matrix = scipy.sparse.load_npz(self._path("matrix.npz")).tocsr()
+            ids = np.load(self._path("ids.npy"))
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+            # Missing, or cut short by a writer that died
+            return False
+
+        # Files are replaced one at a time, so make sure they belong together
+        if matrix.shape != (len(ids), len(vocabulary)) or len(idf) != len(vocabulary):
+            return False
+        if len(ids) and int(ids[-1]) != meta["last_id"]:
+            return False
+
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.matrix = matrix
+        self.ids = ids
+        self.meta = meta
+        self.dirty = False
+        return True
+
+    def save(self):
+        """Write the index to disk if it changed"""
+        if not self.dirty:
+            return
+        os.makedirs(self.index_dir, exist_ok=True)
+
+        replace_file(self._path("vocab.json"), lambda f: f.write(json.dumps(self.vocabulary).encode()))
+        replace_file(self._path("idf.npy"), lambda f: np.save(f, self.idf))
+        replace_file(self._path("matrix.npz"), lambda f: scipy.sparse.save_npz(f, self.matrix))
+        replace_file(self._path("ids.npy"), lambda f: np.save(f, self.ids))
+        replace_file(self._path("meta.json"), lambda f: f.write(json.dumps(self.meta).encode()))
+        self.dirty = False
+
+    def fit(self, ids, texts):
+        """Fit the vocabulary and IDF weights on the full history"""
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        vectorizer = TfidfVectorizer(stop_words='english', dtype=np.float32)
+        self.matrix = vectorizer.fit_transform(texts).tocsr()
+        self.vocabulary = {term: int(col) for term, col in vectorizer.vocabulary_.items()}
+        self.idf = vectorizer.idf_
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.meta = {
+            "fitted_rows": len(ids),
+            "appended_rows": 0,
+            "last_id": int(self.ids[-1]) if len(ids) else 0,
+            "fitted_at": int(time.time()),
+        }
+        self.dirty = True
+
+    def append(self, ids, texts):
+        """Add new command texts using the current vocabulary and IDF weights"""
+        if not ids:
+            return
+        new_rows = transform(self.vocabulary, self.idf, texts)
+        self.matrix = scipy.sparse.vstack([self.matrix, new_rows], format='csr')
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        self.meta["appended_rows"] += len(ids)
+        self.meta["last_id"] = int(self.ids[-1])
+        self.dirty = True
+
+    def needs_refit(self):
+        """Check whether the IDF weights are due for a refresh"""
+        if self.vocabulary is None:
+            return True
+        appended = self.meta["appended_rows"]
+        if appended == 0:
+            return False
+        if appended > REFRESH_RATIO * max(self.meta["fitted_rows"], 1):
+            return True
+        return time.time() - self.meta["fitted_at"] > REFRESH_SECONDS
+
+    def scores(self, query, rows=None):
+        """Return the cosine similarity of the query to every indexed command
+        text, or to those at positions `rows`"""
+        query_vector = transform(self.vocabulary, self.idf, [query])
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        # Rows are L2-normalised, so one sparse product gives cosine similarity
+        return (matrix @ query_vector.T).toarray().ravel()
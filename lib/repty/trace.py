@@ -0,0 +1,219 @@
+"""Per-stage timing for searches, embedding runs and logging.
+
+Tracing is off unless REPTY_TRACE is set or the script is run with
+--timings. Then every stage of the run (imports, loading rows, fitting,
+encoding, scoring, boosting, rendering, ...) is timed with a monotonic
+clock, together with the rows it handled, and a summary with the peak
+memory of the process is printed to stderr when the run finishes:
+
+    REPTY_TRACE=1 repty nlp "restart the redis container"
+    python3 lib/semantic_search.py --timings "restart the redis container"
+
+With REPTY_TRACE=db the stages are also appended to the metrics table of
+the database, one row per stage plus a "total" row per run, so latency
+can be followed over time:
+
+    python3 -m repty.trace report [name]
+
+prints p50/p90/p99 per script and stage.
+"""
+import os
+import sys
+import json
+import math
+import time
+import resource
+
+def trace_mode(argv=None):
+    """Return the trace mode ('', 'stderr' or 'db') and argv without --timings"""
+    argv = list(sys.argv if argv is None else argv)
+    mode = os.environ.get('REPTY_TRACE', '').strip().lower()
+    if mode in ('', '0', 'off', 'no', 'false'):
+        mode = ''
+    elif mode != 'db':
+        mode = 'stderr'
+    if '--timings' in argv:
+        argv.remove('--timings')
+        mode = mode or 'stderr'
+    return mode, argv
+
+def peak_rss_kb():
+    """Peak resident memory of this process in KiB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux KiB
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def ensure_metrics_table(conn):
+    """Create the table trace results are appended to"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS metrics (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run TEXT,
+        ts INTEGER,
+        name TEXT,
+        stage TEXT,
+        ms REAL,
+        rows INTEGER,
+        peak_rss_kb INTEGER,
+        detail TEXT
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS metrics_name_stage ON metrics(name, stage, ms)")
+
+class Stage:
+    """One timed stage; set `rows` to record how many rows it handled"""
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+        self.rows = None
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, time.perf_counter() - self.start, self.rows)
+        return False
+
+class _NullStage:
+    """Stands in for Stage when tracing is off"""
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+class Trace:
+    """Collects the stages of one run of a script"""
+
+    def __init__(self, name, mode=''):
+        self.name = name
+        self.mode = mode
+        self.started = time.perf_counter()
+        # [stage, seconds, rows] in the order stages finished; repeated
+        # stages (one per batch) are summed
+        self.stages = []
+        self._by_name = {}
+        self.detail = {}
+
+    @property
+    def enabled(self):
+        return bool(self.mode)
+
+    def stage(self, name):
+        """Context manager timing one stage"""
+        if not self.mode:
+            return _NULL_STAGE
+        return Stage(self, name)
+
+    def add(self, name, seconds, rows=None):
+        """Record time spent in a stage"""
+        entry = self._by_name.get(name)
+        if entry is None:
+            entry = self._by_name[name] = [name, 0.0, None]
+            self.stages.append(entry)
+        entry[1] += seconds
+        if rows is not None:
+            entry[2] = (entry[2] or 0) + rows
+
+    def note(self, **detail):
+        """Attach extra values (backend, query length, ...) to the run"""
+        if self.mode:
+            self.detail.update(detail)
+
+    def finish(self, db_path=None):
+        """Print the summary and, with REPTY_TRACE=db, store it"""
+        if not self.mode:
+            return
+        total = time.perf_counter() - self.started
+        peak = peak_rss_kb()
+
+        print(f"[trace] {self.name}: {total * 1000:.1f} ms total, peak RSS {peak / 1024:.1f} MB", file=sys.stderr)
+        for name, seconds, rows in self.stages:
+            rows_text = f"  {rows} rows" if rows is not None else ""
+            print(f"[trace]   {name:<16} {seconds * 1000:>9.1f} ms{rows_text}", file=sys.stderr)
+        if self.detail:
+            print(f"[trace]   {json.dumps(self.detail, sort_keys=True)}", file=sys.stderr)
+
+        if self.mode == 'db':
+            try:
+                self._store(db_path, total, peak)
+            except Exception as e:
+                print(f"[trace] could not store metrics: {e}", file=sys.stderr)
+
+    def _store(self, db_path, total, peak):
+        import sqlite3
+        from repty import get_db_path
+
+        run = f"{time.time_ns()}.{os.getpid()}"
+        now = int(time.time())
+        detail = json.dumps(self.detail, sort_keys=True) if self.detail else None
+        rows = [(run, now, self.name, name, seconds * 1000, count, peak, None)
+                for name, seconds, count in self.stages]
+        rows.append((run, now, self.name, "total", total * 1000, None, peak, detail))
+
+        conn = sqlite3.connect(db_path or get_db_path(), timeout=1)
+        try:
+            ensure_metrics_table(conn)
+            with conn:
+                conn.executemany('''
+                INSERT INTO metrics (run, ts, name, stage, ms, rows, peak_rss_kb, detail)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+        finally:
+            conn.close()
+
+def start(name, argv=None):
+    """Return (trace, argv without --timings) for a script"""
+    mode, argv = trace_mode(argv)
+    return Trace(name, mode), argv
+
+NULL_TRACE = Trace("null")
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+def report(conn, name=None):
+    """Print latency percentiles per script and stage"""
+    ensure_metrics_table(conn)
+    sql = "SELECT name, stage, ms FROM metrics"
+    params = ()
+    if name:
+        sql += " WHERE name = ?"
+        params = (name,)
+    timings = {}
+    for script, stage, ms in conn.execute(sql + " ORDER BY name, stage, ms", params):
+        timings.setdefault((script, stage), []).append(ms)
+
+    if not timings:
+        print("No metrics recorded yet; run a search with REPTY_TRACE=db")
+        return
+    print(f"{'script':<20} {'stage':<16} {'runs':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}")
+    for (script, stage), values in sorted(timings.items(), key=lambda item: (item[0][0], item[0][1] != "total")):
+        print(f"{script:<20} {stage:<16} {len(values):>6} {percentile(values, 0.5):>9.1f} "
+              f"{percentile(values, 0.9):>9.1f} {percentile(values, 0.99):>9.1f}")
+
+def main():
+    if sys.argv[1:2] != ['report']:
+        print("Usage: python3 -m repty.trace report [name]", file=sys.stderr)
+        return 1
+    from repty.db import connect
+    conn = connect()
+    try:
+        report(conn, sys.argv[2] if len(sys.argv) > 2 else None)
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""Lifecycle shared by repty's local Unix socket servers: the search daemon
+(repty.daemon) and the group-commit writer (repty.writer).
+
+Each answers one JSON request per connection, on one line each way, and
+stops on {"cmd": "shutdown"} or SIGTERM. A server class sets `stopping`
+and implements dispatch(request) and serve_until_stopped(); this module
+starts it in the foreground or detached, with a pid file next to the
+socket and a log file when detached, and cleans both up when it exits.
+"""
+import sys
+import os
+import json
+import signal
+import socket
+import socketserver
+
+def send_request(socket_path, request, timeout=30):
+    """Send one JSON request to a server and return the decoded response"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(request) + "\n").encode())
+        with sock.makefile('rb') as reader:
+            return json.loads(reader.readline())
+    finally:
+        sock.close()
+
+def is_running(socket_path):
+    """Check whether a server is answering on the socket"""
+    try:
+        return send_request(socket_path, {"cmd": "ping"}, timeout=2).get("ok", False)
+    except (OSError, ValueError):
+        return False
+
+class JsonHandler(socketserver.StreamRequestHandler):
+    """Answer a single JSON request per connection"""
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            response = self.server.dispatch(request)
+        except Exception as e:
+            response = {"ok": False, "error": str(e)}
+        self.wfile.write((json.dumps(response) + "\n").encode())
+
+def serve(name, socket_path, make_server):
+    """Run the server make_server() creates in the foreground until it is asked to stop"""
+    if os.path.exists(socket_path):
+        if is_running(socket_path):
+            print(f"{name} already running on {socket_path}", file=sys.stderr)
+            return 1
+        # Remove a stale socket left behind by a server that died
+        os.unlink(socket_path)
+
+    server = make_server()
+    os.chmod(socket_path, 0o600)
+    with open(socket_path + ".pid", "w") as f:
+        f.write(str(os.getpid()))
+
+    def stop(signum, frame):
+        server.stopping = True
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        server.serve_until_stopped()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for path in (socket_path, socket_path + ".pid"):
+            if os.path.exists(path):
+                os.unlink(path)
+    return 0
+
+def start(name, socket_path, make_server):
+    """Start the server in the background"""
+    if is_running(socket_path):
+        print(f"{name} already running on {socket_path}")
+        return 0
+
+    log_path = socket_path + ".log"
+    if os.fork() > 0:
+        print(f"{name} starting on {socket_path} (log: {log_path})")
+        return 0
+
+    # Detach from the terminal so the server outlives the shell
+    os.setsid()
+    if os.fork() > 0:
+        os._exit(0)
+    with open(os.devnull, "rb") as devnull:
+        os.dup2(devnull.fileno(), 0)
+    with open(log_path, "ab") as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+    os._exit(serve(name, socket_path, make_server))
+
+def stop(name, socket_path):
+    """Ask a running server to exit"""
+    if not is_running(socket_path):
+        print(f"{name} is not running")
+        return 1
+    send_request(socket_path, {"cmd": "shutdown"})
+    print(f"{name} stopped")
+    return 0
+
+def ping(name, socket_path):
+    """Return the server's answer to a ping, or None after saying it is not running"""
+    try:
+        return send_request(socket_path, {"cmd": "ping"}, timeout=2)
+    except (OSError, ValueError):
+        print(f"{name} is not running")
+        return None
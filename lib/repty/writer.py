@@ -0,0 +1,210 @@
+"""Single local writer that group-commits the commands logged by every shell.
+
+With REPTY_LOG_MODE=direct every prompt runs `repty log`, and with many
+shells open each one opens the database and commits its own transaction,
+so the commits queue up for the write lock one fsync at a time. The writer
+owns one connection instead: `repty log` hands it the row over a Unix
+socket, and the rows that arrive while a transaction is committing all go
+into the next one. A shell is only answered once its row is committed.
+
+Nothing depends on it running: `repty log` writes to the database itself
+when the socket is missing or the writer fails, and appends to the spool
+when the database stays locked for longer than REPTY_BUSY_TIMEOUT, so a
+command is never dropped.
+
+Usage:
+    python3 -m repty.writer start|stop|status
+    python3 -m repty.writer serve             # run in the foreground
+"""
+import sys
+import os
+import queue
+import sqlite3
+import threading
+import socketserver
+
+from repty import get_db_path, unix_server
+from repty.db import busy_timeout, connect
+from repty.embed_worker import maybe_start
+from repty.history import ensure_history_schema, record_commands
+from repty.unix_server import JsonHandler, send_request
+
+NAME = "Writer"
+
+# Rows committed together at most, so one transaction stays short
+MAX_GROUP = 1000
+
+def get_socket_path():
+    """Return the writer socket path from the environment or the default"""
+    return os.environ.get('REPTY_WRITER_SOCKET', os.path.expanduser('~/.repty-writer.sock'))
+
+def send_rows(rows, db_path=None, timeout=None):
+    """Have a running writer commit commands table rows, returning whether it did"""
+    socket_path = get_socket_path()
+    if not os.path.exists(socket_path):
+        return False
+    db_path = db_path or get_db_path()
+    try:
+        # The writer gives up after busy_seconds(), or finishes a commit it
+        # has started within the busy timeout, so it always answers first
+        response = send_request(socket_path, {"cmd": "log", "db": db_path, "rows": rows},
+                                timeout=timeout or 2 * busy_seconds())
+    except (OSError, ValueError):
+        return False
+    return response.get("ok", False)
+
+def busy_seconds():
+    """How long a client waits for its commit before writing the rows itself"""
+    return 2 * max(1.0, busy_timeout())
+
+class Pending:
+    """Rows from one client, waiting for the transaction that commits them"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.done = threading.Event()
+        self.response = None
+        # Set by the committer once the rows are in a transaction, or by the
+        # handler when it gives up, whichever comes first
+        self.claimed = False
+        self.cancelled = False
+
+class WriterServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server whose committer thread owns the only connection"""
+
+    daemon_threads = True
+    # Every open shell may connect at the same prompt
+    request_queue_size = 128
+
+    def __init__(self, socket_path, db_path):
+        self.db_path = db_path
+        self.stopping = False
+        self.pending = queue.Queue()
+        self.claim_lock = threading.Lock()
+        self.commits = 0
+        self.committed = 0
+
+        # Fail before serving when the database cannot be opened
+        conn = connect(db_path)
+        try:
+            ensure_history_schema(conn)
+        finally:
+            conn.close()
+        self.committer = threading.Thread(target=self.commit_loop, daemon=True)
+
+        super().__init__(socket_path, JsonHandler)
+        # Wake up every second to check the stop flag
+        self.timeout = 1
+        self.committer.start()
+
+    def dispatch(self, request):
+        cmd = request.get("cmd")
+        if cmd == "ping":
+            return {"ok": True, "commits": self.commits, "rows": self.committed}
+        if cmd == "shutdown":
+            self.stopping = True
+            return {"ok": True}
+        if cmd != "log":
+            return {"ok": False, "error": f"Unknown command: {cmd}"}
+
+        # Refuse rows meant for a different database; the client writes them itself
+        if os.path.realpath(request.get("db", self.db_path)) != os.path.realpath(self.db_path):
+            return {"ok": False, "error": "Writer is serving a different database"}
+
+        pending = Pending([tuple(row) for row in request["rows"]])
+        self.pending.put(pending)
+        if not pending.done.wait(busy_seconds()):
+            with self.claim_lock:
+                if not pending.claimed:
+                    # Never commit them now: the client writes the rows itself
+                    pending.cancelled = True
+                    return {"ok": False, "error": "Timed out waiting for the commit"}
+            pending.done.wait()
+        return pending.response
+
+    def commit_loop(self):
+        """Commit whatever is queued in one transaction, until shut down"""
+        conn = connect(self.db_path)
+        while True:
+            pending = self.pending.get()
+            if pending is None:
+                break
+            # Everything that queued up during the last commit goes into this one
+            group = []
+            rows = 0
+            while pending is not None:
+                with self.claim_lock:
+                    if not pending.cancelled:
+                        pending.claimed = True
+                        group.append(pending)
+                        rows += len(pending.rows)
+                if rows >= MAX_GROUP:
+                    break
+                try:
+                    pending = self.pending.get_nowait()
+                except queue.Empty:
+                    break
+                if pending is None:
+                    self.pending.put(None)
+            if not group:
+                continue
+
+            try:
+                with conn:
+                    record_commands(conn, [row for pending in group for row in pending.rows])
+                response = {"ok": True, "group": rows}
+                self.commits += 1
+                self.committed += rows
+            except sqlite3.Error as e:
+                response = {"ok": False, "error": str(e)}
+            for pending in group:
+                pending.response = response
+                pending.done.set()
+
+            if self.pending.empty():
+                try:
+                    maybe_start(conn, self.db_path)
+                except sqlite3.Error:
+                    pass
+        conn.close()
+
+    def serve_until_stopped(self):
+        while not self.stopping:
+            self.handle_request()
+        self.pending.put(None)
+        self.committer.join()
+
+def status(socket_path):
+    """Print whether the writer is running and how much it has committed"""
+    info = unix_server.ping(NAME, socket_path)
+    if info is None:
+        return 1
+    print(f"{NAME} running on {socket_path} ({info['rows']} commands in {info['commits']} commits)")
+    return 0
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__.strip().split("Usage:")[1])
+        return 1
+
+    socket_path = get_socket_path()
+    db_path = get_db_path()
+    action = sys.argv[1]
+
+    def make_server():
+        return WriterServer(socket_path, db_path)
+
+    if action == "start":
+        return unix_server.start(NAME, socket_path, make_server)
+    if action == "serve":
+        return unix_server.serve(NAME, socket_path, make_server)
+    if action == "stop":
+        return unix_server.stop(NAME, socket_path)
+    if action == "status":
+        return status(socket_path)
+
+    print(f"Unknown writer command: {action}", file=sys.stderr)
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,8 @@
 #!/bin/bash
+# Show command statistics (repty.stats), read from rollup tables kept up to
+# date as commands are recorded, so the time does not grow with the history.
+# Usage: stats.sh [--limit N] [--project NAME] [--cwd DIR] [--rebuild]
 
-DB="$HOME/.repty.db"
+REPTY_LIB_DIR="$(dirname "$(realpath "$0")")"
 
-echo "Repty Stats"
-echo "-----------------------"
-
-sqlite3 -cmd ".mode column" -cmd ".headers on" "$DB" <<'EOF'
-SELECT COUNT(*) AS "Total Commands" FROM commands;
-
-SELECT command AS "Command", COUNT(*) as "Count"
-FROM commands
-GROUP BY command
-ORDER BY Count DESC
-LIMIT 10;
-
-SELECT strftime('%Y-%m-%d', timestamp) AS "Date", COUNT(*) AS "Commands"
-FROM commands
-GROUP BY Date
-ORDER BY Date DESC
-LIMIT 5;
-EOF
+PYTHONPATH="$REPTY_LIB_DIR" exec python3 -m repty.stats "$@"
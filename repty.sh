@@ -3,11 +3,61 @@
 # Check if REPTY_DIR is set, if not, default to ~/.repty
 REPTY_DIR="${REPTY_DIR:-$HOME/.repty}"
 REPTY_DB="${REPTY_DB:-$HOME/.repty.db}"
-REPTY_HISTORY_FILE="${REPTY_HISTORY_FILE:-$HOME/.zsh_history}"
+# Shell history read by `repty import`
+export REPTY_HISTORY_FILE="${REPTY_HISTORY_FILE:-$HOME/.zsh_history}"
 
 # Path to the SQLite database
 DB_PATH="$REPTY_DB"
 
+# spool: append each command to a spool file that is ingested in batches
+# direct: insert each command into the database as it finishes, through
+#         `repty writer` when it is running, so many shells share one commit
+REPTY_LOG_MODE="${REPTY_LOG_MODE:-spool}"
+REPTY_SPOOL="${REPTY_SPOOL:-$REPTY_DB.spool}"
+# Ingest the spool in the background after this many prompts (0 to disable)
+REPTY_SPOOL_FLUSH_EVERY="${REPTY_SPOOL_FLUSH_EVERY:-50}"
+REPTY_SPOOL_COUNT=0
+
+# One session ID per shell, generated once rather than on every prompt
+REPTY_SESSION_ID="$(uuidgen 2>/dev/null || echo "session-$$-$(date +%s)")"
+
+# zsh provides EPOCHSECONDS through a module; bash 5 has it built in
+if [ -n "$ZSH_VERSION" ]; then
+    zmodload -F zsh/datetime p:EPOCHSECONDS p:EPOCHREALTIME 2>/dev/null
+fi
+
+# Append a command to the spool using builtins only, so the prompt never forks
+spool_command() {
+    local COMMAND="$1"
+    local CODE="$2"
+    local CWD="$PWD"
+    local NOW="$EPOCHSECONDS"
+    local TAB=$'\t' NL=$'\n' BS='\'
+
+    if [ -z "$NOW" ]; then
+        printf -v NOW '%(%s)T' -1
+    fi
+
+    # Escape the field separators; the ingester undoes this
+    COMMAND="${COMMAND//"$BS"/"$BS$BS"}"
+    COMMAND="${COMMAND//"$TAB"/"${BS}t"}"
+    COMMAND="${COMMAND//"$NL"/"${BS}n"}"
+    CWD="${CWD//"$BS"/"$BS$BS"}"
+    CWD="${CWD//"$TAB"/"${BS}t"}"
+    CWD="${CWD//"$NL"/"${BS}n"}"
+
+    builtin printf '%s\t%s\t%s\t%s\t%s\n' "$NOW" "$REPTY_SESSION_ID" "$CODE" "$CWD" "$COMMAND" >> "$REPTY_SPOOL"
+
+    # Hand the batch to the ingester every REPTY_SPOOL_FLUSH_EVERY prompts
+    if [ "$REPTY_SPOOL_FLUSH_EVERY" -gt 0 ]; then
+        REPTY_SPOOL_COUNT=$((REPTY_SPOOL_COUNT + 1))
+        if [ "$REPTY_SPOOL_COUNT" -ge "$REPTY_SPOOL_FLUSH_EVERY" ]; then
+            REPTY_SPOOL_COUNT=0
+            ( "$REPTY_DIR/bin/repty" ingest >/dev/null 2>&1 & )
+        fi
+    fi
+}
+
 # Function to log commands to database
 log_command() {
     local COMMAND="$1"
@@ -23,13 +73,18 @@ log_command() {
         return
     fi
     
+    if [ "$REPTY_LOG_MODE" = "spool" ]; then
+        spool_command "$COMMAND" "$CODE"
+        return
+    fi
+
     # Use the repty command-line tool to log the command with keyword extraction
-    "$REPTY_DIR/bin/repty" log "$CODE" "$COMMAND"
+    REPTY_SESSION_ID="$REPTY_SESSION_ID" "$REPTY_DIR/bin/repty" log "$CODE" "$COMMAND"
 }
 
 # Function to be called when a command is about to be executed
 preexec() {
-    REPTY_COMMAND_START=$(date +%s.%N)
+    REPTY_COMMAND_START="$EPOCHREALTIME"
     REPTY_CURRENT_COMMAND="$1"
 }
 
@@ -2,9 +2,16 @@
 
 echo "Removing Repty..."
 
+# Stop the search daemon if it is running
+if [ -f "$HOME/.repty.sock.pid" ]; then
+  kill "$(cat "$HOME/.repty.sock.pid")" 2>/dev/null
+fi
+
 rm -rf "$HOME/.repty"
 rm -f "$HOME/repty_history.md"
-rm -f "$HOME/.repty.db"
+rm -f "$HOME/.repty.db" "$HOME"/.repty.db.spool*
+rm -rf "$HOME/.repty.db.index"
+rm -f "$HOME/.repty.sock" "$HOME/.repty.sock.pid" "$HOME/.repty.sock.log"
 
 if [ -f "$HOME/.zshrc" ]; then
   echo "Cleaning up .zshrc..."